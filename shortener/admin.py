@@ -1,9 +1,48 @@
 from django.contrib import admin
-from .models import URL
+from .cache import redirect_cache
+from .models import URL, ArchivedURL
+from .reputation import ACTIVE, DISABLED, set_status
+from .search import EstimatedCountPaginator, search_urls
 
 class URLAdmin(admin.ModelAdmin):
-    list_display = ('short_code', 'original_url', 'created_at')
+    list_display = ('short_code', 'original_url', 'domain', 'created_at', 'expires_at', 'status')
+    list_filter = ('status',)
+    # Searches are answered by get_search_results(); see shortener/search.py
     search_fields = ('short_code', 'original_url')
-    readonly_fields = ('created_at',)
+    search_help_text = (
+        "Short code prefix, domain (evil.example), full URL, or code:, domain:, text: "
+        "to choose. Text searches may only cover recent links."
+    )
+    readonly_fields = ('created_at', 'checked_at', 'domain')
+    actions = ['disable_links', 'activate_links']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
-admin.site.register(URL, URLAdmin)
\ No newline at end of file
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return search_urls(queryset, search_term), False
+
+    @admin.action(description="Disable selected links")
+    def disable_links(self, request, queryset):
+        updated = set_status(queryset, DISABLED, f"Disabled by {request.user}")
+        self.message_user(request, f"Disabled {updated} links.")
+
+    @admin.action(description="Activate selected links")
+    def activate_links(self, request, queryset):
+        updated = set_status(queryset, ACTIVE)
+        self.message_user(request, f"Activated {updated} links.")
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Status or target edits must not wait for cache entries to expire
+        redirect_cache.delete(obj.short_code)
+
+class ArchivedURLAdmin(admin.ModelAdmin):
+    list_display = ('short_code', 'original_url', 'created_at', 'expires_at', 'archived_at', 'status')
+    list_filter = ('created_month', 'status')
+    search_fields = ('short_code', 'original_url')
+    readonly_fields = ('created_at', 'created_month', 'archived_at')
+
+admin.site.register(URL, URLAdmin)
+admin.site.register(ArchivedURL, ArchivedURLAdmin)
\ No newline at end of file
@@ -0,0 +1,275 @@
+"""
+Offline analytics over link creation and click history.
+
+`manage.py analytics` streams URL and ClickCount rows in chunks into
+columnar NumPy arrays (strings such as domains and IPs are interned to
+integer ids as they arrive), aggregates them with vectorized operations and
+writes two files to SHORTENER_ANALYTICS['OUTPUT_DIR']:
+
+  analytics.npz   the columns themselves, for ad hoc analysis
+  summary.json    the aggregates served by the staff dashboard at /_/analytics
+
+NumPy is only imported by the command; the dashboard reads the JSON.
+"""
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .normalize import normalize_url
+
+DEFAULT_ANALYTICS = {
+    'OUTPUT_DIR': None,          # defaults to BASE_DIR / 'analytics'
+    'BUCKET_SECONDS': 86400,     # width of the creation and click time series
+    'TOP': 50,                   # rows in each top-N table
+    'CHUNK_SIZE': 20000,         # rows fetched per database round trip
+}
+
+SUMMARY_FILE = 'summary.json'
+ARRAYS_FILE = 'analytics.npz'
+
+
+def get_config():
+    config = dict(DEFAULT_ANALYTICS, **getattr(settings, 'SHORTENER_ANALYTICS', {}))
+    if config['OUTPUT_DIR'] is None:
+        config['OUTPUT_DIR'] = os.path.join(settings.BASE_DIR, 'analytics')
+    return config
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImproperlyConfigured("Analytics need NumPy; pip install numpy")
+    return numpy
+
+
+class Interner:
+    """Maps strings to dense integer ids, in order of first appearance."""
+
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def __call__(self, value):
+        index = self.ids.get(value)
+        if index is None:
+            index = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+
+class ColumnBuilder:
+    """Appends rows chunk by chunk and concatenates them into arrays once."""
+
+    def __init__(self, dtypes):
+        self.dtypes = dtypes
+        self.chunks = {name: [] for name in dtypes}
+
+    def add_chunk(self, columns):
+        np = _numpy()
+        for name, values in columns.items():
+            self.chunks[name].append(np.asarray(values, dtype=self.dtypes[name]))
+
+    def build(self):
+        np = _numpy()
+        return {
+            name: np.concatenate(chunks) if chunks else np.empty(0, dtype=self.dtypes[name])
+            for name, chunks in self.chunks.items()
+        }
+
+
+def _url_key(original_url, url_hash):
+    """A 64-bit key of the normalized URL; the stored digest when there is one."""
+    if url_hash:
+        return int(url_hash[:16], 16)
+    digest = hashlib.sha256(normalize_url(original_url).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+
+def load_urls(chunk_size):
+    """Stream the URL table into columns. Returns (columns, domains, ips)."""
+    from .models import URL
+
+    domains, ips = Interner(), Interner()
+    builder = ColumnBuilder({'created': 'int64', 'domain': 'int32', 'ip': 'int32', 'url_key': 'uint64'})
+    rows = (
+        URL.objects.order_by('id')
+        .values_list('created_at', 'ip_address', 'original_url', 'url_hash')
+        .iterator(chunk_size=chunk_size)
+    )
+    chunk = {'created': [], 'domain': [], 'ip': [], 'url_key': []}
+    for created_at, ip_address, original_url, url_hash in rows:
+        chunk['created'].append(int(created_at.timestamp()))
+        chunk['domain'].append(domains((urlsplit(original_url).hostname or '').removeprefix('www.')))
+        chunk['ip'].append(ips(ip_address) if ip_address else -1)
+        chunk['url_key'].append(_url_key(original_url, url_hash))
+        if len(chunk['created']) >= chunk_size:
+            builder.add_chunk(chunk)
+            chunk = {name: [] for name in chunk}
+    builder.add_chunk(chunk)
+    return builder.build(), domains.values, ips.values
+
+
+def load_clicks(chunk_size):
+    """Stream ClickCount into columns. Returns (columns, short_codes)."""
+    from .models import ClickCount
+
+    codes = Interner()
+    builder = ColumnBuilder({'bucket': 'int64', 'code': 'int32', 'clicks': 'int64'})
+    rows = (
+        ClickCount.objects.order_by('id')
+        .values_list('bucket', 'short_code', 'clicks')
+        .iterator(chunk_size=chunk_size)
+    )
+    chunk = {'bucket': [], 'code': [], 'clicks': []}
+    for bucket, short_code, clicks in rows:
+        chunk['bucket'].append(int(bucket.timestamp()))
+        chunk['code'].append(codes(short_code))
+        chunk['clicks'].append(clicks)
+        if len(chunk['bucket']) >= chunk_size:
+            builder.add_chunk(chunk)
+            chunk = {name: [] for name in chunk}
+    builder.add_chunk(chunk)
+    return builder.build(), codes.values
+
+
+def time_series(timestamps, bucket_seconds, weights=None):
+    """Return [[bucket start (ISO), total], ...] for the non-empty buckets."""
+    np = _numpy()
+    if not len(timestamps):
+        return []
+    buckets = timestamps // bucket_seconds
+    keys, inverse = np.unique(buckets, return_inverse=True)
+    totals = np.bincount(inverse, weights=weights, minlength=len(keys))
+    return [
+        [datetime.fromtimestamp(int(key) * bucket_seconds, dt_timezone.utc).isoformat(), int(total)]
+        for key, total in zip(keys, totals)
+    ]
+
+
+def top_counts(ids, labels, top, weights=None):
+    """Return the top ids by count (or summed weights) as (label, total, id) triples."""
+    np = _numpy()
+    valid = ids >= 0
+    ids = ids[valid]
+    if weights is not None:
+        weights = weights[valid]
+    if not len(ids):
+        return [], np.zeros(len(labels))
+    totals = np.bincount(ids, weights=weights, minlength=len(labels))
+    order = np.argsort(totals)[::-1][:top]
+    return [(labels[i], int(totals[i]), int(i)) for i in order if totals[i]], totals
+
+
+def summarize(urls, domains, ips, clicks, codes, bucket_seconds, top):
+    """Aggregate the columns into the JSON-serializable dashboard summary."""
+    np = _numpy()
+    rows = len(urls['created'])
+
+    # Duplicates: rows whose normalized URL occurs more than once
+    if rows:
+        _, inverse, counts = np.unique(urls['url_key'], return_inverse=True, return_counts=True)
+        duplicate = counts[inverse] > 1
+        unique_urls = len(counts)
+    else:
+        duplicate, unique_urls = np.zeros(0, dtype=bool), 0
+
+    top_domains, domain_totals = top_counts(urls['domain'], domains, top)
+    domain_duplicates = np.bincount(urls['domain'], weights=duplicate, minlength=len(domains))
+    top_ips, _ = top_counts(urls['ip'], ips, top)
+
+    # Busiest single time bucket per IP: one key per (ip, bucket) pair
+    peak_ips = []
+    has_ip = urls['ip'] >= 0
+    if has_ip.any():
+        buckets = urls['created'][has_ip] // bucket_seconds
+        span = int(buckets.max() - buckets.min()) + 1
+        pair_keys, pair_counts = np.unique(
+            urls['ip'][has_ip].astype('int64') * span + (buckets - buckets.min()), return_counts=True)
+        peaks = np.zeros(len(ips), dtype='int64')
+        np.maximum.at(peaks, pair_keys // span, pair_counts)
+        order = np.argsort(peaks)[::-1][:top]
+        peak_ips = [{'ip': ips[i], 'peak': int(peaks[i])} for i in order if peaks[i]]
+
+    top_codes, _ = top_counts(clicks['code'], codes, top, weights=clicks['clicks'])
+    return {
+        'generated_at': datetime.now(dt_timezone.utc).isoformat(),
+        'bucket_seconds': bucket_seconds,
+        'urls': rows,
+        'unique_urls': unique_urls,
+        'duplicate_ratio': round(1 - unique_urls / rows, 4) if rows else 0.0,
+        'domains': len(domains),
+        'ips': len(ips),
+        'created_per_bucket': time_series(urls['created'], bucket_seconds),
+        'top_domains': [
+            {'domain': label or '(none)', 'urls': total,
+             'duplicate_ratio': round(domain_duplicates[i] / domain_totals[i], 4)}
+            for label, total, i in top_domains
+        ],
+        'top_ips': [{'ip': label, 'urls': total} for label, total, _ in top_ips],
+        'peak_ips': peak_ips,
+        'clicks': int(clicks['clicks'].sum()),
+        'clicks_per_bucket': time_series(clicks['bucket'], bucket_seconds, weights=clicks['clicks']),
+        'top_clicked': [{'short_code': label, 'clicks': total} for label, total, _ in top_codes],
+    }
+
+
+def _replace(path, write):
+    temp_path = f'{path}.tmp'
+    write(temp_path)
+    os.replace(temp_path, path)
+
+
+def run(config=None):
+    """Compute and write the arrays and summary. Returns the summary."""
+    np = _numpy()
+    config = dict(get_config(), **(config or {}))
+    started = time.monotonic()
+    urls, domains, ips = load_urls(config['CHUNK_SIZE'])
+    clicks, codes = load_clicks(config['CHUNK_SIZE'])
+    summary = summarize(urls, domains, ips, clicks, codes, config['BUCKET_SECONDS'], config['TOP'])
+    summary['seconds'] = round(time.monotonic() - started, 3)
+
+    directory = config['OUTPUT_DIR']
+    os.makedirs(directory, exist_ok=True)
+
+    def write_arrays(path):
+        with open(path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                **{f'url_{name}': column for name, column in urls.items()},
+                **{f'click_{name}': column for name, column in clicks.items()},
+                domains=np.array(domains, dtype=str), ips=np.array(ips, dtype=str),
+                short_codes=np.array(codes, dtype=str),
+            )
+
+    def write_summary(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, separators=(',', ':'))
+
+    _replace(os.path.join(directory, ARRAYS_FILE), write_arrays)
+    _replace(os.path.join(directory, SUMMARY_FILE), write_summary)
+    return summary
+
+
+_summary = (None, None)
+
+
+def read_summary(directory=None):
+    """Return the latest summary from disk, re-reading it only when it changes."""
+    global _summary
+    path = os.path.join(directory or get_config()['OUTPUT_DIR'], SUMMARY_FILE)
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+    if _summary[0] != (path, mtime):
+        with open(path, encoding='utf-8') as f:
+            _summary = ((path, mtime), json.load(f))
+    return _summary[1]
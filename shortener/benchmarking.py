@@ -0,0 +1,249 @@
+import http.client
+import io
+import itertools
+import random
+import socket
+import string
+import threading
+import time
+
+
+def percentile(sorted_values, fraction):
+    """Return the value at fraction (0-1) of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(timings):
+    """Summarize a list of per-call durations (seconds) in microseconds."""
+    timings = sorted(timings)
+    total = sum(timings)
+    return {
+        'calls': len(timings),
+        'ops_per_sec': len(timings) / total if total else 0.0,
+        'mean_us': total / len(timings) * 1e6 if timings else 0.0,
+        'p50_us': percentile(timings, 0.50) * 1e6,
+        'p90_us': percentile(timings, 0.90) * 1e6,
+        'p99_us': percentile(timings, 0.99) * 1e6,
+    }
+
+
+def time_calls(func, args_list, repeat=1):
+    """Call func(*args) for every args tuple, repeat times, and summarize the timings."""
+    timings = []
+    clock = time.perf_counter
+    for _ in range(repeat):
+        for args in args_list:
+            start = clock()
+            func(*args)
+            timings.append(clock() - start)
+    return summarize(timings)
+
+
+def random_words(count, seed=0, min_length=5, max_length=12):
+    """Return count distinct pseudo-random lowercase words."""
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        length = rng.randint(min_length, max_length)
+        words.add(''.join(rng.choice(string.ascii_lowercase) for _ in range(length)))
+    return sorted(words)
+
+
+def legacy_is_spam_url(url, spam_keywords, suspicious_tlds):
+    """The original per-keyword spam check, kept as a reference for benchmarks."""
+    url_lower = url.lower()
+    for keyword in spam_keywords:
+        if keyword in url_lower:
+            return True, f"URL contains blocked keyword: {keyword}"
+    for tld in suspicious_tlds:
+        if url_lower.endswith(tld):
+            return True, f"URL uses suspicious TLD: {tld}"
+    domain_part = url_lower.split('://', 1)[-1].split('/', 1)[0]
+    if domain_part.count('.') > 3:
+        return True, "URL contains excessive subdomains"
+    if len(url) > 1000:
+        return True, "URL is suspiciously long"
+    return False, None
+
+
+def sample_urls(count, seed=0):
+    """Return a mix of realistic clean URLs for spam-check benchmarks."""
+    rng = random.Random(seed)
+    hosts = ['example.com', 'github.com', 'docs.python.org', 'news.ycombinator.com', 'en.wikipedia.org']
+    urls = []
+    for _ in range(count):
+        path = '/'.join(
+            ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 10)))
+            for _ in range(rng.randint(1, 5))
+        )
+        urls.append(f"https://{rng.choice(hosts)}/{path}?id={rng.randint(1, 10 ** 6)}")
+    return urls
+
+
+def http_load(host, port, paths, concurrency=20, total=2000, headers=None):
+    """
+    Fire total GET requests at host:port from concurrency threads.
+
+    Every request uses a fresh connection so sync and async servers are
+    measured the same way. Returns the latency summary plus wall-clock
+    throughput and the status codes seen.
+    """
+    counter = itertools.count()
+    timings = []
+    statuses = {}
+    lock = threading.Lock()
+    clock = time.perf_counter
+
+    def worker():
+        local_timings = []
+        local_statuses = {}
+        while True:
+            index = next(counter)
+            if index >= total:
+                break
+            start = clock()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+            try:
+                conn.request('GET', paths[index % len(paths)], headers=headers or {})
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except OSError:
+                status = 'error'
+            finally:
+                conn.close()
+            local_timings.append(clock() - start)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        with lock:
+            timings.extend(local_timings)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = clock()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = clock() - started
+
+    result = summarize(timings)
+    result['requests_per_sec'] = len(timings) / elapsed if elapsed else 0.0
+    result['statuses'] = {str(status): count for status, count in statuses.items()}
+    return result
+
+
+def free_port():
+    """Return a TCP port that is free on localhost."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    """Block until something accepts connections on localhost:port."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def wsgi_environ(path, host='127.0.0.1', **extra):
+    """Build a minimal WSGI environ for an in-process GET of path."""
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': host,
+        'SERVER_PORT': '443',
+        'HTTP_HOST': host,
+        'HTTP_X_FORWARDED_PROTO': 'https',
+        'REMOTE_ADDR': '127.0.0.1',
+        'SCRIPT_NAME': '',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': io.StringIO(),
+        'wsgi.url_scheme': 'https',
+        'wsgi.version': (1, 0),
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    environ.update(extra)
+    return environ
+
+
+def call_wsgi(application, environ):
+    """Run one request through a WSGI application and return the status line."""
+    status = []
+
+    def start_response(status_line, headers, exc_info=None):
+        status.append(status_line)
+
+    # Each request needs its own (empty) input stream
+    body = application(dict(environ, **{'wsgi.input': io.BytesIO()}), start_response)
+    for _ in body:
+        pass
+    if hasattr(body, 'close'):
+        body.close()
+    return status[0]
+
+
+def seed_urls(rows, batch_size=10000, stdout=None):
+    """
+    Top the URL table up to at least rows rows of synthetic links.
+
+    Uses the configured code generator and bulk_create, so seeding millions
+    of rows takes minutes rather than hours. Returns the number of rows added.
+    """
+    from .codegen import get_code_generator
+    from .models import URL
+    from .normalize import url_digest, url_domain
+
+    existing = URL.objects.count()
+    missing = max(0, rows - existing)
+    generator = get_code_generator()
+    added = 0
+    while added < missing:
+        count = min(batch_size, missing - added)
+        codes = generator.generate_many(count)
+        urls = []
+        for offset, short_code in enumerate(codes):
+            original_url = f'https://seed.example.com/{existing + added + offset}/{short_code}'
+            urls.append(URL(
+                original_url=original_url, short_code=short_code,
+                url_hash=url_digest(original_url), domain=url_domain(original_url)))
+        URL.objects.bulk_create(urls, batch_size=1000)
+        added += count
+        if stdout is not None:
+            stdout.write(f"Seeded {existing + added}/{rows} rows")
+    return added
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Return a list of regressions of results against baseline.
+
+    Median latency may grow by the tolerance fraction, query counts may not
+    grow at all. Tail latencies are reported but too noisy to gate on.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if previous.get('p50_us') and current['p50_us'] > previous['p50_us'] * (1 + tolerance):
+            regressions.append(
+                f"{name}.p50_us: {current['p50_us']:.1f} > {previous['p50_us']:.1f}")
+        if 'queries_per_request' in current and 'queries_per_request' in previous:
+            if current['queries_per_request'] > previous['queries_per_request']:
+                regressions.append(
+                    f"{name}.queries_per_request: {current['queries_per_request']:.2f}"
+                    f" > {previous['queries_per_request']:.2f}")
+    return regressions
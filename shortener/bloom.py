@@ -0,0 +1,262 @@
+"""
+Bloom filter over existing short codes.
+
+Scanners requesting random /<short_code> paths would otherwise cost one
+database query each. The filter answers "definitely not a short code" from
+memory, so those requests 404 without touching the database; a "maybe" still
+goes to the database as before.
+"""
+import atexit
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOOM_FILTER = {
+    'ENABLED': None,             # None: only when the redirect cache is shared between workers
+    'ERROR_RATE': 0.001,         # target false-positive rate at capacity
+    'CAPACITY_FACTOR': 2.0,      # capacity as a multiple of the rows at build time
+    'MIN_CAPACITY': 100000,
+    'REFRESH_INTERVAL': 5,       # seconds between adds of newly created rows
+    'REFRESH_OVERLAP': 60,       # seconds each refresh reaches back before the previous one
+    'REBUILD_INTERVAL': 3600,    # seconds between full rebuilds
+}
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter sized for capacity items at error_rate.
+
+    Bit positions come from one blake2b digest split into two 64-bit hashes
+    (h1 + i * h2), so adding or probing a key costs a single hash call.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(1, int(capacity))
+        self.error_rate = error_rate
+        self.bits = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / self.capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in range(self.hashes)]
+
+    def add(self, key):
+        array = self.array
+        for position in self._positions(key):
+            array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        array = self.array
+        for position in self._positions(key):
+            if not array[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+    def estimated_error_rate(self):
+        """False-positive rate expected for the number of items added so far."""
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+    def stats(self):
+        return {
+            'items': self.count,
+            'capacity': self.capacity,
+            'bits': self.bits,
+            'hashes': self.hashes,
+            'memory_bytes': len(self.array),
+            'estimated_error_rate': self.estimated_error_rate(),
+        }
+
+
+class CodeFilter:
+    """
+    The process-wide filter over URL.short_code, kept current in the background.
+
+    Until the first build completes every code is reported as possibly
+    present, so lookups behave exactly as without a filter. Codes created by
+    this worker are added immediately; codes created elsewhere are picked up
+    every REFRESH_INTERVAL seconds by reading rows written (URL.updated_at)
+    since the previous refresh, less REFRESH_OVERLAP seconds: the timestamp is
+    taken before a row commits, so rows that commit late are still seen. In
+    between, the write-through to the shared redirect cache on creation is
+    what keeps other workers from rejecting a brand new code. That only works
+    if the cache really is shared, so by default the filter is off when the
+    redirect cache is per process (LocMemCache). The filter is rebuilt from
+    scratch every REBUILD_INTERVAL seconds, or sooner once it fills up.
+    """
+
+    def __init__(self, config=None):
+        self.config = dict(DEFAULT_BLOOM_FILTER, **(config or {}))
+        self.filter = None
+        self.since = None
+        self.built_at = None
+        self.rejected = 0
+        self.builds = 0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.filter is not None
+
+    def enabled(self):
+        """Whether start() runs the filter: ENABLED, or if unset, whether the redirect cache is shared."""
+        if self.config['ENABLED'] is not None:
+            return self.config['ENABLED']
+        from django.core.cache.backends.dummy import DummyCache
+        from django.core.cache.backends.locmem import LocMemCache
+
+        from .cache import redirect_cache
+
+        shared = redirect_cache.shared
+        return shared is not None and not isinstance(shared, (LocMemCache, DummyCache))
+
+    def might_contain(self, short_code):
+        """Return False only if short_code certainly does not exist."""
+        bloom = self.filter
+        if bloom is None or short_code in bloom:
+            return True
+        self.rejected += 1
+        return False
+
+    def add(self, short_code):
+        bloom = self.filter
+        if bloom is not None:
+            with self._lock:
+                bloom.add(short_code)
+
+    def _new_filter(self, rows):
+        return BloomFilter(
+            max(self.config['MIN_CAPACITY'], rows * self.config['CAPACITY_FACTOR']),
+            self.config['ERROR_RATE'],
+        )
+
+    def build(self):
+        """Build a new filter from the snapshot, if any, and the database."""
+        from .models import URL, ArchivedURL
+        from .reputation import PENDING
+        from .retention import archive_lookups_enabled
+        from .snapshot import get_config as get_snapshot_config, get_snapshot_store
+
+        store = get_snapshot_store()
+        if store is not None and not get_snapshot_config()['FALLBACK_TO_DATABASE']:
+            return None  # Codes missing from the snapshot never reach the database anyway
+
+        # Taken first, so refreshes pick up anything committed during the build
+        since = timezone.now()
+        max_id = URL.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        bloom = self._new_filter(max(max_id, len(store) if store is not None else 0))
+        rows = URL.objects.all()
+        if store is not None:
+            for entry in store.base:
+                bloom.add(entry[0])
+            for delta in store.deltas:
+                for entry in delta:
+                    bloom.add(entry[0])
+            # Rows written since the snapshot (with the same overlap as the next
+            # delta, for rows that committed late), and pending links, which
+            # snapshots leave out but which redirect
+            cutoff = store.until - timedelta(seconds=get_snapshot_config()['DELTA_OVERLAP'])
+            rows = rows.filter(Q(updated_at__gte=cutoff) | Q(created_at__gte=cutoff) | Q(status=PENDING))
+        for short_code in rows.values_list('short_code', flat=True).iterator(chunk_size=10000):
+            bloom.add(short_code)
+        if archive_lookups_enabled():
+            archived = ArchivedURL.objects.values_list('short_code', flat=True)
+            for short_code in archived.iterator(chunk_size=10000):
+                bloom.add(short_code)
+
+        with self._lock:
+            # Codes added by this worker while building are picked up again
+            # by the next refresh
+            self.filter = bloom
+            self.since = since
+            self.built_at = time.monotonic()
+            self.builds += 1
+        return bloom
+
+    def refresh(self):
+        """Add rows written since the last build or refresh. Returns how many were new."""
+        from .models import URL
+
+        bloom = self.filter
+        if bloom is None:
+            return 0
+        since = timezone.now()
+        codes = list(
+            URL.objects.filter(updated_at__gte=self.since - timedelta(seconds=self.config['REFRESH_OVERLAP']))
+            .values_list('short_code', flat=True)
+        )
+        added = 0
+        with self._lock:
+            for short_code in codes:
+                # Rows in the overlap were usually seen last time
+                if short_code not in bloom:
+                    bloom.add(short_code)
+                    added += 1
+            self.since = since
+        return added
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                close_old_connections()
+                bloom = self.filter
+                if (bloom is None or len(bloom) >= bloom.capacity
+                        or time.monotonic() - self.built_at >= self.config['REBUILD_INTERVAL']):
+                    if self.build() is None:
+                        break
+                else:
+                    self.refresh()
+            except Exception:
+                logger.exception("Failed to update the short code filter")
+            self._stopping.wait(self.config['REFRESH_INTERVAL'])
+        connection.close()
+
+    def start(self):
+        """Build the filter and keep it current in a background thread (once per process)."""
+        if self._thread is not None or not self.enabled():
+            return
+        self._thread = threading.Thread(target=self._run, name='code-filter', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=10):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def clear(self):
+        with self._lock:
+            self.filter = None
+            self.since = None
+            self.built_at = None
+            self.rejected = 0
+
+    def stats(self):
+        stats = self.filter.stats() if self.filter is not None else {}
+        stats.update(ready=self.ready, rejected=self.rejected, builds=self.builds)
+        return stats
+
+
+code_filter = CodeFilter(getattr(settings, 'SHORTENER_BLOOM_FILTER', None))
@@ -0,0 +1,378 @@
+"""
+Streaming bulk import and export of the URL table, used by the `import_urls`
+and `export_urls` management commands.
+
+Both sides use the same row format, in CSV (with a header line) or NDJSON:
+original_url, short_code, created_at, expires_at and ip_address. Only
+original_url is required on import; rows without a short code get one from
+the configured code generator.
+"""
+import csv
+import io
+import ipaddress
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .codegen import ALPHABET, get_code_generator
+from .normalize import url_digest, url_domain
+from .spam_detection import is_spam_url
+
+FIELDS = ['original_url', 'short_code', 'created_at', 'expires_at', 'ip_address']
+# Written on import in addition to FIELDS; both are derived from original_url
+DERIVED_FIELDS = ['url_hash', 'domain']
+FORMATS = ['csv', 'ndjson']
+# Imported short codes are limited to the legacy 6-character form: longer
+# ones could fall in the range of a NodeSequenceCodeGenerator's prefixed codes
+LEGACY_CODE_LENGTH = 6
+
+
+def guess_format(path, default='csv'):
+    """Pick the format from a file extension (.csv, .ndjson, .jsonl)."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    if extension == '.csv':
+        return 'csv'
+    return default
+
+
+def open_input(path):
+    if path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def open_output(path):
+    if path == '-':
+        return io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', newline='', write_through=True)
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+def read_rows(f, fmt):
+    """Yield one dict per input row, lazily."""
+    if fmt == 'csv':
+        yield from csv.DictReader(f)
+        return
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+class RowWriter:
+    """Write export rows as CSV or NDJSON."""
+
+    def __init__(self, f, fmt):
+        self.f = f
+        self.fmt = fmt
+        if fmt == 'csv':
+            self.writer = csv.writer(f)
+            self.writer.writerow(FIELDS)
+
+    def write(self, values):
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        if self.fmt == 'csv':
+            self.writer.writerow(['' if value is None else value for value in values])
+        else:
+            self.f.write(json.dumps(dict(zip(FIELDS, values))) + '\n')
+
+
+def _parse_datetime(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"invalid datetime {value!r}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+_validate_url = URLValidator()
+
+
+def clean_row(row, code_length=LEGACY_CODE_LENGTH):
+    """
+    Validate and normalize one input row. Runs in the import worker processes,
+    so it must not touch the database.
+
+    Returns (values, None) for a good row or (None, reason) for a rejected one.
+    values holds the model field values, including url_hash and domain.
+    """
+    try:
+        original_url = (row.get('original_url') or '').strip()
+        if not original_url:
+            return None, "missing original_url"
+        if len(original_url) > 2000:
+            return None, "original_url is longer than 2000 characters"
+        try:
+            _validate_url(original_url)
+        except ValidationError:
+            return None, "invalid URL"
+        is_spam, reason = is_spam_url(original_url)
+        if is_spam:
+            return None, f"spam: {reason}"
+
+        short_code = (row.get('short_code') or '').strip() or None
+        if short_code is not None and (
+                len(short_code) > code_length or not all(char in ALPHABET for char in short_code)):
+            return None, f"invalid short_code {short_code!r}"
+
+        ip_address = (row.get('ip_address') or '').strip() or None
+        if ip_address is not None:
+            ip_address = str(ipaddress.ip_address(ip_address))
+
+        values = {
+            'original_url': original_url,
+            'short_code': short_code,
+            'created_at': _parse_datetime(row.get('created_at')),
+            'expires_at': _parse_datetime(row.get('expires_at')),
+            'ip_address': ip_address,
+        }
+    except (AttributeError, TypeError, ValueError) as e:
+        return None, str(e)
+    # Expiring links are never deduplicated, as in URL.shorten()
+    values['url_hash'] = url_digest(original_url) if values['expires_at'] is None else None
+    values['domain'] = url_domain(original_url)
+    return values, None
+
+
+def _clean_chunk(rows, code_length):
+    return [clean_row(row, code_length) for row in rows]
+
+
+def _init_worker():
+    # Needed with the 'spawn' start method; a no-op for forked workers
+    import django
+    django.setup()
+
+
+class Checkpoint:
+    """
+    Progress of an import, saved after every committed chunk so an
+    interrupted import can resume where it stopped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {'rows': 0, 'created': 0, 'existing': 0, 'rejected': 0}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.state.update(json.load(f))
+
+    @property
+    def rows(self):
+        return self.state['rows']
+
+    def save(self):
+        if not self.path:
+            return
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class URLImporter:
+    """
+    Import rows into the URL table in chunks.
+
+    Each chunk is validated in a process pool (spam checks are CPU bound)
+    while the previous chunk is written, so at most two chunks are held in
+    memory. Writes use COPY on PostgreSQL and batched INSERTs elsewhere, one
+    transaction per chunk, and the checkpoint is saved after each commit.
+
+    Rows that repeat an existing URL are skipped as 'existing', unless they
+    carry their own short code: then the link is kept, without a url_hash,
+    like the duplicates created before deduplication.
+    """
+
+    def __init__(self, chunk_size=5000, workers=None, use_copy=None, checkpoint=None, errors=None):
+        self.chunk_size = chunk_size
+        self.workers = os.cpu_count() if workers is None else workers
+        self.use_copy = connection.vendor == 'postgresql' if use_copy is None else use_copy
+        self.checkpoint = checkpoint or Checkpoint(None)
+        self.errors = errors
+        self.code_length = LEGACY_CODE_LENGTH
+
+    def _chunks(self, rows):
+        rows = islice(rows, self.checkpoint.rows, None)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def _reject(self, row, reason):
+        self.checkpoint.state['rejected'] += 1
+        if self.errors is not None:
+            self.errors.write(json.dumps({'row': row, 'error': reason}, default=str) + '\n')
+
+    def _existing(self, field, values):
+        from .models import URL
+
+        values = list(values)
+        found = set()
+        for start in range(0, len(values), 1000):
+            found.update(
+                URL.objects.filter(**{f'{field}__in': values[start:start + 1000]})
+                .values_list(field, flat=True)
+            )
+        return found
+
+    def _assign_codes(self, new_rows):
+        """Give rows without a short code fresh ones that are not taken yet."""
+        pending = [values for values in new_rows if values['short_code'] is None]
+        generator = get_code_generator()
+        while pending:
+            for values, short_code in zip(pending, generator.generate_many(len(pending))):
+                values['short_code'] = short_code
+            # Sequence codes only collide with imported (legacy) codes
+            taken = self._existing('short_code', [values['short_code'] for values in pending])
+            pending = [values for values in pending if values['short_code'] in taken]
+
+    def prepare(self, rows, results):
+        """Turn cleaned rows into the list of rows to insert, counting the rest."""
+        state = self.checkpoint.state
+        good = []
+        for row, (values, reason) in zip(rows, results):
+            if values is None:
+                self._reject(row, reason)
+            else:
+                good.append((row, values))
+
+        taken_codes = self._existing('short_code', [v['short_code'] for _, v in good if v['short_code']])
+        taken_hashes = self._existing('url_hash', [v['url_hash'] for _, v in good if v['url_hash']])
+        new_rows = []
+        for row, values in good:
+            if values['short_code'] is not None:
+                if values['short_code'] in taken_codes:
+                    self._reject(row, f"short_code {values['short_code']!r} already exists")
+                    continue
+                taken_codes.add(values['short_code'])
+                if values['url_hash'] in taken_hashes:
+                    values['url_hash'] = None
+            elif values['url_hash'] in taken_hashes:
+                state['existing'] += 1
+                continue
+            if values['url_hash'] is not None:
+                taken_hashes.add(values['url_hash'])
+            new_rows.append(values)
+        self._assign_codes(new_rows)
+        return new_rows
+
+    def _db_rows(self, new_rows):
+        from .models import URL
+
+        now = timezone.now()
+        fields = [URL._meta.get_field(name) for name in FIELDS + DERIVED_FIELDS]
+        for values in new_rows:
+            yield [
+                field.get_db_prep_save(
+                    now if field.name == 'created_at' and values['created_at'] is None
+                    else values[field.name],
+                    connection,
+                )
+                for field in fields
+            ]
+
+    def _columns(self):
+        from .models import URL
+
+        table = connection.ops.quote_name(URL._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(name) for name in FIELDS + DERIVED_FIELDS)
+        return table, columns
+
+    def _copy(self, new_rows):
+        table, columns = self._columns()
+        with connection.cursor() as cursor, connection.wrap_database_errors:
+            with cursor.cursor.copy(f'COPY {table} ({columns}) FROM STDIN') as copy:
+                for row in self._db_rows(new_rows):
+                    copy.write_row(row)
+
+    def _insert(self, new_rows):
+        # A plain multi-row INSERT rather than bulk_create(), which would
+        # replace imported created_at values through auto_now_add
+        table, columns = self._columns()
+        placeholders = ', '.join(['%s'] * (len(FIELDS) + len(DERIVED_FIELDS)))
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {table} ({columns}) VALUES ({placeholders})',
+                list(self._db_rows(new_rows)),
+            )
+
+    def write(self, new_rows):
+        with transaction.atomic():
+            if self.use_copy:
+                self._copy(new_rows)
+            else:
+                self._insert(new_rows)
+
+    def commit_chunk(self, rows, results):
+        new_rows = self.prepare(rows, results)
+        if new_rows:
+            try:
+                self.write(new_rows)
+            except IntegrityError:
+                # Raced with another writer; insert one by one to find the culprit
+                for values in list(new_rows):
+                    try:
+                        with transaction.atomic():
+                            self._insert([values])
+                    except IntegrityError as e:
+                        new_rows.remove(values)
+                        self._reject(values, str(e))
+        self.checkpoint.state['rows'] += len(rows)
+        self.checkpoint.state['created'] += len(new_rows)
+        self.checkpoint.save()
+
+    def run(self, rows, progress=None):
+        """Import an iterable of row dicts. Returns the checkpoint state."""
+        if not self.workers:
+            for chunk in self._chunks(rows):
+                self.commit_chunk(chunk, _clean_chunk(chunk, self.code_length))
+                if progress:
+                    progress(self.checkpoint.state)
+            return self.checkpoint.state
+
+        batch = max(1, self.chunk_size // (self.workers * 4))
+        with ProcessPoolExecutor(self.workers, initializer=_init_worker) as executor:
+            pending = None
+            for chunk in self._chunks(rows):
+                futures = [
+                    executor.submit(_clean_chunk, chunk[start:start + batch], self.code_length)
+                    for start in range(0, len(chunk), batch)
+                ]
+                if pending is not None:
+                    self._finish(pending, progress)
+                pending = chunk, futures
+            if pending is not None:
+                self._finish(pending, progress)
+        return self.checkpoint.state
+
+    def _finish(self, pending, progress):
+        chunk, futures = pending
+        results = [result for future in futures for result in future.result()]
+        self.commit_chunk(chunk, results)
+        if progress:
+            progress(self.checkpoint.state)
+
+
+def export_rows(queryset, chunk_size=5000):
+    """
+    Yield export rows from queryset, streaming with .iterator() (a server-side
+    cursor on PostgreSQL) instead of loading the queryset.
+    """
+    return queryset.order_by('id').values_list(*FIELDS).iterator(chunk_size=chunk_size)
@@ -0,0 +1,446 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .bloom import code_filter
+from .reputation import DISABLED, cache_expiry
+from .retention import archive_lookups_enabled
+from .singleflight import single_flight
+from .snapshot import get_config as get_snapshot_config, get_snapshot_store
+
+# Stored in place of a URL to remember that a short code does not exist
+NOT_FOUND = '__not_found__'
+
+DEFAULT_REDIRECT_CACHE = {
+    'MAX_ENTRIES': 10000,     # per-worker LRU size
+    'TTL': 300,               # seconds an entry lives in the per-worker LRU
+    'NEGATIVE_TTL': 30,       # seconds a 404 is remembered (local and shared)
+    'CACHE_ALIAS': 'default', # Django cache used as the shared tier, or None
+    'SHARED_TTL': 86400,      # seconds an entry lives in the shared tier
+    'KEY_PREFIX': 'redirect:',
+}
+
+
+class LRUCache:
+    """A bounded, thread-safe LRU mapping where every entry has its own expiry."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Return the cached value for key, or None if it is missing or expired."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store value under key, evicting the least recently used entry if full."""
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Return the counters used to size the cache."""
+        return {
+            'size': len(self._data),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+class RedirectCache:
+    """
+    Read-through cache for short_code -> original_url lookups.
+
+    Lookups go through a per-worker LRU first, then the shared Django cache,
+    and only hit the database when both miss. Codes that do not exist are
+    cached too (for a shorter time) so repeated 404s stay off the database.
+
+    Links with an expiry are never cached past it: both tiers store them as
+    (original_url, expires) with their TTL capped at the time left, and
+    resolve() hands the expiry on so HTTP caches can be capped too. Links
+    still pending a reputation check are cached as if they expired shortly
+    (see shortener/reputation.py), and disabled links as 404s.
+
+    When settings.SHORTENER_SNAPSHOT points at a snapshot file, misses are
+    answered from it before (or, with FALLBACK_TO_DATABASE off, instead of)
+    the database. Codes the Bloom filter (shortener/bloom.py) rules out are
+    answered as 404s without either, and without being cached: the filter
+    is as fast as the cache and a cached 404 could outlive the code's
+    creation on another worker. Concurrent misses for the same code share
+    one load (see shortener/singleflight.py).
+    """
+
+    def __init__(self, config=None):
+        self.config = dict(DEFAULT_REDIRECT_CACHE, **(config or {}))
+        self.local = LRUCache(self.config['MAX_ENTRIES'], self.config['TTL'])
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.db_lookups = 0
+        self.negative_hits = 0
+        self.snapshot_hits = 0
+
+    @property
+    def shared(self):
+        alias = self.config['CACHE_ALIAS']
+        return caches[alias] if alias else None
+
+    def _key(self, short_code):
+        return self.config['KEY_PREFIX'] + short_code
+
+    def _load_snapshot(self, short_code):
+        """
+        Return (found, original_url, expires) from the snapshot. found is True
+        when the answer is final and the database must not be asked.
+        """
+        store = get_snapshot_store()
+        if store is None:
+            return False, None, None
+        entry = store.entry(short_code)
+        if entry is not None:
+            self.snapshot_hits += 1
+            return True, entry[0], entry[1]
+        return not get_snapshot_config()['FALLBACK_TO_DATABASE'], None, None
+
+    def _queries(self, short_code):
+        from .models import URL, ArchivedURL
+
+        # Disabled links are answered as 404s
+        yield URL.objects.filter(short_code=short_code).exclude(status=DISABLED)
+        if archive_lookups_enabled():
+            yield ArchivedURL.objects.filter(short_code=short_code).exclude(status=DISABLED)
+
+    def _load(self, short_code):
+        """
+        Fetch (original_url, expires) from the snapshot or database, where
+        expires is a Unix timestamp or None. original_url is None if the code
+        does not exist or has expired.
+        """
+        found, original_url, expires = self._load_snapshot(short_code)
+        if not found:
+            self.db_lookups += 1
+            for queryset in self._queries(short_code):
+                row = queryset.values_list('original_url', 'expires_at', 'status').first()
+                if row is not None:
+                    original_url, expires = row[0], timestamp(cache_expiry(row[2], row[1]))
+                    break
+        return unexpired(original_url, expires)
+
+    async def _aload(self, short_code):
+        # Snapshot reads are a few page-cache lookups; no need for a thread
+        found, original_url, expires = self._load_snapshot(short_code)
+        if not found:
+            self.db_lookups += 1
+            for queryset in self._queries(short_code):
+                row = await queryset.values_list('original_url', 'expires_at', 'status').afirst()
+                if row is not None:
+                    original_url, expires = row[0], timestamp(cache_expiry(row[2], row[1]))
+                    break
+        return unexpired(original_url, expires)
+
+    def resolve(self, short_code):
+        """
+        Return (original_url, expires) for short_code, where expires is a Unix
+        timestamp or None; (None, None) if the code does not exist.
+        """
+        value = self.local.get(short_code)
+        if value is None:
+            value = self._lookup_shared(short_code)
+        if value == NOT_FOUND:
+            self.negative_hits += 1
+            return None, None
+        return unpack(value)
+
+    def lookup(self, short_code):
+        """Return the original URL for short_code, or None if it does not exist."""
+        return self.resolve(short_code)[0]
+
+    def _lookup_shared(self, short_code):
+        shared = self.shared
+        if shared is not None:
+            value = self._from_shared(short_code, shared.get(self._key(short_code)))
+            if value is not None:
+                return value
+            self.shared_misses += 1
+
+        if not code_filter.might_contain(short_code):
+            return NOT_FOUND
+        return single_flight.do(short_code, lambda: self._fill(short_code))
+
+    def _fill(self, short_code):
+        """Load short_code and store it in both tiers, once across workers if configured."""
+        shared = self.shared
+        lock_key = self._key(short_code) + ':lock'
+        if shared is not None and single_flight.config['SHARED_LOCK']:
+            if not shared.add(lock_key, 1, single_flight.config['LOCK_TIMEOUT']):
+                # Another worker is loading it; wait for the value it stores
+                key = self._key(short_code)
+                value = single_flight.wait_shared(lambda: self._from_shared(short_code, shared.get(key)))
+                if value is not None:
+                    return value
+                shared = None
+        else:
+            shared = None
+        try:
+            original_url, expires = self._load(short_code)
+            return self._store(short_code, original_url or NOT_FOUND, expires)
+        finally:
+            if shared is not None:
+                shared.delete(lock_key)
+
+    async def aresolve(self, short_code):
+        """Async version of resolve(), using the async cache and ORM APIs."""
+        value = self.local.get(short_code)
+        if value is None:
+            value = await self._alookup_shared(short_code)
+        if value == NOT_FOUND:
+            self.negative_hits += 1
+            return None, None
+        return unpack(value)
+
+    async def alookup(self, short_code):
+        """Async version of lookup()."""
+        return (await self.aresolve(short_code))[0]
+
+    async def _alookup_shared(self, short_code):
+        shared = self.shared
+        if shared is not None:
+            value = self._from_shared(short_code, await shared.aget(self._key(short_code)))
+            if value is not None:
+                return value
+            self.shared_misses += 1
+
+        if not code_filter.might_contain(short_code):
+            return NOT_FOUND
+        return await single_flight.ado(short_code, lambda: self._afill(short_code))
+
+    async def _afill(self, short_code):
+        """Async version of _fill()."""
+        shared = self.shared
+        lock_key = self._key(short_code) + ':lock'
+        if shared is not None and single_flight.config['SHARED_LOCK']:
+            if not await shared.aadd(lock_key, 1, single_flight.config['LOCK_TIMEOUT']):
+                key = self._key(short_code)
+
+                async def get():
+                    return self._from_shared(short_code, await shared.aget(key))
+
+                value = await single_flight.await_shared(get)
+                if value is not None:
+                    return value
+                shared = None
+        else:
+            shared = None
+        try:
+            original_url, expires = await self._aload(short_code)
+            return await self._astore(short_code, original_url or NOT_FOUND, expires)
+        finally:
+            if shared is not None:
+                await shared.adelete(lock_key)
+
+    def peek_entry(self, short_code):
+        """
+        Return the cached (original_url, expires) without ever touching the
+        database, or (None, None) when the code is unknown to both tiers (and
+        the snapshot, if there is one) or cached as a 404.
+        """
+        value = self.local.get(short_code)
+        if value is None:
+            shared = self.shared
+            if shared is not None:
+                value = self._from_shared(short_code, shared.get(self._key(short_code)))
+            if value is None:
+                value = self._peek_snapshot(short_code)
+        if value is None or value == NOT_FOUND:
+            return None, None
+        return unpack(value)
+
+    async def apeek_entry(self, short_code):
+        """Async version of peek_entry()."""
+        value = self.local.get(short_code)
+        if value is None:
+            shared = self.shared
+            if shared is not None:
+                value = self._from_shared(short_code, await shared.aget(self._key(short_code)))
+            if value is None:
+                value = self._peek_snapshot(short_code)
+        if value is None or value == NOT_FOUND:
+            return None, None
+        return unpack(value)
+
+    def peek(self, short_code):
+        """Return the cached original URL without ever touching the database."""
+        return self.peek_entry(short_code)[0]
+
+    async def apeek(self, short_code):
+        return (await self.apeek_entry(short_code))[0]
+
+    def _peek_snapshot(self, short_code):
+        store = get_snapshot_store()
+        entry = store.entry(short_code) if store is not None else None
+        if entry is None:
+            return None
+        original_url, expires = unexpired(*entry)
+        if original_url is None:
+            return None
+        self.snapshot_hits += 1
+        return self._set_local(short_code, original_url, expires)
+
+    def _from_shared(self, short_code, value):
+        """Copy a shared-tier value to the local LRU. None if missing or expired."""
+        if value is None:
+            return None
+        if value != NOT_FOUND:
+            original_url, expires = unexpired(*unpack(value))
+            if original_url is None:
+                return None
+        self.shared_hits += 1
+        self.local.set(short_code, value, self._local_ttl(value))
+        return value
+
+    def _ttl(self, ttl, expires):
+        """ttl, capped to the seconds left before expires."""
+        if expires is None:
+            return ttl
+        return max(1, min(ttl, int(expires - time.time())))
+
+    def _local_ttl(self, value):
+        if value == NOT_FOUND:
+            return self.config['NEGATIVE_TTL']
+        return self._ttl(self.config['TTL'], unpack(value)[1])
+
+    def _set_local(self, short_code, original_url, expires=None):
+        """Store a URL (or NOT_FOUND) in the local LRU and return the stored value."""
+        value = pack(original_url, expires)
+        self.local.set(short_code, value, self._local_ttl(value))
+        return value
+
+    def _shared_timeout(self, value):
+        if value == NOT_FOUND:
+            return self.config['NEGATIVE_TTL']
+        return self._ttl(self.config['SHARED_TTL'], unpack(value)[1])
+
+    def _store(self, short_code, original_url, expires=None):
+        value = self._set_local(short_code, original_url, expires)
+        shared = self.shared
+        if shared is not None:
+            shared.set(self._key(short_code), value, self._shared_timeout(value))
+        return value
+
+    async def _astore(self, short_code, original_url, expires=None):
+        value = self._set_local(short_code, original_url, expires)
+        shared = self.shared
+        if shared is not None:
+            await shared.aset(self._key(short_code), value, self._shared_timeout(value))
+        return value
+
+    def set(self, short_code, original_url, expires_at=None):
+        """Write-through a freshly created short code, replacing any cached 404."""
+        code_filter.add(short_code)
+        self._store(short_code, original_url, timestamp(expires_at))
+
+    async def aset(self, short_code, original_url, expires_at=None):
+        code_filter.add(short_code)
+        await self._astore(short_code, original_url, timestamp(expires_at))
+
+    def warm(self, short_code, original_url, expires_at=None, shared=False):
+        """Preload a link known to exist; only the local tier unless shared is True."""
+        original_url, expires = unexpired(original_url, timestamp(expires_at))
+        if original_url is None:
+            return False
+        if shared:
+            self._store(short_code, original_url, expires)
+        else:
+            self._set_local(short_code, original_url, expires)
+        return True
+
+    def delete(self, short_code):
+        self.local.delete(short_code)
+        shared = self.shared
+        if shared is not None:
+            shared.delete(self._key(short_code))
+
+    def clear(self):
+        """Drop the per-worker entries and reset the counters."""
+        self.local = LRUCache(self.config['MAX_ENTRIES'], self.config['TTL'])
+        self.shared_hits = self.shared_misses = 0
+        self.db_lookups = self.negative_hits = self.snapshot_hits = 0
+
+    def stats(self):
+        """Return hit/miss/eviction counters for the local and shared tiers."""
+        return {
+            'local': self.local.stats(),
+            'shared_hits': self.shared_hits,
+            'shared_misses': self.shared_misses,
+            'negative_hits': self.negative_hits,
+            'db_lookups': self.db_lookups,
+            'snapshot_hits': self.snapshot_hits,
+        }
+
+
+def pack(original_url, expires):
+    """The cached form of a URL: the URL itself, or (URL, expires) for expiring links."""
+    if expires is None or original_url == NOT_FOUND:
+        return original_url
+    return (original_url, expires)
+
+
+def unpack(value):
+    """Return (original_url, expires) for a cached value."""
+    if isinstance(value, (tuple, list)):
+        return value[0], value[1]
+    return value, None
+
+
+def timestamp(moment):
+    """Convert an optional datetime to a Unix timestamp."""
+    return moment.timestamp() if moment is not None else None
+
+
+def unexpired(original_url, expires):
+    """Return (original_url, expires), or (None, None) once expires has passed."""
+    if expires is not None and expires <= time.time():
+        return None, None
+    return original_url, expires
+
+
+redirect_cache = RedirectCache(getattr(settings, 'SHORTENER_REDIRECT_CACHE', None))
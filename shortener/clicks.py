@@ -0,0 +1,185 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLICK_TRACKING = {
+    'ENABLED': True,
+    'BUCKET_SECONDS': 3600,       # width of a ClickCount time bucket
+    'MAX_PENDING': 50000,         # distinct (code, bucket, referrer, country) keys buffered
+    'FLUSH_INTERVAL': 5.0,        # seconds between background flushes
+    'FLUSH_THRESHOLD': 10000,     # buffered keys that trigger an early flush
+    'BATCH_SIZE': 500,            # rows per INSERT statement
+    'COUNTRY_HEADER': 'HTTP_CF_IPCOUNTRY',
+}
+
+
+def referrer_host(referrer):
+    """The host name of a Referer header, or '' if it is missing or malformed."""
+    if not referrer:
+        return ''
+    try:
+        return (urlsplit(referrer).hostname or '')[:255]
+    except ValueError:
+        # e.g. 'http://[oops/', which clients can send
+        return ''
+
+
+class ClickTracker:
+    """
+    Buffers redirect clicks in memory and writes them out in batches.
+
+    record() only increments a counter in a dict, so it adds next to nothing
+    to the redirect. A background thread periodically swaps the buffer out
+    and upserts it into ClickCount with one statement per BATCH_SIZE rows.
+    The buffer is bounded: clicks for new keys are dropped (and counted)
+    when it is full.
+    """
+
+    def __init__(self, config=None):
+        self.config = dict(DEFAULT_CLICK_TRACKING, **(config or {}))
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.recorded = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failed_clicks = 0
+
+    def record(self, short_code, request):
+        """Count one redirect of short_code."""
+        self.record_meta(short_code, request.META)
+
+    def record_meta(self, short_code, meta):
+        """Count one redirect of short_code, given a WSGI environ / request.META dict."""
+        if not self.config['ENABLED']:
+            return
+        bucket_seconds = self.config['BUCKET_SECONDS']
+        bucket = int(time.time() // bucket_seconds * bucket_seconds)
+        referrer = referrer_host(meta.get('HTTP_REFERER'))
+        country = meta.get(self.config['COUNTRY_HEADER'], '')[:2].upper()
+        key = (short_code, bucket, referrer, country)
+
+        with self._lock:
+            count = self._pending.get(key)
+            if count is None and len(self._pending) >= self.config['MAX_PENDING']:
+                self.dropped += 1
+                return
+            self._pending[key] = (count or 0) + 1
+            self.recorded += 1
+            size = len(self._pending)
+        if size >= self.config['FLUSH_THRESHOLD']:
+            self._wakeup.set()
+
+    def pending(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Write all buffered clicks to the database. Returns the number of rows."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        rows = [
+            (short_code, datetime.fromtimestamp(bucket, dt_timezone.utc), referrer, country, clicks)
+            for (short_code, bucket, referrer, country), clicks in pending.items()
+        ]
+        try:
+            with transaction.atomic():
+                upsert_click_counts(rows, self.config['BATCH_SIZE'])
+        except Exception:
+            self.failed_clicks += sum(pending.values())
+            logger.exception("Failed to flush %d click count rows", len(rows))
+            return 0
+        self.flushes += 1
+        self.flushed_rows += len(rows)
+        return len(rows)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.config['FLUSH_INTERVAL'])
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+        self.flush()
+        connection.close()
+
+    def start(self):
+        """Start the background flusher thread (once per process)."""
+        if self._thread is not None or not self.config['ENABLED']:
+            return
+        self._thread = threading.Thread(target=self._run, name='click-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=10):
+        """Flush what is left and stop the background thread."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        return {
+            'pending': len(self._pending),
+            'recorded': self.recorded,
+            'dropped': self.dropped,
+            'flushes': self.flushes,
+            'flushed_rows': self.flushed_rows,
+            'failed_clicks': self.failed_clicks,
+        }
+
+
+def upsert_click_counts(rows, batch_size=500):
+    """
+    Add (short_code, bucket, referrer, country, clicks) rows to ClickCount.
+
+    Uses INSERT ... ON CONFLICT DO UPDATE to increment existing counters in
+    a single statement per batch on PostgreSQL and SQLite.
+    """
+    from .models import ClickCount
+
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        for short_code, bucket, referrer, country, clicks in rows:
+            updated = ClickCount.objects.filter(
+                short_code=short_code, bucket=bucket, referrer=referrer, country=country,
+            ).update(clicks=F('clicks') + clicks)
+            if not updated:
+                ClickCount.objects.create(
+                    short_code=short_code, bucket=bucket, referrer=referrer,
+                    country=country, clicks=clicks,
+                )
+        return
+
+    qn = connection.ops.quote_name
+    table = qn(ClickCount._meta.db_table)
+    adapt = connection.ops.adapt_datetimefield_value
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            params = []
+            for short_code, bucket, referrer, country, clicks in batch:
+                params.extend([short_code, adapt(bucket), referrer, country, clicks])
+            cursor.execute(
+                'INSERT INTO %s (short_code, bucket, referrer, country, clicks) VALUES %s '
+                'ON CONFLICT (short_code, bucket, referrer, country) '
+                'DO UPDATE SET clicks = %s.clicks + excluded.clicks'
+                % (table, ', '.join(['(%s, %s, %s, %s, %s)'] * len(batch)), table),
+                params,
+            )
+
+
+click_tracker = ClickTracker(getattr(settings, 'SHORTENER_CLICK_TRACKING', None))
@@ -0,0 +1,309 @@
+import hashlib
+import random
+import string
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connection, connections, transaction
+from django.utils.module_loading import import_string
+
+ALPHABET = string.digits + string.ascii_lowercase + string.ascii_uppercase
+BASE = len(ALPHABET)
+
+DEFAULT_CODE_GENERATOR = {
+    'BACKEND': 'shortener.codegen.SequenceCodeGenerator',
+    'OPTIONS': {},
+}
+
+
+class CodeSpaceExhausted(Exception):
+    """Raised when a generator has handed out every code of its length."""
+
+
+def encode(number, length):
+    """Encode number as a fixed-width base62 string (bijective on [0, 62**length))."""
+    chars = []
+    for _ in range(length):
+        number, remainder = divmod(number, BASE)
+        chars.append(ALPHABET[remainder])
+    if number:
+        raise ValueError("Number does not fit in %d base62 digits" % length)
+    return ''.join(reversed(chars))
+
+
+def decode(code):
+    """Inverse of encode()."""
+    number = 0
+    for char in code:
+        number = number * BASE + ALPHABET.index(char)
+    return number
+
+
+class FeistelPermutation:
+    """
+    Keyed bijection on [0, size).
+
+    A balanced Feistel network permutes the smallest even-bit domain that
+    covers size; values that land outside the range are re-encrypted
+    (cycle walking) until they fall back inside, which keeps the mapping a
+    permutation of [0, size) itself.
+    """
+
+    rounds = 4
+
+    def __init__(self, size, key):
+        self.size = size
+        self.half_bits = (max(size - 1, 1).bit_length() + 1) // 2
+        self.mask = (1 << self.half_bits) - 1
+        self.key = hashlib.sha256(key.encode()).digest()
+
+    def _round(self, index, value):
+        digest = hashlib.blake2b(
+            value.to_bytes(8, 'big'),
+            key=self.key,
+            person=b'shortener%d' % index,
+            digest_size=8,
+        ).digest()
+        return int.from_bytes(digest, 'big') & self.mask
+
+    def _encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.mask
+        for index in range(self.rounds):
+            left, right = right, left ^ self._round(index, right)
+        return (left << self.half_bits) | right
+
+    def permute(self, value):
+        if not 0 <= value < self.size:
+            raise ValueError("Value outside of the permutation domain")
+        value = self._encrypt(value)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+
+class CodeGenerator:
+    """Base class for short code generation engines."""
+
+    def __init__(self, length=6):
+        self.length = length
+
+    def generate(self):
+        raise NotImplementedError
+
+    def generate_many(self, count):
+        return [self.generate() for _ in range(count)]
+
+    def prefetch(self, count):
+        """Make the next count codes available without a database write."""
+
+
+class RandomCodeGenerator(CodeGenerator):
+    """The original engine: random codes, probing the database for collisions."""
+
+    def generate(self):
+        from .models import URL
+
+        chars = string.ascii_letters + string.digits
+        short_code = ''.join(random.choice(chars) for _ in range(self.length))
+        while URL.objects.filter(short_code=short_code).exists():
+            short_code = ''.join(random.choice(chars) for _ in range(self.length))
+        return short_code
+
+
+class SequenceCodeGenerator(CodeGenerator):
+    """
+    Collision-free codes from a block-allocated database sequence.
+
+    Each worker reserves block_size sequence values with a single UPDATE and
+    hands them out from memory. Every value is passed through a keyed
+    permutation of the code space before base62 encoding, so consecutive
+    links do not get consecutive (guessable) codes.
+
+    The key must never change once codes have been issued: a different key is
+    a different permutation and will start colliding with existing codes.
+    """
+
+    def __init__(self, length=6, block_size=100, sequence='default', key=None):
+        super().__init__(length)
+        self.block_size = block_size
+        self.sequence = sequence
+        self.size = BASE ** length
+        if key is None:
+            key = getattr(settings, 'SHORTENER_CODE_KEY', None) or settings.SECRET_KEY
+        self.permutation = FeistelPermutation(self.size, key)
+        self._next = self._end = 0
+        self._lock = threading.Lock()
+
+    def reserve_block(self, count):
+        """
+        Atomically advance the sequence by count and return the first value.
+
+        A reservation must commit even if the caller's transaction rolls back,
+        or this worker would hand out values that other workers reserve again.
+        Inside a transaction it therefore runs on a separate connection, except
+        on SQLite: with a single writer, that connection would wait for the
+        caller's own lock. There the values stay in the caller's transaction
+        and next_value() does not keep any of them for later.
+        """
+        from .models import CodeSequence
+
+        if connection.in_atomic_block and connection.vendor != 'sqlite':
+            return self._reserve_separately(count)
+
+        table = connection.ops.quote_name(CodeSequence._meta.db_table)
+        if connection.features.can_return_columns_from_insert:
+            # PostgreSQL and SQLite >= 3.35 both support UPDATE ... RETURNING
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'UPDATE %s SET next_value = next_value + %%s '
+                    'WHERE name = %%s RETURNING next_value' % table,
+                    [count, self.sequence],
+                )
+                row = cursor.fetchone()
+            if row is not None:
+                return row[0] - count
+        else:
+            with transaction.atomic():
+                row = (
+                    CodeSequence.objects.select_for_update()
+                    .filter(name=self.sequence)
+                    .first()
+                )
+                if row is not None:
+                    start = row.next_value
+                    row.next_value = start + count
+                    row.save(update_fields=['next_value'])
+                    return start
+
+        # First reservation for this sequence: create the row and try again
+        try:
+            with transaction.atomic():
+                CodeSequence.objects.create(name=self.sequence, next_value=0)
+        except IntegrityError:
+            pass  # Another worker created it first
+        return self.reserve_block(count)
+
+    def _reserve_separately(self, count):
+        """reserve_block() on a new connection that commits on its own."""
+        from .models import CodeSequence
+
+        table = connection.ops.quote_name(CodeSequence._meta.db_table)
+        other = connections.create_connection(connection.alias)
+        try:
+            other.set_autocommit(False)
+            with other.cursor() as cursor:
+                cursor.execute(
+                    'UPDATE %s SET next_value = next_value + %%s WHERE name = %%s' % table,
+                    [count, self.sequence],
+                )
+                if cursor.rowcount:
+                    cursor.execute('SELECT next_value FROM %s WHERE name = %%s' % table, [self.sequence])
+                    start = cursor.fetchone()[0] - count
+                else:
+                    cursor.execute(
+                        'INSERT INTO %s (name, next_value) VALUES (%%s, %%s)' % table,
+                        [self.sequence, count],
+                    )
+                    start = 0
+            other.commit()
+        except IntegrityError:
+            # Another worker created the row first
+            other.rollback()
+            return self._reserve_separately(count)
+        finally:
+            other.close()
+        return start
+
+    def _can_keep_block(self):
+        """Whether a reserved block outlives the current transaction (see reserve_block)."""
+        return not (connection.in_atomic_block and connection.vendor == 'sqlite')
+
+    def next_value(self):
+        with self._lock:
+            if self._next < self._end:
+                value = self._next
+                self._next += 1
+            elif self._can_keep_block():
+                value = self._next = self.reserve_block(self.block_size)
+                self._end = self._next + self.block_size
+                self._next += 1
+            else:
+                value = self.reserve_block(1)
+        if value >= self.size:
+            raise CodeSpaceExhausted(
+                "All %d-character codes in sequence %r have been used"
+                % (self.length, self.sequence)
+            )
+        return value
+
+    def prefetch(self, count):
+        if not self._can_keep_block():
+            return
+        with self._lock:
+            if self._end - self._next < count:
+                size = max(count, self.block_size)
+                self._next = self.reserve_block(size)
+                self._end = self._next + size
+
+    def code_for(self, value):
+        """Return the short code for a sequence value."""
+        return encode(self.permutation.permute(value), self.length)
+
+    def generate(self):
+        return self.code_for(self.next_value())
+
+    def generate_many(self, count):
+        with self._lock:
+            available = self._end - self._next
+            if available >= count:
+                start = self._next
+                self._next += count
+            else:
+                # Large batches get their own contiguous reservation
+                start = self.reserve_block(count)
+        if start + count > self.size:
+            raise CodeSpaceExhausted(
+                "All %d-character codes in sequence %r have been used"
+                % (self.length, self.sequence)
+            )
+        return [self.code_for(value) for value in range(start, start + count)]
+
+
+class NodeSequenceCodeGenerator(SequenceCodeGenerator):
+    """
+    Sequence codes prefixed with the node's id, for deployments where
+    several nodes (regions) create links independently.
+
+    Each node allocates from its own sequence ('node-<id>' by default), so
+    nodes never contend on the same CodeSequence row and can even use
+    separate databases; the prefix keeps their codes disjoint although the
+    sequences overlap. Codes are prefix_length + length characters long, so
+    with a total other than 6 they cannot collide with codes issued by the
+    6-character generators either. prefix_length=1 allows 62 nodes.
+    """
+
+    def __init__(self, node_id, length=6, prefix_length=1, block_size=100, sequence=None, key=None):
+        if not 0 <= node_id < BASE ** prefix_length:
+            raise ImproperlyConfigured(
+                "Node id %r does not fit in a %d-character prefix" % (node_id, prefix_length)
+            )
+        super().__init__(length, block_size, sequence or 'node-%d' % node_id, key)
+        self.node_id = node_id
+        self.prefix = encode(node_id, prefix_length)
+
+    def code_for(self, value):
+        return self.prefix + super().code_for(value)
+
+
+_generator = None
+
+
+def get_code_generator():
+    """Return the process-wide generator configured by SHORTENER_CODE_GENERATOR."""
+    global _generator
+    if _generator is None:
+        config = getattr(settings, 'SHORTENER_CODE_GENERATOR', DEFAULT_CODE_GENERATOR)
+        backend = import_string(config.get('BACKEND', DEFAULT_CODE_GENERATOR['BACKEND']))
+        _generator = backend(**config.get('OPTIONS', {}))
+    return _generator
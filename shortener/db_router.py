@@ -0,0 +1,137 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+DEFAULT_DATABASE_ROUTING = {
+    'REPLICAS': [],                       # database aliases that serve reads
+    'STICKY_SECONDS': 10,                 # reads stay on the primary this long after a write
+    'COOKIE_NAME': 'shortener_primary',
+}
+
+
+class RoutingState:
+    """Per-request routing flags, shared by every thread the request runs in."""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+_state = ContextVar('shortener_db_routing', default=None)
+
+
+def get_config():
+    return dict(DEFAULT_DATABASE_ROUTING, **getattr(settings, 'SHORTENER_DATABASE_ROUTING', {}))
+
+
+@contextmanager
+def use_primary():
+    """Send every read in the block to the primary."""
+    token = _state.set(RoutingState(pinned=True))
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+def mark_written():
+    """
+    Treat the current request as having written to the database.
+
+    For views whose writes happen after they return, such as while a
+    streaming response is consumed: by then the response headers, and the
+    stickiness cookie with them, have already been sent.
+    """
+    state = _state.get()
+    if state is not None:
+        state.wrote = True
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends writes to the primary and reads to a random replica.
+
+    Reads stay on the primary when the request has already written, when the
+    client wrote within the last STICKY_SECONDS (ReplicaStickinessMiddleware
+    sets a cookie for that), or inside a transaction on the primary. With no
+    replicas configured every query goes to the default database.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = get_config()['REPLICAS']
+        if not replicas:
+            return None
+        state = _state.get()
+        if state is not None and (state.pinned or state.wrote):
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in get_config()['REPLICAS']
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Gives read-your-writes consistency across requests.
+
+    A response to a request that wrote to the database sets a short-lived
+    cookie; requests carrying it read from the primary until it expires, so
+    a freshly created short link is never looked up on a lagging replica.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not config['REPLICAS']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.cookie_name = config['COOKIE_NAME']
+        self.sticky_seconds = config['STICKY_SECONDS']
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState(pinned=self.cookie_name in request.COOKIES)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.process_response(state, response)
+
+    async def __acall__(self, request):
+        # Sync code run through sync_to_async sees the same RoutingState
+        state = RoutingState(pinned=self.cookie_name in request.COOKIES)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.process_response(state, response)
+
+    def process_response(self, state, response):
+        if state.wrote:
+            response.set_cookie(
+                self.cookie_name, '1', max_age=self.sticky_seconds, httponly=True, samesite='Lax')
+        return response
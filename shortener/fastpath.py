@@ -0,0 +1,138 @@
+import re
+
+from django.conf import settings
+from django.http.request import split_domain_port, validate_host
+from django.utils.encoding import iri_to_uri
+
+from .cache import redirect_cache
+from .clicks import click_tracker
+from .httpcache import get_config as get_http_cache_config, is_not_modified, redirect_headers
+from .metrics import registry
+
+SHORT_CODE_PATH = re.compile(r'^/([0-9A-Za-z]{1,32})$')
+
+
+class FastPath:
+    """
+    Shared logic for the WSGI and ASGI redirect dispatchers.
+
+    A GET or HEAD for /<short_code> whose code is already in the redirect
+    cache is answered with a 301 (or a 304 for a matching If-None-Match)
+    without going through Django's middleware stack. Every other request,
+    cache misses, and anything that would fail the host or HTTPS checks fall
+    through to the Django application.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.hits = 0
+        self.fallthroughs = 0
+        allowed_hosts = settings.ALLOWED_HOSTS
+        if settings.DEBUG and not allowed_hosts:
+            allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']
+        self.allowed_hosts = allowed_hosts
+        self.ssl_redirect = getattr(settings, 'SECURE_SSL_REDIRECT', False)
+        self.proxy_ssl_header = getattr(settings, 'SECURE_PROXY_SSL_HEADER', None)
+
+        headers = [('Content-Type', 'text/html; charset=utf-8'), ('Content-Length', '0')]
+        if getattr(settings, 'SECURE_CONTENT_TYPE_NOSNIFF', True):
+            headers.append(('X-Content-Type-Options', 'nosniff'))
+        if getattr(settings, 'SECURE_REFERRER_POLICY', None):
+            headers.append(('Referrer-Policy', settings.SECURE_REFERRER_POLICY))
+        if getattr(settings, 'SECURE_CROSS_ORIGIN_OPENER_POLICY', None):
+            headers.append(('Cross-Origin-Opener-Policy', settings.SECURE_CROSS_ORIGIN_OPENER_POLICY))
+        self.headers = headers
+        self.http_cache = get_http_cache_config()
+        registry.register_collector(self.collect)
+
+    def short_code(self, method, path, host, scheme, meta):
+        """Return the short code if this request may take the fast path, else None."""
+        if method not in ('GET', 'HEAD'):
+            return None
+        match = SHORT_CODE_PATH.match(path)
+        if match is None:
+            return None
+        domain, port = split_domain_port(host)
+        if not domain or not validate_host(domain, self.allowed_hosts):
+            return None
+        if self.ssl_redirect and scheme != 'https':
+            if not self.proxy_ssl_header or meta.get(self.proxy_ssl_header[0]) != self.proxy_ssl_header[1]:
+                return None  # Let SecurityMiddleware issue the HTTPS redirect
+        return match.group(1)
+
+    def response(self, original_url, expires, if_none_match):
+        """Return (status, headers) for a redirect, or a 304 if the client's copy is current."""
+        caching = redirect_headers(original_url, expires, self.http_cache)
+        if is_not_modified(if_none_match, caching):
+            return 304, caching
+        return 301, self.headers + caching + [('Location', iri_to_uri(original_url))]
+
+    def stats(self):
+        return {'hits': self.hits, 'fallthroughs': self.fallthroughs}
+
+    def collect(self):
+        for event, value in self.stats().items():
+            yield ('shortener_fastpath_requests_total', 'counter',
+                   'Requests answered by the fast path (hits) or passed to Django.',
+                   {'event': event}, value)
+
+
+class FastRedirectWSGI(FastPath):
+    """WSGI dispatcher that serves cached redirects in front of Django."""
+
+    def __call__(self, environ, start_response):
+        short_code = self.short_code(
+            environ.get('REQUEST_METHOD'),
+            environ.get('PATH_INFO', ''),
+            environ.get('HTTP_HOST') or environ.get('SERVER_NAME', ''),
+            environ.get('wsgi.url_scheme'),
+            environ,
+        )
+        if short_code is not None:
+            original_url, expires = redirect_cache.peek_entry(short_code)
+            if original_url is not None:
+                self.hits += 1
+                click_tracker.record_meta(short_code, environ)
+                status, headers = self.response(original_url, expires, environ.get('HTTP_IF_NONE_MATCH'))
+                start_response('301 Moved Permanently' if status == 301 else '304 Not Modified', headers)
+                return [b'']
+        self.fallthroughs += 1
+        return self.application(environ, start_response)
+
+
+class FastRedirectASGI(FastPath):
+    """ASGI dispatcher that serves cached redirects in front of Django."""
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+            # Only the headers the fast path looks at, in request.META form
+            meta = {
+                'HTTP_REFERER': headers.get('referer', ''),
+                click_tracker.config['COUNTRY_HEADER']: headers.get(
+                    click_tracker.config['COUNTRY_HEADER'][5:].lower().replace('_', '-'), ''),
+            }
+            if self.proxy_ssl_header:
+                meta[self.proxy_ssl_header[0]] = headers.get(
+                    self.proxy_ssl_header[0][5:].lower().replace('_', '-'))
+            short_code = self.short_code(
+                scope['method'], scope['path'], headers.get('host', ''), scope.get('scheme'), meta)
+            if short_code is not None:
+                original_url, expires = await redirect_cache.apeek_entry(short_code)
+                if original_url is not None:
+                    self.hits += 1
+                    click_tracker.record_meta(short_code, meta)
+                    status, response_headers = self.response(
+                        original_url, expires, headers.get('if-none-match'))
+                    await send({
+                        'type': 'http.response.start',
+                        'status': status,
+                        'headers': [
+                            (name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in response_headers
+                        ],
+                    })
+                    await send({'type': 'http.response.body', 'body': b''})
+                    return
+            self.fallthroughs += 1
+        await self.application(scope, receive, send)
@@ -1,6 +1,17 @@
+from datetime import timedelta
 from django import forms
+from django.utils import timezone
 from .spam_detection import is_spam_url
 
+# Lifetimes offered for expiring links, in seconds
+EXPIRY_CHOICES = [
+    ('', 'Never expires'),
+    ('3600', 'Expires in 1 hour'),
+    ('86400', 'Expires in 1 day'),
+    ('604800', 'Expires in 1 week'),
+    ('2592000', 'Expires in 30 days'),
+]
+
 class URLForm(forms.Form):
     original_url = forms.URLField(
         required=True,
@@ -10,6 +21,13 @@ class URLForm(forms.Form):
             'placeholder': 'Enter your long URL here (e.g., https://example.com/long/url)',
         })
     )
+    expires_in = forms.TypedChoiceField(
+        choices=EXPIRY_CHOICES,
+        coerce=int,
+        empty_value=None,
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-select'}),
+    )
     
     def clean_original_url(self):
         """Validate that the URL is not spam."""
@@ -22,4 +40,9 @@ class URLForm(forms.Form):
                 f"This URL has been flagged as potential spam. Reason: {reason}"
             )
         
-        return url
\ No newline at end of file
+        return url
+
+    def expires_at(self):
+        """Return when the link should expire, or None for a permanent link."""
+        seconds = self.cleaned_data.get('expires_in')
+        return timezone.now() + timedelta(seconds=seconds) if seconds else None
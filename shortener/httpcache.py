@@ -0,0 +1,127 @@
+"""
+HTTP caching policy for redirects and the landing page.
+
+Short links never change once created, so redirects can be cached by
+browsers and by a CDN or reverse proxy in front of the app; every redirect
+they serve is one that never reaches gunicorn (and is not counted by click
+tracking). Links with an expiry are never cached past it.
+"""
+import hashlib
+import os
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.http import HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+
+DEFAULT_HTTP_CACHE = {
+    'REDIRECT_MAX_AGE': 3600,       # seconds browsers may reuse a redirect, or None for no header
+    'REDIRECT_S_MAXAGE': 86400,     # seconds shared caches (CDNs) may, or None to follow MAX_AGE
+    'REDIRECT_IMMUTABLE': True,     # tell browsers not to revalidate within max-age
+    'REDIRECT_ETAG': True,          # send ETags and answer If-None-Match with 304
+    'LANDING_PAGE_ETAG': True,      # conditional GETs for the landing page
+}
+
+# Templates the landing page is rendered from; their mtimes version its ETag
+LANDING_PAGE_TEMPLATES = ['shortener/index.html', 'shortener/base.html']
+
+
+def get_config():
+    return dict(DEFAULT_HTTP_CACHE, **getattr(settings, 'SHORTENER_HTTP_CACHE', {}))
+
+
+def redirect_etag(original_url):
+    return quote_etag(hashlib.sha256(original_url.encode('utf-8')).hexdigest()[:32])
+
+
+def redirect_headers(original_url, expires=None, config=None):
+    """
+    Return the (name, value) caching headers for a redirect to original_url.
+    expires is the link's expiry as a Unix timestamp, or None.
+    """
+    config = config or get_config()
+    headers = []
+    max_age = config['REDIRECT_MAX_AGE']
+    if max_age is not None:
+        s_maxage = config['REDIRECT_S_MAXAGE']
+        if s_maxage is None:
+            s_maxage = max_age
+        if expires is not None:
+            remaining = max(0, int(expires - time.time()))
+            max_age, s_maxage = min(max_age, remaining), min(s_maxage, remaining)
+        directives = ['public', f'max-age={max_age}']
+        if s_maxage != max_age:
+            directives.append(f's-maxage={s_maxage}')
+        if config['REDIRECT_IMMUTABLE'] and max_age:
+            directives.append('immutable')
+        headers.append(('Cache-Control', ', '.join(directives)))
+    if config['REDIRECT_ETAG']:
+        headers.append(('ETag', redirect_etag(original_url)))
+    return headers
+
+
+def is_not_modified(if_none_match, headers):
+    """Return True if an If-None-Match header value matches the ETag in headers."""
+    if not if_none_match:
+        return False
+    etag = dict(headers).get('ETag')
+    if etag is None:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag.removeprefix('W/') in [tag.removeprefix('W/') for tag in etags]
+
+
+def conditional_redirect(request, response, original_url, expires=None):
+    """Add caching headers to a redirect response, or turn it into a 304."""
+    headers = redirect_headers(original_url, expires)
+    if is_not_modified(request.META.get('HTTP_IF_NONE_MATCH'), headers):
+        response = HttpResponseNotModified()
+    for name, value in headers:
+        response[name] = value
+    return response
+
+
+_template_version = None
+
+
+def landing_page_version():
+    """Return (version, last_modified) of the landing page templates, computed once."""
+    global _template_version
+    if _template_version is None:
+        from django.template.loader import get_template
+
+        mtimes = [os.stat(get_template(name).origin.name).st_mtime for name in LANDING_PAGE_TEMPLATES]
+        version = hashlib.sha256(repr(mtimes).encode()).hexdigest()[:16]
+        _template_version = version, datetime.fromtimestamp(int(max(mtimes)), dt_timezone.utc)
+    return _template_version
+
+
+def _landing_page_cacheable(request):
+    # The page embeds the visitor's CSRF token and any pending messages
+    return (
+        get_config()['LANDING_PAGE_ETAG']
+        and not settings.CSRF_USE_SESSIONS
+        and settings.CSRF_COOKIE_NAME in request.COOKIES
+        and CookieStorage.cookie_name not in request.COOKIES
+    )
+
+
+def landing_page_etag(request, *args, **kwargs):
+    """
+    ETag for the landing page: the template version plus the visitor's CSRF
+    secret. A page served from the browser cache then still carries a token
+    that is valid for this visitor.
+    """
+    if not _landing_page_cacheable(request):
+        return None
+    version, _ = landing_page_version()
+    secret = request.COOKIES[settings.CSRF_COOKIE_NAME]
+    return hashlib.sha256(f'{version}:{secret}'.encode()).hexdigest()[:32]
+
+
+def landing_page_last_modified(request, *args, **kwargs):
+    if not _landing_page_cacheable(request):
+        return None
+    return landing_page_version()[1]
@@ -0,0 +1,34 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from shortener.analytics import get_config, run
+
+
+class Command(BaseCommand):
+    help = (
+        "Aggregate link creation and click history into the columnar arrays "
+        "and summary served by the /_/analytics dashboard (see "
+        "shortener/analytics.py). Run it from a scheduler, not a web worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Directory to write to (default SHORTENER_ANALYTICS['OUTPUT_DIR']).")
+        parser.add_argument('--bucket', type=int, help="Time series bucket width in seconds.")
+        parser.add_argument('--top', type=int, help="Rows in each top-N table.")
+        parser.add_argument('--chunk-size', type=int, help="Rows fetched per database round trip.")
+
+    def handle(self, *args, **options):
+        config = get_config()
+        for option, key in (('output', 'OUTPUT_DIR'), ('bucket', 'BUCKET_SECONDS'),
+                            ('top', 'TOP'), ('chunk_size', 'CHUNK_SIZE')):
+            if options[option]:
+                config[key] = options[option]
+        try:
+            summary = run(config)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            f"Summarized {summary['urls']} links ({summary['duplicate_ratio']:.1%} duplicates, "
+            f"{summary['domains']} domains) and {summary['clicks']} clicks in {summary['seconds']:.2f}s "
+            f"to {config['OUTPUT_DIR']}"
+        )
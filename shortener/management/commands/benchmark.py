@@ -0,0 +1,256 @@
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from shortener.benchmarking import (
+    call_wsgi, compare_to_baseline, free_port, http_load, legacy_is_spam_url,
+    random_words, sample_urls, seed_urls, time_calls, wait_for_port,
+    wsgi_environ,
+)
+from shortener.cache import redirect_cache
+from shortener.models import URL
+from shortener.spam_detection import (
+    DEFAULT_SPAM_KEYWORDS, DEFAULT_SUSPICIOUS_TLDS, SpamMatcher, get_matcher,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Run benchmarks for the shortener hot paths. 'suite' seeds the URL "
+        "table and measures redirects, creation, the landing page and spam "
+        "checks; run it against a dedicated database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=['suite', 'seed', 'spam', 'servers', 'fastpath'])
+        parser.add_argument(
+            '--sizes', default='16,1000,10000,50000',
+            help="Comma-separated blocklist sizes for the spam benchmark.",
+        )
+        parser.add_argument('--urls', type=int, default=2000, help="Number of URLs checked per run.")
+        parser.add_argument('--workers', type=int, default=2, help="Server worker processes.")
+        parser.add_argument('--concurrency', type=int, default=50, help="Concurrent client connections.")
+        parser.add_argument('--requests', type=int, default=5000, help="Requests per server profile.")
+        parser.add_argument('--codes', type=int, default=1000, help="Distinct short codes to request.")
+        parser.add_argument('--repeat', type=int, default=5, help="Passes over the codes per measurement.")
+        parser.add_argument('--rows', type=int, default=0, help="Seed the URL table up to this many rows.")
+        parser.add_argument('--creates', type=int, default=500, help="URLs created by the suite.")
+        parser.add_argument('--json', dest='json_path', help="Write the suite results to this JSON file.")
+        parser.add_argument('--baseline', help="Fail if results regress against this JSON file.")
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help="Allowed latency growth against the baseline, as a fraction.",
+        )
+
+    def handle(self, *args, **options):
+        getattr(self, 'bench_%s' % options['scenario'])(options)
+
+    def bench_seed(self, options):
+        """Seed the URL table up to --rows rows."""
+        added = seed_urls(options['rows'], stdout=self.stdout)
+        self.stdout.write(f"Added {added} rows")
+
+    def sample_codes(self, count):
+        """Pick count existing short codes spread over the whole table."""
+        ids = URL.objects.order_by('id').values_list('id', flat=True)
+        first, last = ids.first(), ids.last()
+        if first is None:
+            raise CommandError("The URL table is empty; seed it with --rows")
+        rng = random.Random(0)
+        wanted = {rng.randint(first, last) for _ in range(count * 2)}
+        codes = list(URL.objects.filter(id__in=wanted).values_list('short_code', flat=True)[:count])
+        if len(codes) < count:
+            codes += list(URL.objects.values_list('short_code', flat=True)[:count - len(codes)])
+        return codes
+
+    def count_queries(self, func, args_list):
+        """Run func over args_list and return the mean number of queries per call."""
+        with CaptureQueriesContext(connection) as queries:
+            for args in args_list:
+                func(*args)
+        return len(queries) / len(args_list)
+
+    def bench_suite(self, options):
+        """Measure the redirect, create, landing page and spam-check paths."""
+        from django.core.handlers.wsgi import WSGIHandler
+        from shortener.fastpath import FastRedirectWSGI
+
+        if options['rows']:
+            seed_urls(options['rows'], stdout=self.stdout)
+        # Every cold 404 would otherwise log a warning
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        host = (settings.ALLOWED_HOSTS or ['127.0.0.1'])[0].lstrip('.')
+        handler = WSGIHandler()
+        client = Client(HTTP_HOST=host, HTTP_X_FORWARDED_PROTO='https')
+        results = {}
+
+        def redirect(environ):
+            call_wsgi(handler, environ)
+
+        codes = self.sample_codes(options['codes'])
+        environs = [(wsgi_environ(f'/{code}', host=host),) for code in codes]
+        missing = [(wsgi_environ(f'/zz{i:04d}', host=host),) for i in range(len(codes))]
+
+        # Cold: every lookup goes to the database
+        for name, args_list in (('redirect_cold', environs), ('redirect_404_cold', missing)):
+            cache.clear()
+            redirect_cache.clear()
+            results[name] = time_calls(redirect, args_list)
+            cache.clear()
+            redirect_cache.clear()
+            results[name]['queries_per_request'] = self.count_queries(redirect, args_list)
+
+        # Warm: served from the redirect cache, through Django and through the fast path
+        results['redirect_warm'] = time_calls(redirect, environs, options['repeat'])
+        results['redirect_warm']['queries_per_request'] = self.count_queries(redirect, environs)
+        fast_app = FastRedirectWSGI(handler)
+        results['redirect_fastpath'] = time_calls(
+            lambda environ: call_wsgi(fast_app, environ), environs, options['repeat'])
+
+        # Creation through the form, from distinct client networks so the
+        # per-IP and per-subnet rate limits do not kick in
+        def create(index):
+            client.post(
+                '/', {'original_url': f'https://bench.example.com/{random.random()}/{index}'},
+                REMOTE_ADDR=f'10.{index // 256 % 256}.{index % 256}.1',
+            )
+
+        cache.clear()
+        creates = [(index,) for index in range(options['creates'])]
+        results['create'] = time_calls(create, creates)
+        cache.clear()
+        results['create']['queries_per_request'] = self.count_queries(create, creates[:50])
+
+        results['index_get'] = time_calls(lambda: client.get('/'), [()] * 200)
+        results['index_get']['queries_per_request'] = self.count_queries(lambda: client.get('/'), [()] * 20)
+
+        matcher = get_matcher()
+        results['spam_check'] = time_calls(matcher.check, [(url,) for url in sample_urls(options['urls'])])
+
+        self.stdout.write(f"{'benchmark':>18} {'ops/s':>9} {'p50 us':>9} {'p99 us':>9} {'queries':>8}")
+        for name, result in results.items():
+            queries = result.get('queries_per_request')
+            self.stdout.write(
+                f"{name:>18} {result['ops_per_sec']:>9.0f} {result['p50_us']:>9.1f} "
+                f"{result['p99_us']:>9.1f} {'' if queries is None else f'{queries:.2f}':>8}"
+            )
+
+        report = {
+            'meta': {
+                'database': connection.vendor,
+                'rows': URL.objects.count(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'results': results,
+        }
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['results']
+            regressions = compare_to_baseline(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError("Performance regressions:\n" + "\n".join(regressions))
+            self.stdout.write("No regressions against the baseline.")
+
+    def bench_spam(self, options):
+        """Compare the compiled matcher against per-keyword scanning."""
+        urls = [(url,) for url in sample_urls(options['urls'])]
+        self.stdout.write(
+            f"{'keywords':>9} {'build ms':>9} {'legacy p50 us':>14} "
+            f"{'compiled p50 us':>16} {'speedup':>8}"
+        )
+        for size in [int(size) for size in options['sizes'].split(',')]:
+            keywords = DEFAULT_SPAM_KEYWORDS + random_words(max(0, size - len(DEFAULT_SPAM_KEYWORDS)))
+            start = time.perf_counter()
+            matcher = SpamMatcher(keywords=keywords)
+            build_ms = (time.perf_counter() - start) * 1000
+
+            legacy = time_calls(
+                lambda url: legacy_is_spam_url(url, keywords, DEFAULT_SUSPICIOUS_TLDS), urls)
+            compiled = time_calls(matcher.check, urls)
+            self.stdout.write(
+                f"{len(keywords):>9} {build_ms:>9.1f} {legacy['p50_us']:>14.1f} "
+                f"{compiled['p50_us']:>16.1f} {legacy['mean_us'] / compiled['mean_us']:>7.1f}x"
+            )
+
+    # Gunicorn command lines for each deployment profile
+    SERVER_PROFILES = {
+        'wsgi': ['url_shortener.wsgi:application'],
+        'asgi': ['url_shortener.asgi:application', '-k', 'uvicorn_worker.UvicornWorker'],
+    }
+
+    def bench_servers(self, options):
+        """Compare redirect throughput of the WSGI and ASGI deployment profiles."""
+        codes = [
+            url.short_code for url, created in URL.shorten_many(
+                [f'https://example.com/benchmark/{i}' for i in range(options['codes'])])
+        ]
+        paths = [f'/{code}' for code in codes]
+        # Look like a request that came through the HTTPS proxy, so the
+        # production SSL redirect does not kick in
+        headers = {'Host': '127.0.0.1', 'X-Forwarded-Proto': 'https'}
+
+        self.stdout.write(
+            f"{'profile':>8} {'req/s':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8}  statuses")
+        for profile, args in self.SERVER_PROFILES.items():
+            port = free_port()
+            env = dict(os.environ, ASYNC_VIEWS=str(profile == 'asgi'))
+            env.setdefault('SECRET_KEY', settings.SECRET_KEY)
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', *args, '--bind', f'127.0.0.1:{port}',
+                 '--workers', str(options['workers']), '--log-level', 'warning'],
+                env=env, cwd=settings.BASE_DIR,
+            )
+            try:
+                if not wait_for_port(port):
+                    raise CommandError(f"The {profile} server did not start")
+                http_load('127.0.0.1', port, paths, options['concurrency'], len(paths), headers)  # warm up
+                result = http_load(
+                    '127.0.0.1', port, paths, options['concurrency'], options['requests'], headers)
+            finally:
+                server.terminate()
+                server.wait()
+            self.stdout.write(
+                f"{profile:>8} {result['requests_per_sec']:>9.0f} {result['p50_us'] / 1000:>8.2f} "
+                f"{result['p90_us'] / 1000:>8.2f} {result['p99_us'] / 1000:>8.2f}  {result['statuses']}"
+            )
+
+    def bench_fastpath(self, options):
+        """Compare cached redirects through the fast path and the full Django stack."""
+        from django.core.handlers.wsgi import WSGIHandler
+        from shortener.fastpath import FastRedirectWSGI
+
+        codes = [
+            url.short_code for url, created in URL.shorten_many(
+                [f'https://example.com/benchmark/{i}' for i in range(options['codes'])])
+        ]
+        host = (settings.ALLOWED_HOSTS or ['127.0.0.1'])[0].lstrip('.')
+        environs = [(wsgi_environ(f'/{code}', host=host),) for code in codes]
+
+        django_app = WSGIHandler()
+        fast_app = FastRedirectWSGI(django_app)
+        self.stdout.write(f"{'handler':>10} {'req/s':>9} {'p50 us':>8} {'p99 us':>8}")
+        for name, app in (('django', django_app), ('fastpath', fast_app)):
+            for environ, in environs:  # warm the redirect cache
+                status = call_wsgi(app, environ)
+                if not status.startswith('301'):
+                    raise CommandError(f"Expected a redirect, got {status}")
+            result = time_calls(lambda environ: call_wsgi(app, environ), environs, options['repeat'])
+            self.stdout.write(
+                f"{name:>10} {result['ops_per_sec']:>9.0f} {result['p50_us']:>8.1f} {result['p99_us']:>8.1f}")
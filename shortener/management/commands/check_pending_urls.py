@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from shortener.reputation import ReputationChecker, get_config
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the reputation checks in SHORTENER_REPUTATION['SOURCES'] on "
+        "pending links, activating those that pass and disabling the rest. "
+        "Run one instance of it next to the web workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help="Pending links checked per pass.")
+        parser.add_argument('--workers', type=int, help="Concurrent checks.")
+        parser.add_argument('--loop', action='store_true', help="Keep checking, every POLL_INTERVAL seconds.")
+
+    def handle(self, *args, **options):
+        config = get_config()
+        if not config['ENABLED'] and options['loop']:
+            raise CommandError("Reputation checks are disabled (SHORTENER_REPUTATION['ENABLED'])")
+        if options['batch_size']:
+            config['BATCH_SIZE'] = options['batch_size']
+        if options['workers']:
+            config['WORKERS'] = options['workers']
+        checker = ReputationChecker(config)
+
+        while True:
+            counts = checker.check_pending()
+            checked = sum(counts.values())
+            if checked or not options['loop']:
+                self.stdout.write(
+                    f"Activated {counts['active']}, disabled {counts['disabled']}, "
+                    f"left {counts['retry']} pending for a retry"
+                )
+            if not options['loop']:
+                break
+            close_old_connections()
+            # Inconclusive links are not due again for a while, so only a
+            # full batch means there is more to do straight away
+            if checked < config['BATCH_SIZE']:
+                time.sleep(config['POLL_INTERVAL'])
@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shortener.models import URL
+from shortener.reputation import ACTIVE
+from shortener.snapshot import (
+    DELTA, FULL, SnapshotError, SnapshotFile, get_config, snapshot_rows, write_snapshot,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Export short_code -> original_url pairs to a memory-mappable snapshot "
+        "file (see shortener/snapshot.py). With --delta-from, only rows created "
+        "or changed since the given snapshot or delta (less "
+        "SHORTENER_SNAPSHOT['DELTA_OVERLAP']) are written, with tombstones for "
+        "links that are no longer active."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to write; it is replaced atomically.")
+        parser.add_argument(
+            '--delta-from', metavar='SNAPSHOT',
+            help="Write a delta covering rows changed since this snapshot or delta file.",
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        kind = FULL
+        if options['delta_from']:
+            try:
+                previous = SnapshotFile(options['delta_from'])
+            except (OSError, SnapshotError) as e:
+                raise CommandError(str(e))
+            # Reach back far enough to catch rows that committed after the
+            # previous export although they were written before it
+            since = previous.until - timedelta(seconds=get_config()['DELTA_OVERLAP'])
+            previous.close()
+            kind = DELTA
+
+        # Taken before the query, so the next delta starts no later than
+        # anything this export could have missed
+        until = timezone.now()
+        if since is not None and since > until:
+            raise CommandError(f"{options['delta_from']} is newer than the database")
+        if since is None:
+            queryset = URL.objects.filter(status=ACTIVE).exclude(expires_at__lte=until)
+        else:
+            # Every status, so links disabled since the last export become tombstones
+            queryset = URL.objects.filter(updated_at__gte=since)
+        count = write_snapshot(options['path'], snapshot_rows(queryset), kind=kind, since=since, until=until)
+        self.stdout.write(f"Wrote {count} rows (changed {since or 'ever'} to {until}) to {options['path']}")
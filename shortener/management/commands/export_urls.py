@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shortener.bulk import FORMATS, RowWriter, export_rows, guess_format, open_output
+from shortener.models import URL
+
+
+class Command(BaseCommand):
+    help = (
+        "Export links as CSV or NDJSON in the format import_urls reads. Rows "
+        "are streamed from the database in id order, never loaded at once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to write, or - for stdout.")
+        parser.add_argument('--format', choices=FORMATS, help="Output format; guessed from the extension by default.")
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Rows fetched per round trip.")
+        parser.add_argument('--after-id', type=int, default=0, help="Only export rows with a higher id.")
+        parser.add_argument('--include-expired', action='store_true', help="Also export links that have expired.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        queryset = URL.objects.filter(id__gt=options['after_id'])
+        if not options['include_expired']:
+            queryset = queryset.exclude(expires_at__lte=timezone.now())
+
+        try:
+            f = open_output(path)
+        except OSError as e:
+            raise CommandError(str(e))
+        writer = RowWriter(f, options['format'] or guess_format(path))
+        count = 0
+        try:
+            for values in export_rows(queryset, options['chunk_size']):
+                writer.write(values)
+                count += 1
+        finally:
+            f.flush()
+            if path != '-':
+                f.close()
+        if path != '-':
+            self.stdout.write(f"Exported {count} links to {path}")
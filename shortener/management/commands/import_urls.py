@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shortener.bulk import FORMATS, Checkpoint, URLImporter, guess_format, open_input, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Import links from a CSV or NDJSON file (see shortener/bulk.py for the "
+        "columns). Rows are validated and spam-checked in worker processes and "
+        "inserted in chunks; an interrupted import resumes from its checkpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to read, or - for stdin.")
+        parser.add_argument('--format', choices=FORMATS, help="Input format; guessed from the extension by default.")
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Rows per transaction.")
+        parser.add_argument('--workers', type=int, help="Validation processes (default: CPU count, 0 to validate inline).")
+        parser.add_argument(
+            '--checkpoint', metavar='FILE',
+            help="Progress file (default: <path>.checkpoint). An existing one is resumed from.",
+        )
+        parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint.")
+        parser.add_argument('--no-copy', action='store_true', help="Use batched INSERTs instead of COPY on PostgreSQL.")
+        parser.add_argument('--errors', metavar='FILE', help="Append rejected rows to this NDJSON file.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or guess_format(path)
+        checkpoint_path = options['checkpoint'] or (None if path == '-' else f'{path}.checkpoint')
+        if options['restart'] and checkpoint_path:
+            Checkpoint(checkpoint_path).remove()
+        checkpoint = Checkpoint(checkpoint_path)
+        if checkpoint.rows:
+            if path == '-':
+                raise CommandError("Cannot resume an import from stdin; use --restart")
+            self.stdout.write(f"Resuming after {checkpoint.rows} rows")
+
+        try:
+            f = open_input(path)
+        except OSError as e:
+            raise CommandError(str(e))
+        errors = open(options['errors'], 'a', encoding='utf-8') if options['errors'] else None
+        importer = URLImporter(
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            use_copy=False if options['no_copy'] else None,
+            checkpoint=checkpoint,
+            errors=errors,
+        )
+
+        def progress(state):
+            self.stderr.write(
+                f"{state['rows']} rows: {state['created']} created, "
+                f"{state['existing']} existing, {state['rejected']} rejected"
+            )
+
+        try:
+            state = importer.run(read_rows(f, fmt), progress if options['verbosity'] > 1 else None)
+        except ValueError as e:
+            raise CommandError(f"Could not read {path} after row {checkpoint.rows}: {e}")
+        finally:
+            if path != '-':
+                f.close()
+            if errors is not None:
+                errors.close()
+        checkpoint.remove()
+        self.stdout.write(
+            f"Imported {state['created']} links from {state['rows']} rows "
+            f"({state['existing']} already existed, {state['rejected']} rejected)"
+        )
@@ -0,0 +1,49 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from shortener.retention import drop_archived_months, get_config, purge_urls
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete (or archive) expired links and archive links older than "
+        "SHORTENER_RETENTION['ARCHIVE_AFTER_MONTHS'], in small batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help="Rows moved per transaction.")
+        parser.add_argument('--pause', type=float, help="Seconds to sleep between batches.")
+        parser.add_argument('--loop', action='store_true', help="Keep running, every --interval seconds.")
+        parser.add_argument('--interval', type=float, default=300, help="Seconds between runs with --loop.")
+        parser.add_argument(
+            '--drop-archived-before', metavar='YYYY-MM',
+            help="Also delete archived links created before this month.",
+        )
+
+    def handle(self, *args, **options):
+        config = get_config()
+        if options['batch_size']:
+            config['BATCH_SIZE'] = options['batch_size']
+        if options['pause'] is not None:
+            config['BATCH_PAUSE'] = options['pause']
+        drop_before = None
+        if options['drop_archived_before']:
+            try:
+                drop_before = datetime.strptime(options['drop_archived_before'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError("--drop-archived-before must look like 2024-01")
+
+        while True:
+            counts = purge_urls(config=config)
+            message = f"Removed {counts['expired']} expired and archived {counts['archived']} old links"
+            if drop_before is not None:
+                dropped = drop_archived_months(drop_before, config=config)
+                message += f", dropped {dropped} archived links created before {drop_before:%Y-%m}"
+            self.stdout.write(message)
+            if not options['loop']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
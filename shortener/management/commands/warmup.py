@@ -0,0 +1,37 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from shortener.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the worker warm-up (see shortener/warmup.py) and report what it "
+        "loaded and how long it took. With --shared, the preloaded redirects "
+        "are written to the shared cache, e.g. after it was flushed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget', type=float, help="Time budget in seconds.")
+        parser.add_argument('--top', type=int, help="Most clicked links to preload.")
+        parser.add_argument('--recent', type=int, help="Most recent links to preload.")
+        parser.add_argument('--shared', action='store_true', help="Also fill the shared cache tier.")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        config = {}
+        for option, key in (('budget', 'TIME_BUDGET'), ('top', 'TOP_CLICKED'), ('recent', 'RECENT')):
+            if options[option] is not None:
+                config[key] = options[option]
+        report = warm_up(config, shared=options['shared'])
+        if options['json']:
+            self.stdout.write(json.dumps(report))
+            return
+        self.stdout.write(
+            f"Loaded {report['entries']} redirects and opened {report['connections']} "
+            f"connections in {report['seconds']:.3f}s"
+            + ('' if report['complete'] else " (time budget exhausted)")
+        )
+        for name, seconds in report['steps'].items():
+            self.stdout.write(f"  {name}: {seconds:.3f}s")
@@ -0,0 +1,292 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+DEFAULT_METRICS = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 0.01,   # fraction of requests that are timed
+    'TOKEN': None,         # bearer token required by the metrics endpoint
+}
+
+# Set while the current request is being sampled
+_sampled = ContextVar('shortener_metrics_sampled', default=False)
+# The QueryCounter of the async request being sampled, if any
+_query_counter = ContextVar('shortener_metrics_query_counter', default=None)
+
+
+def get_config():
+    return dict(DEFAULT_METRICS, **getattr(settings, 'SHORTENER_METRICS', {}))
+
+
+def is_sampled():
+    """Return True if the request being handled is sampled for metrics."""
+    return _sampled.get()
+
+
+@contextmanager
+def sampled(value=True):
+    token = _sampled.set(value)
+    try:
+        yield
+    finally:
+        _sampled.reset(token)
+
+
+class Histogram:
+    """
+    Log-linear histogram with a fixed relative error, in the spirit of HDR
+    histograms: SUB_BUCKETS buckets per power of two between MIN and MAX.
+    Recording a value is one log2 and one list increment.
+    """
+
+    SUB_BUCKETS = 4
+    MIN = 1e-6   # seconds
+    MAX = 64.0
+
+    def __init__(self):
+        self.size = int(math.log2(self.MAX / self.MIN) * self.SUB_BUCKETS) + 1
+        self.counts = [0] * (self.size + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def index(self, value):
+        if value <= self.MIN:
+            return 0
+        return min(self.size, int(math.log2(value / self.MIN) * self.SUB_BUCKETS))
+
+    def upper_bound(self, index):
+        return self.MIN * 2 ** ((index + 1) / self.SUB_BUCKETS)
+
+    def observe(self, value):
+        self.counts[self.index(value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, fraction):
+        """Estimate a quantile from the bucket counts (upper bound of its bucket)."""
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return self.upper_bound(index) if index < self.size else math.inf
+        return 0.0
+
+
+class MetricsRegistry:
+    """Process-wide counters and histograms, exported in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+        self.collectors = []
+
+    def describe(self, name, help_text):
+        self.help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def register_collector(self, collector):
+        """
+        Register a callable returning (name, type, help, labels, value) tuples,
+        evaluated at scrape time. Used for stats kept elsewhere (caches, buffers).
+        """
+        if collector not in self.collectors:
+            self.collectors.append(collector)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        typed = set()
+
+        def header(name, kind, help_text=None):
+            if name in typed:
+                return
+            typed.add(name)
+            help_text = help_text or self.help.get(name)
+            if help_text:
+                lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            for (name, labels), value in counters:
+                header(name, 'counter')
+                lines.append(f'{name}{format_labels(labels)} {value}')
+            for (name, labels), histogram in histograms:
+                header(name, 'histogram')
+                cumulative = 0
+                for index, count in enumerate(histogram.counts[:-1]):
+                    cumulative += count
+                    bound = format_labels(labels + (('le', '%.6g' % histogram.upper_bound(index)),))
+                    lines.append(f'{name}_bucket{bound} {cumulative}')
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {histogram.count}')
+                lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+
+        for collector in self.collectors:
+            for name, kind, help_text, labels, value in collector():
+                header(name, kind, help_text)
+                lines.append(f'{name}{format_labels(tuple(sorted(labels.items())))} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{%s}' % ','.join(escaped)
+
+
+class QueryCounter:
+    """connection.execute_wrapper hook counting queries and their total time."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+    execute_wrapper hook passing queries to the current request's QueryCounter.
+
+    Async requests share the connections of the thread their sync code runs
+    in, so a wrapper per request cannot be pushed and popped around them.
+    This one stays installed and finds its counter through a context variable.
+    """
+    queries = _query_counter.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    return queries(execute, sql, params, many, context)
+
+
+@contextmanager
+def counting_queries(queries):
+    token = _query_counter.set(queries)
+    try:
+        yield
+    finally:
+        _query_counter.reset(token)
+
+
+def install_query_counter():
+    """Add count_queries to this thread's database connections, once."""
+    from django.db import connections
+
+    for connection in connections.all():
+        if count_queries not in connection.execute_wrappers:
+            connection.execute_wrappers.append(count_queries)
+
+
+registry = MetricsRegistry()
+registry.describe('shortener_request_duration_seconds', 'Time spent handling sampled requests, per view.')
+registry.describe('shortener_requests_sampled_total', 'Requests that were sampled for metrics, per view.')
+registry.describe('shortener_db_queries_total', 'SQL queries run by sampled requests, per view.')
+registry.describe('shortener_db_query_duration_seconds', 'Total SQL time per sampled request, per view.')
+registry.describe('shortener_spam_check_duration_seconds', 'Time spent in is_spam_url for sampled requests.')
+
+
+def collect_shortener_stats():
+    """Expose the redirect cache, code filter, write queue, warm-up and click buffer counters."""
+    from . import warmup
+    from .bloom import code_filter
+    from .cache import redirect_cache
+    from .clicks import click_tracker
+    from .singleflight import single_flight
+    from .writequeue import write_queue
+
+    cache_stats = redirect_cache.stats()
+    local = cache_stats['local']
+    yield ('shortener_redirect_cache_local_entries', 'gauge',
+           'Entries in the per-worker redirect LRU.', {}, local['size'])
+    for event in ('hits', 'misses', 'evictions', 'expirations'):
+        yield ('shortener_redirect_cache_local_events_total', 'counter',
+               'Per-worker redirect LRU events.', {'event': event}, local[event])
+    for event in ('shared_hits', 'shared_misses', 'negative_hits', 'db_lookups', 'snapshot_hits'):
+        yield ('shortener_redirect_cache_events_total', 'counter',
+               'Redirect cache shared tier, snapshot and database events.', {'event': event}, cache_stats[event])
+
+    filter_stats = code_filter.stats()
+    yield ('shortener_code_filter_ready', 'gauge',
+           'Whether the short code Bloom filter has been built.', {}, int(filter_stats['ready']))
+    yield ('shortener_code_filter_rejected_total', 'counter',
+           'Lookups answered as 404 by the Bloom filter.', {}, filter_stats['rejected'])
+    if filter_stats['ready']:
+        yield ('shortener_code_filter_items', 'gauge',
+               'Short codes added to the Bloom filter.', {}, filter_stats['items'])
+        yield ('shortener_code_filter_memory_bytes', 'gauge',
+               'Size of the Bloom filter bit array.', {}, filter_stats['memory_bytes'])
+        yield ('shortener_code_filter_estimated_error_rate', 'gauge',
+               'Expected false-positive rate at the current fill.', {}, filter_stats['estimated_error_rate'])
+
+    queue_stats = write_queue.stats()
+    yield ('shortener_write_queue_pending', 'gauge',
+           'Writes waiting for the single-writer thread.', {}, queue_stats['pending'])
+    for event in ('calls', 'batches', 'failed_batches'):
+        yield ('shortener_write_queue_events_total', 'counter',
+               'Single-writer queue events.', {'event': event}, queue_stats[event])
+
+    for event, value in single_flight.stats().items():
+        if event != 'in_flight':
+            yield ('shortener_single_flight_events_total', 'counter',
+                   'Redirect cache misses that ran a load (leaders) or shared one (collapsed).',
+                   {'event': event}, value)
+
+    report = warmup.last_report
+    if report is not None:
+        yield ('shortener_warmup_entries', 'gauge',
+               'Redirects preloaded when this worker started.', {}, report['entries'])
+        yield ('shortener_warmup_duration_seconds', 'gauge',
+               'Time the worker warm-up took.', {}, report['seconds'])
+
+    click_stats = click_tracker.stats()
+    yield ('shortener_clicks_pending', 'gauge',
+           'Distinct click counter keys waiting to be flushed.', {}, click_stats['pending'])
+    for event in ('recorded', 'dropped', 'failed_clicks', 'flushed_rows', 'flushes'):
+        yield ('shortener_clicks_events_total', 'counter',
+               'Click tracking pipeline events.', {'event': event}, click_stats[event])
+
+
+registry.register_collector(collect_shortener_stats)
@@ -0,0 +1,72 @@
+import random
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .metrics import (
+    QueryCounter, counting_queries, get_config, install_query_counter, registry, sampled,
+)
+
+
+class MetricsMiddleware:
+    """
+    Times a random sample of requests and counts their SQL queries.
+
+    Unsampled requests cost one random() call. Sampled ones are wrapped in
+    an execute_wrapper on every database connection and recorded per view
+    (the URL pattern name) in the metrics registry. Under ASGI the queries
+    are counted by a wrapper installed once per connection instead.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = config['SAMPLE_RATE']
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        queries = QueryCounter()
+        with ExitStack() as stack, sampled():
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            start = time.perf_counter()
+            response = self.get_response(request)
+            duration = time.perf_counter() - start
+        self.record(request, duration, queries)
+        return response
+
+    async def __acall__(self, request):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return await self.get_response(request)
+
+        queries = QueryCounter()
+        # The ORM runs on the thread sync_to_async uses, with its connections
+        await sync_to_async(install_query_counter)()
+        with counting_queries(queries), sampled():
+            start = time.perf_counter()
+            response = await self.get_response(request)
+            duration = time.perf_counter() - start
+        self.record(request, duration, queries)
+        return response
+
+    def record(self, request, duration, queries):
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name or match.view_name if match else 'unmatched'
+        registry.observe('shortener_request_duration_seconds', duration, view=view)
+        registry.inc('shortener_requests_sampled_total', view=view)
+        registry.inc('shortener_db_queries_total', queries.count, view=view)
+        registry.observe('shortener_db_query_duration_seconds', queries.duration, view=view)
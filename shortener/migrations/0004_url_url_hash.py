@@ -0,0 +1,58 @@
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+from shortener.normalize import url_digest
+
+BATCH_SIZE = 2000
+
+
+def backfill_url_hash(apps, schema_editor):
+    """Hash every existing URL, keeping the hash only on the oldest duplicate."""
+    URL = apps.get_model('shortener', 'URL')
+    db_alias = schema_editor.connection.alias
+    urls = URL.objects.using(db_alias).only('id', 'original_url').order_by('id')
+
+    batch = []
+    for url in urls.iterator(chunk_size=BATCH_SIZE):
+        url.url_hash = url_digest(url.original_url)
+        batch.append(url)
+        if len(batch) >= BATCH_SIZE:
+            URL.objects.using(db_alias).bulk_update(batch, ['url_hash'])
+            batch = []
+    if batch:
+        URL.objects.using(db_alias).bulk_update(batch, ['url_hash'])
+
+    # Duplicates keep working as redirects, but only the oldest row is
+    # used for deduplication so the unique index can be built
+    duplicates = (
+        URL.objects.using(db_alias)
+        .values('url_hash')
+        .annotate(rows=Count('id'), first_id=Min('id'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        (URL.objects.using(db_alias)
+            .filter(url_hash=duplicate['url_hash'])
+            .exclude(id=duplicate['first_id'])
+            .update(url_hash=None))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0003_codesequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='url',
+            name='url_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_url_hash, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='url',
+            name='url_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
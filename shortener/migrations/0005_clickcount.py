@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0004_url_url_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClickCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('short_code', models.CharField(max_length=6)),
+                ('bucket', models.DateTimeField()),
+                ('referrer', models.CharField(blank=True, max_length=255)),
+                ('country', models.CharField(blank=True, max_length=2)),
+                ('clicks', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('short_code', 'bucket', 'referrer', 'country'), name='unique_click_bucket')],
+            },
+        ),
+    ]
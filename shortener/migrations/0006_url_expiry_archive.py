@@ -0,0 +1,39 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0005_clickcount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedURL',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_url', models.URLField(max_length=2000)),
+                ('short_code', models.CharField(max_length=6, unique=True)),
+                ('created_at', models.DateTimeField()),
+                ('created_month', models.DateField(db_index=True)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='url',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='url',
+            index=models.Index(fields=['ip_address', 'created_at'], name='url_ip_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='url',
+            index=models.Index(fields=['created_at'], name='url_created_idx'),
+        ),
+    ]
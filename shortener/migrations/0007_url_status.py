@@ -0,0 +1,32 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0006_url_expiry_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='url',
+            name='checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='url',
+            name='status',
+            field=models.CharField(choices=[('active', 'Active'), ('pending', 'Pending review'), ('disabled', 'Disabled')], db_default='active', default='active', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='url',
+            name='status_reason',
+            field=models.CharField(blank=True, db_default='', default='', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='url',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['id'], name='url_pending_idx'),
+        ),
+    ]
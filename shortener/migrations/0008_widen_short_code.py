@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0007_url_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedurl',
+            name='short_code',
+            field=models.CharField(max_length=16, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='clickcount',
+            name='short_code',
+            field=models.CharField(max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='url',
+            name='short_code',
+            field=models.CharField(max_length=16, unique=True),
+        ),
+    ]
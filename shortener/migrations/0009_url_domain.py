@@ -0,0 +1,72 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+from shortener.normalize import url_domain
+
+BATCH_SIZE = 2000
+
+# PostgreSQL only: LIKE 'prefix%' on short_code, and trigram matching for
+# substring searches of original_url (see shortener/search.py)
+POSTGRES_INDEXES = [
+    (
+        'CREATE INDEX IF NOT EXISTS url_code_prefix_idx '
+        'ON shortener_url (short_code varchar_pattern_ops)',
+        'DROP INDEX IF EXISTS url_code_prefix_idx',
+    ),
+    (
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        None,
+    ),
+    (
+        'CREATE INDEX IF NOT EXISTS url_original_url_trgm_idx '
+        'ON shortener_url USING gin (original_url gin_trgm_ops)',
+        'DROP INDEX IF EXISTS url_original_url_trgm_idx',
+    ),
+]
+
+
+def backfill_domains(apps, schema_editor):
+    URL = apps.get_model('shortener', 'URL')
+    last_id = 0
+    while True:
+        batch = list(
+            URL.objects.using(schema_editor.connection.alias)
+            .filter(id__gt=last_id).order_by('id').only('id', 'original_url')[:BATCH_SIZE]
+        )
+        if not batch:
+            return
+        for url in batch:
+            url.domain = url_domain(url.original_url)
+        URL.objects.using(schema_editor.connection.alias).bulk_update(batch, ['domain'])
+        last_id = batch[-1].id
+
+
+def create_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for create, _ in POSTGRES_INDEXES:
+            schema_editor.execute(create)
+
+
+def drop_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for _, drop in reversed(POSTGRES_INDEXES):
+            if drop:
+                schema_editor.execute(drop)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0008_widen_short_code'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='url',
+            name='domain',
+            field=models.CharField(blank=True, db_default='', db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_domains, migrations.RunPython.noop),
+        migrations.RunPython(create_postgres_indexes, drop_postgres_indexes),
+    ]
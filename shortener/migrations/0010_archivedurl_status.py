@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0009_url_domain'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedurl',
+            name='status',
+            field=models.CharField(choices=[('active', 'Active'), ('pending', 'Pending review'), ('disabled', 'Disabled')], db_default='active', default='active', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='archivedurl',
+            name='status_reason',
+            field=models.CharField(blank=True, db_default='', default='', max_length=255),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:54
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0010_archivedurl_status'),
+    ]
+
+    # Added without the default first, so existing rows stay NULL instead of
+    # all looking freshly updated to the next snapshot delta
+    operations = [
+        migrations.AddField(
+            model_name='url',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='url',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_default=django.db.models.functions.datetime.Now(), db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:56
+
+import django.db.models.functions.datetime
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0011_url_updated_at'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='url',
+            name='url_pending_idx',
+        ),
+        migrations.AddField(
+            model_name='url',
+            name='check_attempts',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='url',
+            name='next_check_at',
+            field=models.DateTimeField(db_default=django.db.models.functions.datetime.Now(), default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='url',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['next_check_at'], name='url_pending_due_idx'),
+        ),
+    ]
@@ -1,31 +1,200 @@
-from django.db import models
-import random
-import string
+from asgiref.sync import sync_to_async
+from django.db import models, router, transaction, IntegrityError
 import time
+from django.db.models.functions import Now
 from django.utils import timezone
 from datetime import timedelta, datetime
+from .normalize import url_digest, url_domain
+from .reputation import ACTIVE, DISABLED, PENDING, cache_expiry, initial_status
+
+STATUS_CHOICES = [
+    (ACTIVE, 'Active'),
+    (PENDING, 'Pending review'),
+    (DISABLED, 'Disabled'),
+]
 
 class URL(models.Model):
     original_url = models.URLField(max_length=2000)
-    short_code = models.CharField(max_length=6, unique=True)
+    short_code = models.CharField(max_length=16, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
+    # SHA-256 of the normalized URL, used to find existing short codes.
+    # NULL for legacy duplicates that were created before deduplication.
+    url_hash = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+    # Links stop redirecting after this and are removed by `manage.py purge_urls`
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Set by the deferred reputation checks in shortener/reputation.py
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=ACTIVE, db_default=ACTIVE)
+    status_reason = models.CharField(max_length=255, blank=True, default='', db_default='')
+    checked_at = models.DateTimeField(null=True, blank=True)
+    # Inconclusive checks so far, and when a pending link is due for the next
+    check_attempts = models.PositiveIntegerField(default=0, db_default=0, editable=False)
+    next_check_at = models.DateTimeField(default=timezone.now, db_default=Now(), editable=False)
+    # When the row last changed, so snapshot deltas pick up status changes.
+    # NULL for rows that have not changed since the column was added.
+    updated_at = models.DateTimeField(auto_now=True, null=True, db_default=Now(), db_index=True)
+    # Host of original_url, kept in step by save() so admin searches by
+    # domain are an index lookup (see shortener/search.py)
+    domain = models.CharField(max_length=255, blank=True, default='', db_default='', db_index=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ip_address', 'created_at'], name='url_ip_created_idx'),
+            models.Index(fields=['created_at'], name='url_created_idx'),
+            models.Index(fields=['next_check_at'], condition=models.Q(status=PENDING), name='url_pending_due_idx'),
+        ]
     
     def __str__(self):
         return f"{self.original_url} -> {self.short_code}"
+
+    def save(self, *args, **kwargs):
+        self.domain = url_domain(self.original_url)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = {*update_fields, 'updated_at'}
+            if 'original_url' in update_fields:
+                update_fields.add('domain')
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+
+    def is_expired(self, now=None):
+        return self.expires_at is not None and self.expires_at <= (now or timezone.now())
+
+    def cache_expires_at(self):
+        """When caches must drop this link; see reputation.cache_expiry()."""
+        return cache_expiry(self.status, self.expires_at)
     
     @classmethod
     def create_short_code(cls):
-        """Generate a random 6-character string for the short URL."""
-        chars = string.ascii_letters + string.digits
-        short_code = ''.join(random.choice(chars) for _ in range(6))
-        
-        # Make sure the code is unique
-        while cls.objects.filter(short_code=short_code).exists():
-            short_code = ''.join(random.choice(chars) for _ in range(6))
-            
-        return short_code
+        """Generate a new short code using the configured code generator."""
+        from .codegen import get_code_generator
+        return get_code_generator().generate()
     
+    @classmethod
+    def shorten(cls, original_url, ip_address=None, max_attempts=3, expires_at=None):
+        """
+        Return (url, created) for original_url, reusing the existing short code
+        when an equivalent URL has already been shortened.
+
+        Links with an expiry always get a new short code and are never reused,
+        so a permanent link is never handed out with someone else's expiry.
+        """
+        url_hash = url_digest(original_url) if expires_at is None else None
+        if url_hash is not None:
+            existing_url = cls.objects.filter(url_hash=url_hash).first()
+            if existing_url:
+                return existing_url, False
+
+        # Sequence-allocated codes never repeat, so this is normally a single
+        # INSERT; the retry covers legacy random codes that the sequence
+        # happens to land on, and concurrent requests for the same URL.
+        for attempt in range(max_attempts):
+            # Drawn outside the transaction, so a failed INSERT cannot roll
+            # back a block reservation this worker goes on using
+            short_code = cls.create_short_code()
+            try:
+                with transaction.atomic():
+                    url = cls.objects.create(
+                        original_url=original_url,
+                        short_code=short_code,
+                        ip_address=ip_address,
+                        url_hash=url_hash,
+                        expires_at=expires_at,
+                        status=initial_status(),
+                    )
+                return url, True
+            except IntegrityError:
+                if url_hash is not None:
+                    # The conflicting row may not have reached a read replica yet
+                    primary = router.db_for_write(cls)
+                    existing_url = cls.objects.using(primary).filter(url_hash=url_hash).first()
+                    if existing_url:
+                        return existing_url, False
+                if attempt == max_attempts - 1:
+                    raise
+
+    @classmethod
+    async def ashorten(cls, original_url, ip_address=None, max_attempts=3, expires_at=None):
+        """Async version of shorten(), using the async ORM."""
+        url_hash = url_digest(original_url) if expires_at is None else None
+        if url_hash is not None:
+            existing_url = await cls.objects.filter(url_hash=url_hash).afirst()
+            if existing_url:
+                return existing_url, False
+
+        for attempt in range(max_attempts):
+            # Usually served from memory; reserving a new block is a sync query
+            short_code = await sync_to_async(cls.create_short_code)()
+            try:
+                url = await cls.objects.acreate(
+                    original_url=original_url,
+                    short_code=short_code,
+                    ip_address=ip_address,
+                    url_hash=url_hash,
+                    expires_at=expires_at,
+                    status=initial_status(),
+                )
+                return url, True
+            except IntegrityError:
+                if url_hash is not None:
+                    primary = router.db_for_write(cls)
+                    existing_url = await cls.objects.using(primary).filter(url_hash=url_hash).afirst()
+                    if existing_url:
+                        return existing_url, False
+                if attempt == max_attempts - 1:
+                    raise
+
+    @classmethod
+    def shorten_many(cls, original_urls, ip_address=None, batch_size=500):
+        """
+        Bulk version of shorten(): return a (url, created) pair per input URL.
+
+        Existing URLs are resolved with one IN query per batch and new ones are
+        inserted with a single bulk_create. If the batch races with another
+        writer, it falls back to shortening the remaining URLs one by one.
+        """
+        from .codegen import get_code_generator
+
+        digests = [url_digest(original_url) for original_url in original_urls]
+        found = {}
+        unique_digests = list(dict.fromkeys(digests))
+        for start in range(0, len(unique_digests), batch_size):
+            for url in cls.objects.filter(url_hash__in=unique_digests[start:start + batch_size]):
+                found[url.url_hash] = url
+
+        new_urls = {}
+        for original_url, url_hash in zip(original_urls, digests):
+            if url_hash not in found and url_hash not in new_urls:
+                new_urls[url_hash] = cls(
+                    original_url=original_url, ip_address=ip_address, url_hash=url_hash,
+                    status=initial_status(), domain=url_domain(original_url))
+        if new_urls:
+            codes = get_code_generator().generate_many(len(new_urls))
+            for url, short_code in zip(new_urls.values(), codes):
+                url.short_code = short_code
+            try:
+                with transaction.atomic():
+                    cls.objects.bulk_create(new_urls.values(), batch_size=batch_size)
+            except IntegrityError:
+                created_urls = {}
+                for url_hash, url in new_urls.items():
+                    url, created = cls.shorten(url.original_url, ip_address)
+                    if created:
+                        created_urls[url_hash] = url
+                    else:
+                        found[url_hash] = url
+                new_urls = created_urls
+
+        results = []
+        for url_hash in digests:
+            if url_hash in new_urls:
+                # Only the first occurrence of a URL in the batch counts as created
+                results.append((new_urls.pop(url_hash), True))
+                found[url_hash] = results[-1][0]
+            else:
+                results.append((found[url_hash], False))
+        return results
+
     @classmethod
     def get_recent_urls_by_ip(cls, ip_address, minutes=10):
         """Get URLs created by this IP address in the last X minutes."""
@@ -33,4 +202,55 @@ class URL(models.Model):
         return cls.objects.filter(
             ip_address=ip_address,
             created_at__gt=time_threshold
-        )
\ No newline at end of file
+        )
+
+
+class ArchivedURL(models.Model):
+    """
+    A URL moved out of the hot table by `manage.py purge_urls`, either because
+    it expired or because it is older than SHORTENER_RETENTION allows.
+    Archived rows are grouped by creation month so old months can be dropped
+    in one range delete.
+    """
+    original_url = models.URLField(max_length=2000)
+    short_code = models.CharField(max_length=16, unique=True)
+    created_at = models.DateTimeField()
+    created_month = models.DateField(db_index=True)  # first day of the creation month
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    # Carried over from URL, so a disabled link stays disabled once archived
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=ACTIVE, db_default=ACTIVE)
+    status_reason = models.CharField(max_length=255, blank=True, default='', db_default='')
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.original_url} -> {self.short_code} (archived)"
+
+
+class CodeSequence(models.Model):
+    """A named counter that code generators reserve blocks of values from."""
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+
+
+class ClickCount(models.Model):
+    """Aggregated redirect counts per short code, time bucket, referrer and country."""
+    short_code = models.CharField(max_length=16)
+    bucket = models.DateTimeField()  # start of the time bucket
+    referrer = models.CharField(max_length=255, blank=True)  # referring host
+    country = models.CharField(max_length=2, blank=True)
+    clicks = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['short_code', 'bucket', 'referrer', 'country'],
+                name='unique_click_bucket',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.short_code} @ {self.bucket}: {self.clicks}"
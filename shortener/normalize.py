@@ -0,0 +1,47 @@
+import hashlib
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    """
+    Canonicalize a URL for duplicate detection.
+
+    Lowercases the scheme and host, drops the default port and any trailing
+    slash on the path. Query strings and fragments are kept as they are.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').rstrip('.')
+    if ':' in host:
+        host = f'[{host}]'  # IPv6 literal
+
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host
+    if port is not None and DEFAULT_PORTS.get(scheme) != port:
+        netloc = f'{netloc}:{port}'
+    if parts.username is not None:
+        userinfo = parts.username
+        if parts.password is not None:
+            userinfo = f'{userinfo}:{parts.password}'
+        netloc = f'{userinfo}@{netloc}'
+
+    return urlunsplit((scheme, netloc, parts.path.rstrip('/'), parts.query, parts.fragment))
+
+
+def url_digest(url):
+    """Return the SHA-256 hex digest of the normalized URL."""
+    return hashlib.sha256(normalize_url(url).encode('utf-8')).hexdigest()
+
+
+def url_domain(url):
+    """Return the lowercased host of a URL, as stored in URL.domain."""
+    try:
+        host = urlsplit(url.strip()).hostname or ''
+    except ValueError:
+        return ''
+    return host.rstrip('.')[:255]
@@ -0,0 +1,229 @@
+import ipaddress
+import math
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .cache import LRUCache
+
+DEFAULT_RATE_LIMITS = {
+    'BACKEND': 'cache',        # 'cache' (shared Django cache) or 'memory' (per worker)
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'ratelimit:',
+    'MAX_KEYS': 100000,        # size bound for the memory backend
+    'POLICIES': {
+        'create': [
+            {'scope': 'ip', 'algorithm': 'sliding_window', 'limit': 10, 'window': 600},
+        ],
+        # Charged one unit per URL by the bulk API, so a full batch must fit
+        'bulk': [
+            {'scope': 'ip', 'algorithm': 'sliding_window', 'limit': 2000, 'window': 3600},
+        ],
+    },
+}
+
+
+class RateLimitResult(namedtuple('RateLimitResult', ['allowed', 'retry_after', 'rule'])):
+    """Outcome of a rate limit check; retry_after is in seconds (0 when allowed)."""
+
+    @property
+    def retry_after_header(self):
+        """The Retry-After header value: whole seconds, rounded up."""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class MemoryStore:
+    """Per-worker counter storage, bounded by an LRU."""
+
+    def __init__(self, max_keys):
+        self._data = LRUCache(max_keys, ttl=0)
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        return {key: self._data.get(key) for key in keys}
+
+    def set(self, key, value, ttl):
+        self._data.set(key, value, ttl)
+
+    def incr(self, key, delta, ttl):
+        with self._lock:
+            self._data.set(key, (self._data.get(key) or 0) + delta, ttl)
+
+    def clear(self):
+        self._data.clear()
+
+
+class CacheStore:
+    """Counter storage in a Django cache, shared by every worker using it."""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_many(self, keys):
+        return self.cache.get_many(keys)
+
+    def set(self, key, value, ttl):
+        self.cache.set(key, value, ttl)
+
+    def incr(self, key, delta, ttl):
+        if not self.cache.add(key, delta, ttl):
+            try:
+                self.cache.incr(key, delta)
+            except ValueError:
+                # The key expired between add() and incr()
+                self.cache.set(key, delta, ttl)
+
+    def clear(self):
+        pass  # Entries expire on their own; clear the cache itself to reset
+
+
+class SlidingWindowCounter:
+    """
+    Sliding window approximated from two fixed windows.
+
+    The count for the current window is added to the previous window's count
+    weighted by how much of it still overlaps the sliding window. Two counters
+    per key, one read and one increment per check.
+    """
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+
+    def _keys(self, key, now):
+        index = int(now // self.window)
+        return index, '%s:%d' % (key, index), '%s:%d' % (key, index - 1)
+
+    def check(self, store, key, cost, now):
+        index, current_key, previous_key = self._keys(key, now)
+        counts = store.get_many([current_key, previous_key])
+        current = counts.get(current_key) or 0
+        previous = counts.get(previous_key) or 0
+        elapsed = now - index * self.window
+
+        estimate = previous * (1 - elapsed / self.window) + current
+        if estimate + cost <= self.limit:
+            return True, 0, lambda: store.incr(current_key, cost, 2 * self.window)
+        return False, self._retry_after(previous, current, elapsed, cost), None
+
+    def _retry_after(self, previous, current, elapsed, cost):
+        room = self.limit - cost
+        if room < 0:
+            return self.window  # This request can never fit
+        if room - current >= 0 and previous > 0:
+            # Wait for enough of the previous window to slide out
+            return max(0, self.window * (1 - (room - current) / previous) - elapsed)
+        # Wait for the next window, where the current count becomes the weighted one
+        wait = self.window - elapsed
+        if current > 0:
+            wait += max(0, self.window * (1 - room / current))
+        return wait
+
+
+class TokenBucket:
+    """
+    Token bucket holding up to limit tokens, refilled at limit/window per second.
+
+    Allows bursts of up to limit requests. On the cache backend the
+    read-modify-write is not atomic, so concurrent workers may occasionally
+    let a request or two over the limit.
+    """
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.rate = limit / window
+
+    def check(self, store, key, cost, now):
+        state = store.get_many([key]).get(key)
+        tokens, updated = state if state else (self.limit, now)
+        tokens = min(self.limit, tokens + (now - updated) * self.rate)
+        if tokens >= cost:
+            return True, 0, lambda: store.set(key, (tokens - cost, now), 2 * self.window)
+        if cost > self.limit:
+            return False, self.window, None
+        return False, (cost - tokens) / self.rate, None
+
+
+ALGORITHMS = {
+    'sliding_window': SlidingWindowCounter,
+    'token_bucket': TokenBucket,
+}
+
+
+def scope_key(rule, ip_address):
+    """Return the identity a rule counts against: the IP itself or its subnet."""
+    if not ip_address:
+        return 'unknown'
+    if rule.get('scope', 'ip') == 'ip':
+        return ip_address
+    try:
+        address = ipaddress.ip_address(ip_address.strip())
+    except ValueError:
+        return ip_address
+    prefix = rule.get('ipv4_prefix', 24) if address.version == 4 else rule.get('ipv6_prefix', 64)
+    return str(ipaddress.ip_network('%s/%d' % (address, prefix), strict=False))
+
+
+class RateLimiter:
+    """Checks requests against the rules of a named policy, e.g. 'create'."""
+
+    def __init__(self, config=None):
+        self.config = dict(DEFAULT_RATE_LIMITS, **(config or {}))
+        if self.config['BACKEND'] == 'memory':
+            self.store = MemoryStore(self.config['MAX_KEYS'])
+        else:
+            self.store = CacheStore(self.config['CACHE_ALIAS'])
+        self.policies = {
+            name: [
+                (rule, ALGORITHMS[rule.get('algorithm', 'sliding_window')](
+                    rule['limit'], rule['window']))
+                for rule in rules
+            ]
+            for name, rules in self.config['POLICIES'].items()
+        }
+
+    def _rules(self, policy):
+        return self.policies.get(policy, self.policies.get('create', []))
+
+    def max_cost(self, policy='create'):
+        """The largest cost a single check of policy can ever be allowed, or None if unlimited."""
+        limits = [rule['limit'] for rule, _ in self._rules(policy)]
+        return min(limits) if limits else None
+
+    def check(self, ip_address, policy='create', cost=1):
+        """
+        Check and consume cost units of every rule in policy for ip_address.
+
+        Nothing is consumed unless all rules allow the request. Policies that
+        are not configured fall back to 'create'.
+        """
+        rules = self._rules(policy)
+        now = time.time()
+        commits = []
+        denied = None
+        for index, (rule, algorithm) in enumerate(rules):
+            key = '%s%s:%d:%s' % (self.config['KEY_PREFIX'], policy, index, scope_key(rule, ip_address))
+            allowed, retry_after, commit = algorithm.check(self.store, key, cost, now)
+            if allowed:
+                commits.append(commit)
+            elif denied is None or retry_after > denied.retry_after:
+                denied = RateLimitResult(False, retry_after, rule)
+        if denied is not None:
+            return denied
+        for commit in commits:
+            commit()
+        return RateLimitResult(True, 0, None)
+
+    def reset(self):
+        self.store.clear()
+
+
+rate_limiter = RateLimiter(getattr(settings, 'SHORTENER_RATE_LIMITS', None))
@@ -0,0 +1,359 @@
+"""
+Deferred reputation checks for new links.
+
+With SHORTENER_REPUTATION['ENABLED'], links are created in the 'pending'
+state and redirect straight away, but every cache tier (and the HTTP
+Cache-Control header) treats them as expiring within PENDING_CACHE_TTL
+seconds. `manage.py check_pending_urls` scores pending links in a thread
+pool against the configured sources; links that pass become 'active' and
+links that fail are 'disabled' and dropped from the redirect cache.
+
+Links whose checks are inconclusive (a source failed) stay pending and are
+retried after RETRY_DELAY seconds, doubling up to MAX_RETRY_DELAY.
+
+A source is any class with a check(url, host) method returning None when
+the URL looks fine or a reason string when it should be disabled. Sources
+with per_domain = True only look at the host, so their answers are cached
+per domain for DOMAIN_CACHE_TTL seconds.
+"""
+import http.client
+import ipaddress
+import logging
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = 'active'
+PENDING = 'pending'
+DISABLED = 'disabled'
+
+DEFAULT_REPUTATION = {
+    'ENABLED': False,
+    'SOURCES': [
+        {'BACKEND': 'shortener.reputation.DNSSource'},
+        {'BACKEND': 'shortener.reputation.RedirectChainSource'},
+    ],
+    'WORKERS': 16,                # concurrent checks
+    'BATCH_SIZE': 200,            # pending links claimed per pass
+    'RETRY_DELAY': 30,            # seconds before an inconclusive check is retried; doubles
+    'MAX_RETRY_DELAY': 3600,      # cap on that delay
+    'POLL_INTERVAL': 5,           # seconds between passes with --loop
+    'DOMAIN_CACHE_TTL': 3600,     # seconds a per-domain answer is reused
+    'DOMAIN_CACHE_SIZE': 100000,
+    'PENDING_CACHE_TTL': 60,      # seconds a pending link may be cached anywhere
+}
+
+
+def get_config():
+    return dict(DEFAULT_REPUTATION, **getattr(settings, 'SHORTENER_REPUTATION', {}))
+
+
+def initial_status():
+    """The status new links are created with."""
+    return PENDING if get_config()['ENABLED'] else ACTIVE
+
+
+def cache_expiry(status, expires_at):
+    """
+    When a link should drop out of caches: its expiry, or for pending links
+    at most PENDING_CACHE_TTL seconds from now, so a link that is disabled
+    later stops redirecting everywhere within that time.
+    """
+    if status != PENDING:
+        return expires_at
+    limit = timezone.now() + timedelta(seconds=get_config()['PENDING_CACHE_TTL'])
+    return limit if expires_at is None else min(expires_at, limit)
+
+
+class DNSSource:
+    """Fails hosts that do not resolve, or that resolve to private addresses."""
+
+    per_domain = True
+
+    def __init__(self, allow_private=False):
+        self.allow_private = allow_private
+
+    def check(self, url, host):
+        try:
+            infos = socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)
+        except socket.gaierror as e:
+            if e.errno in (socket.EAI_NONAME, getattr(socket, 'EAI_NODATA', socket.EAI_NONAME)):
+                return "Domain does not resolve"
+            raise
+        if not self.allow_private:
+            for info in infos:
+                address = ipaddress.ip_address(info[4][0].split('%')[0])
+                if not address.is_global:
+                    return f"Domain resolves to a non-public address ({address})"
+        return None
+
+
+class NonPublicAddress(OSError):
+    """Raised instead of connecting to a loopback, private or link-local address."""
+
+
+def connect_public(address, *args, **kwargs):
+    """
+    socket.create_connection() for hosts that only resolve to public
+    addresses. It connects to the addresses it checked rather than resolving
+    the host again, so a DNS answer that changes in between cannot slip an
+    internal address through.
+    """
+    host, port = address
+    addresses = []
+    for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM):
+        ip = ipaddress.ip_address(info[4][0].split('%')[0])
+        if not ip.is_global:
+            raise NonPublicAddress(f"{host} resolves to a non-public address ({ip})")
+        addresses.append(str(ip))
+    error = OSError(f"{host} has no addresses")
+    for ip in dict.fromkeys(addresses):
+        try:
+            return socket.create_connection((ip, port), *args, **kwargs)
+        except OSError as e:
+            error = e
+    raise error
+
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = connect_public
+
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = connect_public
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, request):
+        return self.do_open(_PublicHTTPConnection, request)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, request):
+        return self.do_open(_PublicHTTPSConnection, request, context=self._context)
+
+
+class RedirectChainSource:
+    """
+    Follows the redirect chain with HEAD requests and runs every hop through
+    the spam matcher. Unreachable sites are not failed: a link to a site
+    that is down is not abusive.
+
+    Anyone can submit a URL, so every hop is resolved first and links that
+    lead to a non-public address (loopback, private networks, cloud metadata
+    endpoints) are failed without being fetched. Requests go out directly,
+    never through an HTTP proxy from the environment, whose own address
+    would hide where they end up. allow_private turns this off for private
+    deployments.
+    """
+
+    per_domain = False
+
+    def __init__(self, max_redirects=5, timeout=5, user_agent='url-shortener-reputation/1.0',
+                 allow_private=False):
+        self.max_redirects = max_redirects
+        self.timeout = timeout
+        self.user_agent = user_agent
+        if allow_private:
+            self.opener = urllib.request.build_opener(_NoRedirect)
+        else:
+            self.opener = urllib.request.build_opener(
+                urllib.request.ProxyHandler({}), _PublicHTTPHandler, _PublicHTTPSHandler, _NoRedirect)
+
+    def check(self, url, host):
+        from .spam_detection import is_spam_url
+
+        for hop in range(self.max_redirects + 1):
+            if urlsplit(url).scheme not in ('http', 'https'):
+                return None
+            request = urllib.request.Request(url, method='HEAD', headers={'User-Agent': self.user_agent})
+            try:
+                response = self.opener.open(request, timeout=self.timeout)
+                response.close()
+                return None
+            except urllib.error.HTTPError as e:
+                location = e.headers.get('Location') if 300 <= e.code < 400 else None
+                if location is None:
+                    return None
+            except urllib.error.URLError as e:
+                if isinstance(e.reason, NonPublicAddress):
+                    return f"{'Redirects' if hop else 'Points'} to a non-public address ({e.reason})"
+                return None
+            except (OSError, ValueError):
+                return None
+            url = urljoin(url, location)
+            is_spam, reason = is_spam_url(url)
+            if is_spam:
+                return f"Redirects to a flagged URL ({reason})"
+        return f"More than {self.max_redirects} redirects"
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class BlocklistFeedSource:
+    """
+    Fails hosts on an external domain blocklist (one domain per line, '#'
+    comments), downloaded from url and refreshed every refresh_interval
+    seconds. Subdomains of a listed domain are blocked too.
+    """
+
+    per_domain = True
+
+    def __init__(self, url, refresh_interval=3600, timeout=30):
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.matcher = None
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+    def fetch(self):
+        with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+            text = response.read().decode('utf-8', 'replace')
+        return [line.split('#', 1)[0].strip() for line in text.splitlines() if line.split('#', 1)[0].strip()]
+
+    def _matcher(self):
+        from .spam_detection import SpamMatcher
+
+        with self._lock:
+            if self.loaded_at is None or time.monotonic() - self.loaded_at >= self.refresh_interval:
+                try:
+                    domains = self.fetch()
+                    self.matcher = SpamMatcher(keywords=(), suspicious_tlds=(), blocked_domains=domains)
+                except (OSError, ValueError):
+                    if self.matcher is None:
+                        raise
+                    logger.exception("Failed to refresh blocklist feed %s; keeping the old list", self.url)
+                self.loaded_at = time.monotonic()
+            return self.matcher
+
+    def check(self, url, host):
+        reason = self._matcher().match_host(host)
+        return f"Listed by {self.url} ({reason})" if reason else None
+
+
+def load_sources(config):
+    return [
+        import_string(source['BACKEND'])(**source.get('OPTIONS', {}))
+        for source in config['SOURCES']
+    ]
+
+
+class ReputationChecker:
+    """
+    Scores links against the configured sources, several at a time.
+
+    A source that raises counts as inconclusive: the link is left pending
+    and retried on the next pass rather than disabled on a flaky lookup.
+    """
+
+    def __init__(self, config=None, sources=None):
+        from .cache import LRUCache
+
+        self.config = dict(get_config(), **(config or {}))
+        self.sources = load_sources(self.config) if sources is None else sources
+        self.domain_cache = LRUCache(self.config['DOMAIN_CACHE_SIZE'], self.config['DOMAIN_CACHE_TTL'])
+        self.checks = self.domain_cache_hits = 0
+
+    def _check(self, source, original_url, host):
+        """Run one source; False if it raised."""
+        self.checks += 1
+        try:
+            return source.check(original_url, host)
+        except Exception:
+            logger.exception("%s failed for %s", type(source).__name__, original_url)
+            return False
+
+    def score(self, original_url):
+        """Return (ok, reason). ok is None if a source failed to answer."""
+        host = (urlsplit(original_url).hostname or '').lower().rstrip('.')
+        for index, source in enumerate(self.sources):
+            if source.per_domain:
+                key = (index, host)
+                cached = self.domain_cache.get(key)
+                if cached is not None:
+                    self.domain_cache_hits += 1
+                    reason = cached or None
+                else:
+                    reason = self._check(source, original_url, host)
+                    if reason is False:
+                        return None, None
+                    self.domain_cache.set(key, reason or '')
+            else:
+                reason = self._check(source, original_url, host)
+                if reason is False:
+                    return None, None
+            if reason:
+                return False, reason
+        return True, None
+
+    def retry_delay(self, attempts):
+        """Seconds to wait before checking a link again after attempts inconclusive checks."""
+        return min(self.config['RETRY_DELAY'] * 2 ** (attempts - 1), self.config['MAX_RETRY_DELAY'])
+
+    def check_pending(self, limit=None):
+        """
+        Score up to limit pending links (BATCH_SIZE by default) that are due
+        for a check, oldest due first, and record the outcome. Inconclusive
+        links are put back with a growing delay, so links that keep failing
+        do not hold up new ones. Returns {'active': n, 'disabled': n, 'retry': n}.
+        """
+        from .cache import redirect_cache
+        from .models import URL
+
+        now = timezone.now()
+        pending = list(
+            URL.objects.filter(status=PENDING, next_check_at__lte=now).order_by('next_check_at')
+            .values_list('id', 'short_code', 'original_url', 'check_attempts')[:limit or self.config['BATCH_SIZE']]
+        )
+        with ThreadPoolExecutor(self.config['WORKERS'], thread_name_prefix='reputation') as executor:
+            scores = list(executor.map(lambda row: self.score(row[2]), pending))
+
+        counts = {'active': 0, 'disabled': 0, 'retry': 0}
+        now = timezone.now()
+        passed = [row[0] for row, (ok, _) in zip(pending, scores) if ok]
+        # Only pending rows are updated, so a status set by hand in the meantime wins
+        counts['active'] = URL.objects.filter(id__in=passed, status=PENDING).update(
+            status=ACTIVE, checked_at=now, updated_at=now)
+        for (url_id, short_code, _, attempts), (ok, reason) in zip(pending, scores):
+            if ok is None:
+                counts['retry'] += 1
+                URL.objects.filter(id=url_id, status=PENDING).update(
+                    check_attempts=attempts + 1, checked_at=now,
+                    next_check_at=now + timedelta(seconds=self.retry_delay(attempts + 1)))
+            elif not ok:
+                counts['disabled'] += URL.objects.filter(id=url_id, status=PENDING).update(
+                    status=DISABLED, status_reason=reason[:255], checked_at=now, updated_at=now)
+        for _, short_code, _, _ in pending:
+            redirect_cache.delete(short_code)
+        return counts
+
+
+def set_status(queryset, status, reason=''):
+    """Change the status of links by hand, dropping them from the redirect cache."""
+    from .cache import redirect_cache
+
+    codes = list(queryset.values_list('short_code', flat=True))
+    now = timezone.now()
+    updated = queryset.update(status=status, status_reason=reason, checked_at=now, updated_at=now)
+    for short_code in codes:
+        redirect_cache.delete(short_code)
+    return updated
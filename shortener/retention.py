@@ -0,0 +1,115 @@
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+DEFAULT_RETENTION = {
+    'ARCHIVE_EXPIRED': False,       # keep expired links in ArchivedURL instead of deleting them
+    'ARCHIVE_AFTER_MONTHS': None,   # move links created this many months ago to ArchivedURL
+    'BATCH_SIZE': 1000,             # rows moved per transaction
+    'BATCH_PAUSE': 0.1,             # seconds between batches, to let other writers in
+}
+
+
+def get_config():
+    return dict(DEFAULT_RETENTION, **getattr(settings, 'SHORTENER_RETENTION', {}))
+
+
+def month_start(moment):
+    """Return the first day of the month of a date or datetime."""
+    if isinstance(moment, datetime):
+        moment = timezone.localtime(moment) if timezone.is_aware(moment) else moment
+        moment = moment.date()
+    return moment.replace(day=1)
+
+
+def months_ago(months, now=None):
+    """Return the aware datetime at the start of the month `months` before now."""
+    start = month_start(now or timezone.now())
+    year, month = divmod(start.year * 12 + start.month - 1 - months, 12)
+    return timezone.make_aware(datetime(year, month + 1, 1))
+
+
+def archive_lookups_enabled():
+    """Whether links still live in ArchivedURL, so redirects must look there too."""
+    return get_config()['ARCHIVE_AFTER_MONTHS'] is not None
+
+
+def move_batch(queryset, batch_size, archive):
+    """
+    Delete (or archive, then delete) up to batch_size URL rows of queryset.
+
+    Each batch is its own short transaction, so locks on the URL table are
+    only ever held for batch_size rows. Returns the number of rows moved.
+    """
+    from .cache import redirect_cache
+    from .models import URL, ArchivedURL
+
+    fields = ['id', 'original_url', 'short_code', 'created_at', 'ip_address', 'expires_at',
+              'status', 'status_reason']
+    with transaction.atomic():
+        rows = list(queryset.order_by('id').values(*fields)[:batch_size])
+        if not rows:
+            return 0
+        if archive:
+            ArchivedURL.objects.bulk_create(
+                [
+                    ArchivedURL(created_month=month_start(row['created_at']),
+                                **{field: row[field] for field in fields[1:]})
+                    for row in rows
+                ],
+                ignore_conflicts=True,
+            )
+        URL.objects.filter(id__in=[row['id'] for row in rows]).delete()
+    for row in rows:
+        redirect_cache.delete(row['short_code'])
+    return len(rows)
+
+
+def move_all(queryset, archive, config):
+    moved = 0
+    while True:
+        count = move_batch(queryset, config['BATCH_SIZE'], archive)
+        moved += count
+        if count < config['BATCH_SIZE']:
+            return moved
+        time.sleep(config['BATCH_PAUSE'])
+
+
+def purge_urls(now=None, config=None):
+    """
+    Remove expired links, and archive old ones if ARCHIVE_AFTER_MONTHS is set.
+    Returns {'expired': n, 'archived': n}.
+    """
+    from .models import URL
+
+    config = config or get_config()
+    now = now or timezone.now()
+    counts = {
+        'expired': move_all(URL.objects.filter(expires_at__lte=now), config['ARCHIVE_EXPIRED'], config),
+        'archived': 0,
+    }
+    if config['ARCHIVE_AFTER_MONTHS'] is not None:
+        cutoff = months_ago(config['ARCHIVE_AFTER_MONTHS'], now)
+        counts['archived'] = move_all(URL.objects.filter(created_at__lt=cutoff), True, config)
+    return counts
+
+
+def drop_archived_months(before, config=None):
+    """Delete archived links created in months before `before` (a date). Returns the count."""
+    from .models import ArchivedURL
+
+    config = config or get_config()
+    before = month_start(before)
+    dropped = 0
+    while True:
+        ids = list(
+            ArchivedURL.objects.filter(created_month__lt=before)
+            .values_list('id', flat=True)[:config['BATCH_SIZE']]
+        )
+        if not ids:
+            return dropped
+        dropped += ArchivedURL.objects.filter(id__in=ids).delete()[0]
+        time.sleep(config['BATCH_PAUSE'])
@@ -0,0 +1,141 @@
+"""
+Request coalescing for redirect cache misses.
+
+When a link goes viral, many requests can miss the cache for the same code
+at once. SingleFlight lets the first of them (the leader) run the database
+lookup while the others wait for its result, so the burst costs one query
+per worker. With SHARED_LOCK on, workers also coordinate through a short
+lived cache.add() lock: the worker that gets it loads the link, and the
+others poll the shared cache for the value it stores, falling back to their
+own query after WAIT_TIMEOUT seconds.
+"""
+import asyncio
+import threading
+import time
+
+from django.conf import settings
+
+DEFAULT_SINGLE_FLIGHT = {
+    'ENABLED': True,
+    'SHARED_LOCK': False,      # also coalesce across workers via the shared cache
+    'LOCK_TIMEOUT': 5,         # seconds before an abandoned cross-worker lock expires
+    'WAIT_TIMEOUT': 0.5,       # seconds to wait for another worker's result
+    'POLL_INTERVAL': 0.01,     # first delay between polls of the shared cache; doubles
+}
+
+
+class _Call:
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time and shares its result."""
+
+    def __init__(self, config=None):
+        self.config = dict(DEFAULT_SINGLE_FLIGHT, **(config or {}))
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.collapsed = 0
+        self.shared_collapsed = 0
+        self.shared_timeouts = 0
+
+    def do(self, key, function):
+        """Return function(), or the result of an identical call already in flight."""
+        if not self.config['ENABLED']:
+            return function()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.collapsed += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            call.value = function()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.value
+
+    async def ado(self, key, function):
+        """Async version of do(); function returns an awaitable."""
+        if not self.config['ENABLED']:
+            return await function()
+        loop = asyncio.get_running_loop()
+        task = self._tasks.get(key)
+        if task is None or task.get_loop() is not loop:
+            # A task, so that a cancelled leader does not cancel its followers
+            task = self._tasks[key] = loop.create_task(function())
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.leaders += 1
+        else:
+            self.collapsed += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+    def _delays(self):
+        deadline = time.monotonic() + self.config['WAIT_TIMEOUT']
+        delay = self.config['POLL_INTERVAL']
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            yield min(delay, remaining)
+            delay *= 2
+
+    def wait_shared(self, get):
+        """Poll get() until it returns a value or WAIT_TIMEOUT passes."""
+        for delay in self._delays():
+            time.sleep(delay)
+            value = get()
+            if value is not None:
+                self.shared_collapsed += 1
+                return value
+        self.shared_timeouts += 1
+        return None
+
+    async def await_shared(self, aget):
+        """Async version of wait_shared()."""
+        for delay in self._delays():
+            await asyncio.sleep(delay)
+            value = await aget()
+            if value is not None:
+                self.shared_collapsed += 1
+                return value
+        self.shared_timeouts += 1
+        return None
+
+    def clear(self):
+        self.leaders = self.collapsed = self.shared_collapsed = self.shared_timeouts = 0
+
+    def stats(self):
+        return {
+            'in_flight': len(self._calls) + len(self._tasks),
+            'leaders': self.leaders,
+            'collapsed': self.collapsed,
+            'shared_collapsed': self.shared_collapsed,
+            'shared_timeouts': self.shared_timeouts,
+        }
+
+
+single_flight = SingleFlight(getattr(settings, 'SHORTENER_SINGLE_FLIGHT', None))
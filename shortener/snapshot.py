@@ -0,0 +1,331 @@
+"""
+Read-only redirect snapshots.
+
+A snapshot file holds short_code -> original_url pairs sorted by code, so
+lookups are a binary search over a memory-mapped file. Every worker that maps
+the same file shares the same page cache pages, and no database connection is
+needed.
+
+File layout (little endian):
+
+    header   magic 'SHRTSNAP', version (u32), kind (u32: 0 full, 1 delta),
+             count (u64), since (u64), until (u64), both Unix microseconds
+    index    count x u64 absolute record offsets, in code order
+    records  code length (u8), code, expires (u64 Unix time, 0 for never),
+             URL length (u32), URL (UTF-8); an empty URL is a tombstone
+
+A full snapshot covers the active rows as of until, the time its export
+started. A delta covers rows created or changed (URL.updated_at) from since
+to its own until, and is layered on top of the snapshot it extends. since is
+DELTA_OVERLAP seconds before the previous file's until: timestamps are taken
+before a row commits, so a row written just before an export may only become
+visible after it, and the overlap makes the next delta pick it up. Links
+that are no longer active (disabled or pending a check) are written to
+deltas as tombstones, which hide the code in older files so that lookups
+fall through to the database.
+"""
+import glob
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SHRTSNAP'
+VERSION = 3
+FULL, DELTA = 0, 1
+HEADER = struct.Struct('<8sIIQQQ')
+OFFSET = struct.Struct('<Q')
+EXPIRES = struct.Struct('<Q')
+URL_LENGTH = struct.Struct('<I')
+
+DEFAULT_SNAPSHOT = {
+    'PATH': None,                   # full snapshot file, or None to disable
+    'DELTA_DIR': None,              # directory scanned for *.delta files
+    'REFRESH_INTERVAL': 60,         # seconds between scans for new deltas
+    'FALLBACK_TO_DATABASE': True,   # query the database for codes not in the snapshot
+    'DELTA_OVERLAP': 300,           # seconds each delta reaches back before the previous file
+}
+
+
+class SnapshotError(Exception):
+    """Raised for unreadable or inconsistent snapshot files."""
+
+
+def to_micros(moment):
+    return int(moment.timestamp() * 1000000) if moment is not None else 0
+
+
+def from_micros(value):
+    return datetime.fromtimestamp(value / 1000000, dt_timezone.utc) if value else None
+
+
+def write_snapshot(path, rows, kind=FULL, since=None, until=None):
+    """
+    Write (short_code, original_url, expires_at) rows, already sorted by
+    code, to path. expires_at, since and until are aware datetimes or None.
+
+    Records are streamed to a temporary file while their offsets are kept in
+    a compact array, then the header and index are written in front. The
+    final file is moved into place atomically. Returns the number of rows.
+    """
+    offsets = array('Q')
+    directory = os.path.dirname(os.path.abspath(path))
+    previous = None
+    with tempfile.TemporaryFile(dir=directory) as records:
+        position = 0
+        for short_code, original_url, expires_at in rows:
+            code = short_code.encode('ascii')
+            if previous is not None and code <= previous:
+                raise SnapshotError("Rows must be sorted by short code and unique")
+            previous = code
+            url = original_url.encode('utf-8')
+            expires = int(expires_at.timestamp()) if expires_at is not None else 0
+            offsets.append(position)
+            record = bytes([len(code)]) + code + EXPIRES.pack(expires) + URL_LENGTH.pack(len(url)) + url
+            records.write(record)
+            position += len(record)
+
+        base = HEADER.size + OFFSET.size * len(offsets)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(HEADER.pack(MAGIC, VERSION, kind, len(offsets), to_micros(since), to_micros(until)))
+                for offset in offsets:
+                    out.write(OFFSET.pack(base + offset))
+                records.seek(0)
+                while True:
+                    chunk = records.read(1 << 20)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    return len(offsets)
+
+
+class SnapshotFile:
+    """A memory-mapped snapshot or delta file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError(f"{path} is empty")
+        try:
+            if len(self._mmap) < HEADER.size:
+                raise SnapshotError(f"{path} is too short to be a snapshot")
+            magic, version, self.kind, self.count, since, until = HEADER.unpack_from(self._mmap)
+            if magic != MAGIC or version != VERSION:
+                raise SnapshotError(f"{path} is not a version {VERSION} snapshot")
+            if len(self._mmap) < HEADER.size + OFFSET.size * self.count:
+                raise SnapshotError(f"{path} is truncated")
+        except SnapshotError:
+            self._mmap.close()
+            raise
+        self.since, self.until = from_micros(since), from_micros(until)
+
+    def _key(self, index):
+        offset = OFFSET.unpack_from(self._mmap, HEADER.size + OFFSET.size * index)[0]
+        length = self._mmap[offset]
+        return offset, self._mmap[offset + 1:offset + 1 + length]
+
+    def _value(self, offset, key):
+        """Return (original_url, expires) for the record at offset."""
+        start = offset + 1 + len(key)
+        expires = EXPIRES.unpack_from(self._mmap, start)[0] or None
+        start += EXPIRES.size
+        length = URL_LENGTH.unpack_from(self._mmap, start)[0]
+        start += URL_LENGTH.size
+        return self._mmap[start:start + length].decode('utf-8'), expires
+
+    def entry(self, short_code):
+        """
+        Return (original_url, expires) for short_code, or None. expires is a
+        Unix timestamp or None, and is not checked here; original_url is ''
+        for a tombstone. O(log n).
+        """
+        try:
+            key = short_code.encode('ascii')
+        except UnicodeEncodeError:
+            return None
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset, candidate = self._key(middle)
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                return self._value(offset, candidate)
+        return None
+
+    def get(self, short_code):
+        """Return the original URL for short_code, or None if missing or expired."""
+        return unexpired_url(self.entry(short_code))
+
+    def __iter__(self):
+        """Yield (short_code, original_url, expires) in code order."""
+        for index in range(self.count):
+            offset, key = self._key(index)
+            yield (key.decode('ascii'),) + self._value(offset, key)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._mmap.close()
+
+
+class SnapshotStore:
+    """
+    A full snapshot plus the deltas layered on top of it.
+
+    Deltas are picked up from delta_dir (at most every refresh_interval
+    seconds) and must chain on from the snapshot: each one's since has to
+    be covered by the files already loaded. Lookups that find a refresh due
+    run it only if no other thread already is, and a delta that cannot be
+    applied is logged and retried on the next refresh rather than failing
+    the lookup.
+    """
+
+    def __init__(self, path, delta_dir=None, refresh_interval=60):
+        self.base = SnapshotFile(path)
+        self.delta_dir = delta_dir
+        self.refresh_interval = refresh_interval
+        self.deltas = []
+        self._loaded = set()
+        self._lock = threading.RLock()
+        self._next_refresh = 0
+        self.refresh()
+
+    @property
+    def until(self):
+        return self.deltas[-1].until if self.deltas else self.base.until
+
+    def apply_delta(self, path):
+        """Layer a delta file on top of the store."""
+        delta = SnapshotFile(path)
+        if delta.kind != DELTA:
+            raise SnapshotError(f"{path} is not a delta")
+        with self._lock:
+            if delta.since is None or delta.since > self.until:
+                delta.close()
+                raise SnapshotError(
+                    f"{path} starts at {delta.since}, but the store only covers up to {self.until}")
+            self.deltas.append(delta)
+            self._loaded.add(os.path.abspath(path))
+
+    def refresh(self):
+        """Load any new delta files from delta_dir, oldest first."""
+        with self._lock:
+            self._next_refresh = time.monotonic() + self.refresh_interval
+            if not self.delta_dir:
+                return
+            deltas = []
+            for path in glob.glob(os.path.join(self.delta_dir, '*.delta')):
+                if os.path.abspath(path) not in self._loaded:
+                    try:
+                        delta = SnapshotFile(path)
+                    except (SnapshotError, OSError):
+                        logger.exception("Skipping unreadable snapshot delta %s", path)
+                        continue
+                    deltas.append((delta.until, path))
+                    delta.close()
+            for until, path in sorted(deltas):
+                if until > self.until:
+                    try:
+                        self.apply_delta(path)
+                    except (SnapshotError, OSError):
+                        logger.exception("Skipping snapshot delta %s", path)
+
+    def entry(self, short_code):
+        """
+        Return (original_url, expires) from the newest file that has short_code,
+        or None if none has it or the newest one has a tombstone.
+        """
+        if self.delta_dir and time.monotonic() >= self._next_refresh and self._lock.acquire(blocking=False):
+            # Other threads keep serving from the files already loaded
+            try:
+                self.refresh()
+            finally:
+                self._lock.release()
+        for delta in reversed(self.deltas):
+            entry = delta.entry(short_code)
+            if entry is not None:
+                return entry if entry[0] else None
+        return self.base.entry(short_code)
+
+    def get(self, short_code):
+        return unexpired_url(self.entry(short_code))
+
+    def __len__(self):
+        return len(self.base) + sum(len(delta) for delta in self.deltas)
+
+
+def unexpired_url(entry):
+    if entry is None or not entry[0] or (entry[1] is not None and entry[1] <= time.time()):
+        return None
+    return entry[0]
+
+
+def snapshot_rows(queryset):
+    """
+    Order a URL queryset by code in byte order and yield (code, url, expires_at),
+    with a tombstone ('' for url) for every link that is not active.
+    """
+    from django.db import connections
+    from django.db.models.functions import Collate
+
+    from .reputation import ACTIVE
+
+    if connections[queryset.db].vendor == 'postgresql':
+        # Byte order, whatever the database's default collation is
+        queryset = queryset.order_by(Collate('short_code', 'C'))
+    else:
+        queryset = queryset.order_by('short_code')
+    rows = queryset.values_list('short_code', 'original_url', 'expires_at', 'status')
+    for short_code, original_url, expires_at, status in rows.iterator(chunk_size=10000):
+        if status == ACTIVE:
+            yield short_code, original_url, expires_at
+        else:
+            yield short_code, '', None
+
+
+def get_config():
+    return dict(DEFAULT_SNAPSHOT, **getattr(settings, 'SHORTENER_SNAPSHOT', {}))
+
+
+_store = None
+
+
+def get_snapshot_store():
+    """Return the process-wide SnapshotStore, or None if no snapshot is configured."""
+    global _store
+    config = get_config()
+    if _store is None and config['PATH']:
+        _store = SnapshotStore(config['PATH'], config['DELTA_DIR'], config['REFRESH_INTERVAL'])
+    return _store
+
+
+def reload_snapshot_store():
+    """Reopen the snapshot from settings, e.g. after a new full export."""
+    global _store
+    config = get_config()
+    _store = None
+    if config['PATH']:
+        _store = SnapshotStore(config['PATH'], config['DELTA_DIR'], config['REFRESH_INTERVAL'])
+    return _store
@@ -1,38 +1,194 @@
+from collections import deque
+
+from django.conf import settings
+
+from .metrics import is_sampled, registry
+
+# Default blocklists, extended or replaced through settings.SHORTENER_SPAM
+DEFAULT_SPAM_KEYWORDS = [
+    'casino', 'poker', 'viagra', 'cialis', 'sex', 'xxx',
+    'porn', 'bet', 'lottery', 'free-money', 'make-money-fast',
+    'get-rich', 'pharma', 'meds', 'pills', 'prescription'
+]
+
+DEFAULT_SUSPICIOUS_TLDS = ['.xyz', '.top', '.win', '.loan', '.online']
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over a list of keywords.
+
+    Finds every keyword occurrence in a single pass over the text, however
+    many keywords there are. When several keywords match, the one that comes
+    first in the original list wins, just like checking them one by one.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        self.goto = [{}]
+        self.fail = [0]
+        # Lowest keyword index that ends at each state (following fail links)
+        self.output = [None]
+
+        for index, keyword in enumerate(self.keywords):
+            if not keyword:
+                continue
+            state = 0
+            for char in keyword:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(None)
+                state = next_state
+            if self.output[state] is None:
+                self.output[state] = index
+
+        # Breadth-first pass to link every state to its longest proper suffix
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                inherited = self.output[self.fail[next_state]]
+                if inherited is not None and (
+                        self.output[next_state] is None or inherited < self.output[next_state]):
+                    self.output[next_state] = inherited
+
+    def first_match(self, text):
+        """Return the earliest-listed keyword found in text, or None."""
+        goto, fail, output = self.goto, self.fail, self.output
+        best = None
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            found = output[state]
+            if found is not None and (best is None or found < best):
+                best = found
+                if best == 0:
+                    break
+        return None if best is None else self.keywords[best]
+
+
+class SpamMatcher:
+    """
+    Compiled spam rules: one automaton for keywords and a suffix table for
+    domains and TLDs. Build once and reuse; building is the expensive part.
+    """
+
+    def __init__(self, keywords=DEFAULT_SPAM_KEYWORDS, suspicious_tlds=DEFAULT_SUSPICIOUS_TLDS,
+                 blocked_domains=(), max_subdomain_dots=3, max_length=1000):
+        self.keywords = KeywordAutomaton(keyword.lower() for keyword in keywords)
+        # Keyed by host suffix ('xyz', 'spam.example'), so a lookup costs one
+        # set probe per label of the host
+        self.suffixes = {}
+        for domain in blocked_domains:
+            domain = domain.lower().strip('.')
+            self.suffixes.setdefault(domain, f"URL uses blocked domain: {domain}")
+        for tld in suspicious_tlds:
+            tld = tld.lower().strip('.')
+            self.suffixes[tld] = f"URL uses suspicious TLD: .{tld}"
+        self.max_subdomain_dots = max_subdomain_dots
+        self.max_length = max_length
+
+    @classmethod
+    def from_settings(cls):
+        """Build a matcher from settings.SHORTENER_SPAM and the files it lists."""
+        config = getattr(settings, 'SHORTENER_SPAM', {})
+        keywords = list(config.get('KEYWORDS', DEFAULT_SPAM_KEYWORDS))
+        domains = list(config.get('BLOCKED_DOMAINS', ()))
+        for path in config.get('KEYWORD_FILES', ()):
+            keywords.extend(read_list(path))
+        for path in config.get('DOMAIN_FILES', ()):
+            domains.extend(read_list(path))
+        return cls(
+            keywords=keywords,
+            suspicious_tlds=config.get('SUSPICIOUS_TLDS', DEFAULT_SUSPICIOUS_TLDS),
+            blocked_domains=domains,
+            max_subdomain_dots=config.get('MAX_SUBDOMAIN_DOTS', 3),
+            max_length=config.get('MAX_LENGTH', 1000),
+        )
+
+    def match_host(self, host):
+        """Return the reason for the first blocked suffix of host, or None."""
+        host = host.strip('.')
+        position = len(host)
+        # Check 'com', then 'example.com', then 'www.example.com', ...
+        while position > 0:
+            position = host.rfind('.', 0, position)
+            reason = self.suffixes.get(host[position + 1:])
+            if reason is not None:
+                return reason
+        return None
+
+    def check(self, url):
+        """Return (is_spam, reason) for url."""
+        url_lower = url.lower()
+
+        keyword = self.keywords.first_match(url_lower)
+        if keyword is not None:
+            return True, f"URL contains blocked keyword: {keyword}"
+
+        domain_part = url_lower.split('://', 1)[-1].split('/', 1)[0]
+        host = domain_part.rsplit('@', 1)[-1].split(':', 1)[0]
+        reason = self.match_host(host)
+        if reason is not None:
+            return True, reason
+
+        # Check for excessive number of subdomains (potential phishing)
+        if domain_part.count('.') > self.max_subdomain_dots:
+            return True, "URL contains excessive subdomains"
+
+        # Check for extremely long URLs (often spam or malicious)
+        if len(url) > self.max_length:
+            return True, "URL is suspiciously long"
+
+        return False, None
+
+
+def read_list(path):
+    """Read a blocklist file: one entry per line, '#' starts a comment."""
+    with open(path, encoding='utf-8') as f:
+        return [
+            line.split('#', 1)[0].strip()
+            for line in f
+            if line.split('#', 1)[0].strip()
+        ]
+
+
+_matcher = None
+
+
+def get_matcher():
+    """Return the process-wide matcher, building it on first use."""
+    global _matcher
+    if _matcher is None:
+        _matcher = SpamMatcher.from_settings()
+    return _matcher
+
+
+def reload_matcher():
+    """Rebuild the matcher from settings, e.g. after a blocklist file changed."""
+    global _matcher
+    _matcher = SpamMatcher.from_settings()
+    return _matcher
+
 
 def is_spam_url(url):
     """
     Check if a URL appears to be spam based on some basic rules.
     Returns (is_spam, reason) tuple.
     """
-    # Convert to lowercase for case-insensitive matching
-    url_lower = url.lower()
-    
-    # List of spam keywords
-    spam_keywords = [
-        'casino', 'poker', 'viagra', 'cialis', 'sex', 'xxx',
-        'porn', 'bet', 'lottery', 'free-money', 'make-money-fast',
-        'get-rich', 'pharma', 'meds', 'pills', 'prescription'
-    ]
-    
-    # Check for spam keywords in URL
-    for keyword in spam_keywords:
-        if keyword in url_lower:
-            return True, f"URL contains blocked keyword: {keyword}"
-    
-    # Check for suspicious TLDs
-    suspicious_tlds = ['.xyz', '.top', '.win', '.loan', '.online']
-    for tld in suspicious_tlds:
-        if url_lower.endswith(tld):
-            return True, f"URL uses suspicious TLD: {tld}"
-    
-    # Check for excessive number of subdomains (potential phishing)
-    domain_part = url_lower.split('://', 1)[-1].split('/', 1)[0]
-    if domain_part.count('.') > 3:
-        return True, "URL contains excessive subdomains"
-    
-    # Check for extremely long URLs (often spam or malicious)
-    if len(url) > 1000:
-        return True, "URL is suspiciously long"
-    
-    # Not detected as spam
-    return False, None
\ No newline at end of file
+    if is_sampled():
+        with registry.timer('shortener_spam_check_duration_seconds'):
+            return get_matcher().check(url)
+    return get_matcher().check(url)
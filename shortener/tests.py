@@ -1,11 +1,68 @@
-from django.test import TestCase, RequestFactory
-from django.utils import timezone
-from django.urls import reverse
+import asyncio
+import contextvars
+import http.server
+import io
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
 from datetime import timedelta
-from .models import URL
+from unittest import mock
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.http import Http404, HttpResponse
+from django.test import (
+    AsyncRequestFactory, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import analytics, views
+from .benchmarking import call_wsgi, compare_to_baseline, legacy_is_spam_url, seed_urls, wsgi_environ
+from .bloom import BloomFilter, CodeFilter, code_filter
+from .cache import LRUCache, RedirectCache, redirect_cache
+from .clicks import ClickTracker, click_tracker
+from .codegen import FeistelPermutation, NodeSequenceCodeGenerator, SequenceCodeGenerator, decode, encode
+from .db_router import PrimaryReplicaRouter, ReplicaStickinessMiddleware, use_primary
+from .fastpath import FastRedirectWSGI
 from .forms import URLForm
-from .views import get_client_ip
-from .spam_detection import is_spam_url
+from .metrics import Histogram, registry
+from .middleware import MetricsMiddleware
+from .models import URL, ArchivedURL, ClickCount, CodeSequence
+from .normalize import normalize_url, url_digest
+from .ratelimit import RateLimiter, scope_key
+from .reputation import NonPublicAddress, RedirectChainSource, ReputationChecker, connect_public, set_status
+from .retention import drop_archived_months, months_ago, purge_urls
+from .search import EstimatedCountPaginator, classify, search_urls
+from .singleflight import SingleFlight, single_flight
+from .snapshot import DELTA, SnapshotError, SnapshotFile, SnapshotStore, reload_snapshot_store, write_snapshot
+from .spam_detection import KeywordAutomaton, SpamMatcher, is_spam_url
+from .views import bulk_shorten, get_client_ip, redirect_to_original_async
+from .warmup import warm_up
+from .writequeue import WriteQueue
+
+
+class ColdCacheMixin:
+    """Starts every test with empty Django and redirect caches."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        redirect_cache.clear()
+
 
 class URLModelTest(TestCase):
     def test_create_short_code(self):
@@ -103,6 +160,42 @@ class SpamDetectionTest(TestCase):
             self.assertTrue(is_spam, f"URL {url} should be flagged as spam")
             self.assertIsNotNone(reason, "Spam reason should be provided")
 
+    def test_keyword_automaton(self):
+        """Test that the automaton reports the earliest-listed matching keyword"""
+        automaton = KeywordAutomaton(['he', 'she', 'his', 'hers'])
+        self.assertEqual(automaton.first_match('ushers'), 'he')
+        self.assertEqual(automaton.first_match('ahishe'), 'he')
+        self.assertEqual(automaton.first_match('this'), 'his')
+        self.assertIsNone(automaton.first_match('nothing to see'))
+
+    def test_matches_legacy_behaviour(self):
+        """Test that the compiled matcher agrees with per-keyword scanning"""
+        matcher = SpamMatcher()
+        keywords = ['casino', 'poker', 'viagra', 'cialis', 'sex', 'xxx',
+                    'porn', 'bet', 'lottery', 'free-money', 'make-money-fast',
+                    'get-rich', 'pharma', 'meds', 'pills', 'prescription']
+        urls = [
+            "https://example.com/alphabet-soup",
+            "https://xxx-sex.example.com",
+            "https://example.com/pharmacy/pills",
+            "https://a.b.c.d.example.com/",
+            "https://example.com/" + "a" * 1200,
+            "https://GET-RICH.example.com/Poker",
+        ]
+        for url in urls:
+            self.assertEqual(matcher.check(url),
+                             legacy_is_spam_url(url, keywords, ['.xyz', '.top', '.win', '.loan', '.online']))
+
+    def test_domain_suffixes(self):
+        """Test that blocked domains and TLDs match on the host's suffix"""
+        matcher = SpamMatcher(keywords=[], blocked_domains=['bad.example'])
+        self.assertEqual(matcher.check("https://www.bad.example/page"),
+                         (True, "URL uses blocked domain: bad.example"))
+        self.assertEqual(matcher.check("https://user@site.xyz:8080/"),
+                         (True, "URL uses suspicious TLD: .xyz"))
+        self.assertEqual(matcher.check("https://notbad.example/"), (False, None))
+        self.assertEqual(matcher.check("https://example.com/file.xyz"), (False, None))
+
 
 class URLFormTest(TestCase):
     def test_form_validation(self):
@@ -126,8 +219,9 @@ class URLFormTest(TestCase):
                     "Error message should mention spam")
 
 
-class ViewsTest(TestCase):
+class ViewsTest(ColdCacheMixin, TestCase):
     def setUp(self):
+        super().setUp()
         # Every test needs access to the request factory
         self.factory = RequestFactory()
     
@@ -173,6 +267,8 @@ class ViewsTest(TestCase):
         self.assertTrue(len(messages) > 0, "Should have an error message")
         self.assertIn('rate limit', str(messages[0]).lower(), 
                     "Message should mention rate limit")
+        self.assertIn('Retry-After', response,
+                      "Rate limited responses should say when to retry")
     
     def test_redirect_view(self):
         """Test that short URLs correctly redirect to original URLs"""
@@ -192,4 +288,1412 @@ class ViewsTest(TestCase):
         # Test a non-existent short code
         response = self.client.get('/nonexistent')
         self.assertEqual(response.status_code, 404,
-                        "Should return a 404 for non-existent short codes")
\ No newline at end of file
+                        "Should return a 404 for non-existent short codes")
+
+
+class RedirectCacheTest(ColdCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.redirect_cache = RedirectCache()
+
+    def test_lru_eviction_and_ttl(self):
+        """Test that the per-worker LRU is bounded and honours TTLs"""
+        lru = LRUCache(max_entries=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')  # 'a' is now the most recently used entry
+        lru.set('c', 3)
+        self.assertIsNone(lru.get('b'), "Least recently used entry should be evicted")
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.stats()['evictions'], 1)
+
+        lru.set('d', 4, ttl=-1)
+        self.assertIsNone(lru.get('d'), "Expired entries should not be returned")
+
+    def test_read_through_and_negative_caching(self):
+        """Test that lookups only hit the database once per code"""
+        URL.objects.create(original_url='https://example.com/cached', short_code='cache1')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.redirect_cache.lookup('cache1'), 'https://example.com/cached')
+            self.assertEqual(self.redirect_cache.lookup('cache1'), 'https://example.com/cached')
+
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.redirect_cache.lookup('nope00'))
+            self.assertIsNone(self.redirect_cache.lookup('nope00'))
+
+        # A second worker with a cold LRU is served from the shared tier
+        other_worker = RedirectCache()
+        with self.assertNumQueries(0):
+            self.assertEqual(other_worker.lookup('cache1'), 'https://example.com/cached')
+            self.assertIsNone(other_worker.lookup('nope00'))
+
+        stats = self.redirect_cache.stats()
+        self.assertEqual(stats['db_lookups'], 2)
+        self.assertEqual(stats['negative_hits'], 2)
+
+    def test_write_through_replaces_negative_entry(self):
+        """Test that creating a URL overwrites a cached 404 for its code"""
+        self.assertIsNone(self.redirect_cache.lookup('new123'))
+        self.redirect_cache.set('new123', 'https://example.com/new')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.redirect_cache.lookup('new123'), 'https://example.com/new')
+
+
+class CodeGeneratorTest(TestCase):
+    def test_base62_round_trip(self):
+        """Test that base62 encoding is fixed-width and reversible"""
+        self.assertEqual(encode(0, 6), '000000')
+        self.assertEqual(len(encode(62 ** 6 - 1, 6)), 6)
+        for number in (1, 61, 62, 12345678, 62 ** 6 - 1):
+            self.assertEqual(decode(encode(number, 6)), number)
+        with self.assertRaises(ValueError):
+            encode(62 ** 6, 6)
+
+    def test_permutation_is_bijective(self):
+        """Test that the keyed permutation maps the code space onto itself"""
+        permutation = FeistelPermutation(62 ** 2, 'test-key')
+        values = [permutation.permute(value) for value in range(62 ** 2)]
+        self.assertEqual(sorted(values), list(range(62 ** 2)))
+        self.assertNotEqual(values[:10], list(range(10)), "Codes should not be sequential")
+
+    def test_node_allocators_never_collide(self):
+        """Simulate several nodes allocating codes with no shared state"""
+        nodes = [NodeSequenceCodeGenerator(node_id, block_size=25, key='k') for node_id in (0, 1, 7, 61)]
+        rng = random.Random(42)
+        codes = []
+        for _ in range(400):
+            node = rng.choice(nodes)
+            if rng.random() < 0.1:
+                codes.extend(node.generate_many(rng.randint(2, 60)))
+            else:
+                codes.append(node.generate())
+        self.assertEqual(len(set(codes)), len(codes), "Codes should never repeat across nodes")
+        self.assertTrue(all(len(code) == 7 for code in codes))
+        self.assertEqual({code[0] for code in codes}, {'0', '1', '7', 'Z'})
+        # Every node counts from zero in its own sequence; only the prefix keeps them apart
+        self.assertEqual(
+            set(CodeSequence.objects.values_list('name', flat=True)),
+            {'node-0', 'node-1', 'node-7', 'node-61'},
+        )
+        self.assertEqual(nodes[0].code_for(0)[1:], nodes[1].code_for(0)[1:])
+
+        legacy = SequenceCodeGenerator(sequence='default', key='k').generate_many(100)
+        URL.objects.bulk_create(
+            URL(original_url=f'https://example.com/node/{i}', short_code=code)
+            for i, code in enumerate(codes + legacy)
+        )
+        with self.assertRaises(ImproperlyConfigured):
+            NodeSequenceCodeGenerator(62, prefix_length=1)
+
+    def test_create_url_without_existence_probe(self):
+        """Test that a generated code is inserted without checking it first"""
+        short_code = URL.create_short_code()
+        with self.assertNumQueries(1):
+            URL.objects.create(
+                original_url='https://example.com/one-insert',
+                short_code=short_code,
+            )
+
+
+class CodeBlockReservationTest(TransactionTestCase):
+    # Not TestCase: blocks are only kept outside transactions on SQLite
+
+    def test_block_allocation(self):
+        """Test that a worker reserves a whole block of codes with one query"""
+        generator = SequenceCodeGenerator(block_size=50, sequence='test', key='k')
+        first = generator.generate()
+
+        with self.assertNumQueries(0):
+            codes = [generator.generate() for _ in range(49)]
+        with self.assertNumQueries(1):
+            codes.append(generator.generate())
+
+        # A second worker gets a disjoint block from the same sequence
+        other = SequenceCodeGenerator(block_size=50, sequence='test', key='k')
+        codes.extend(other.generate_many(200))
+        codes.append(first)
+        self.assertEqual(len(set(codes)), len(codes), "Codes should never repeat")
+        self.assertTrue(all(len(code) == 6 for code in codes))
+
+    def test_reservation_survives_rollback(self):
+        """Test that a rolled back INSERT does not leave a block other workers re-reserve"""
+        first = SequenceCodeGenerator(sequence='rollback', key='k')
+        codes = []
+        try:
+            with transaction.atomic():
+                codes.append(first.generate())
+                raise IntegrityError('duplicate short code')
+        except IntegrityError:
+            pass
+        other = SequenceCodeGenerator(sequence='rollback', key='k')
+        codes.extend(first.generate() for _ in range(5))
+        codes.extend(other.generate() for _ in range(5))
+        self.assertEqual(len(set(codes[1:])), 10, "Codes should never repeat")
+
+    def test_shorten_draws_code_outside_transaction(self):
+        """Test that URL.shorten reserves codes before its INSERT transaction"""
+        generator = SequenceCodeGenerator(sequence='shorten', key='k')
+        with mock.patch('shortener.codegen._generator', generator):
+            url, created = URL.shorten('https://example.com/reserved')
+        self.assertTrue(created)
+        self.assertEqual(generator._end - generator._next, generator.block_size - 1)
+        self.assertEqual(CodeSequence.objects.get(name='shorten').next_value, generator.block_size)
+
+
+class RateLimiterTest(TestCase):
+    def limiter(self, rules):
+        return RateLimiter({'BACKEND': 'memory', 'POLICIES': {'create': rules}})
+
+    def test_sliding_window(self):
+        """Test that the sliding window counter enforces its limit"""
+        limiter = self.limiter([{'scope': 'ip', 'limit': 3, 'window': 60}])
+        for _ in range(3):
+            self.assertTrue(limiter.check('192.168.1.1').allowed)
+
+        result = limiter.check('192.168.1.1')
+        self.assertFalse(result.allowed)
+        self.assertGreater(result.retry_after, 0)
+        self.assertLessEqual(result.retry_after, 120)
+
+        # Other clients are counted separately
+        self.assertTrue(limiter.check('192.168.1.2').allowed)
+
+    def test_token_bucket_cost(self):
+        """Test that the token bucket charges the requested cost"""
+        limiter = self.limiter([
+            {'scope': 'ip', 'algorithm': 'token_bucket', 'limit': 10, 'window': 100},
+        ])
+        self.assertTrue(limiter.check('10.0.0.1', cost=8).allowed)
+        result = limiter.check('10.0.0.1', cost=5)
+        self.assertFalse(result.allowed)
+        # 3 more tokens are needed at a refill rate of 0.1 per second
+        self.assertAlmostEqual(result.retry_after, 30, delta=1)
+
+    def test_subnet_scope(self):
+        """Test that subnet rules group addresses by network prefix"""
+        rule = {'scope': 'subnet', 'ipv4_prefix': 24, 'ipv6_prefix': 64}
+        self.assertEqual(scope_key(rule, '10.1.2.3'), '10.1.2.0/24')
+        self.assertEqual(scope_key(rule, '2001:db8::1'), '2001:db8::/64')
+
+        limiter = self.limiter([dict(rule, limit=2, window=60)])
+        self.assertTrue(limiter.check('10.1.2.3').allowed)
+        self.assertTrue(limiter.check('10.1.2.4').allowed)
+        self.assertFalse(limiter.check('10.1.2.5').allowed)
+
+    def test_denied_rule_does_not_consume(self):
+        """Test that a request denied by one rule is not charged to the others"""
+        limiter = self.limiter([
+            {'scope': 'ip', 'limit': 100, 'window': 60},
+            {'scope': 'subnet', 'limit': 1, 'window': 60},
+        ])
+        self.assertTrue(limiter.check('10.0.0.1').allowed)
+        self.assertFalse(limiter.check('10.0.0.2').allowed)
+        self.assertFalse(limiter.check('10.0.0.2').allowed)
+        self.assertTrue(limiter.check('10.0.1.1').allowed)
+
+
+class DeduplicationTest(TestCase):
+    def test_normalize_url(self):
+        """Test that trivially different URLs normalize to the same string"""
+        self.assertEqual(normalize_url('HTTPS://Example.COM:443/'), 'https://example.com')
+        self.assertEqual(normalize_url('http://example.com:80/path/'), 'http://example.com/path')
+        self.assertEqual(normalize_url('http://example.com:8080/Path?Q=1'),
+                         'http://example.com:8080/Path?Q=1')
+        self.assertEqual(url_digest('https://example.com'), url_digest('https://EXAMPLE.com/'))
+        self.assertNotEqual(url_digest('https://example.com/a'), url_digest('https://example.com/A'))
+
+    def test_shorten_reuses_equivalent_url(self):
+        """Test that shortening an equivalent URL returns the existing code"""
+        url, created = URL.shorten('https://example.com/page/')
+        self.assertTrue(created)
+        with self.assertNumQueries(1):
+            same, created = URL.shorten('https://EXAMPLE.com:443/page')
+        self.assertFalse(created)
+        self.assertEqual(same.short_code, url.short_code)
+        self.assertEqual(URL.objects.count(), 1)
+
+
+class BulkShortenTest(ColdCacheMixin, TestCase):
+    def post_ndjson(self, lines):
+        response = self.client.post(
+            reverse('bulk_shorten'), '\n'.join(lines), content_type='application/x-ndjson')
+        return response
+
+    def test_bulk_shorten(self):
+        """Test that a batch returns one result per line, in order"""
+        existing = URL.objects.create(
+            original_url='https://example.com/existing', short_code='exist1',
+            url_hash=url_digest('https://example.com/existing'))
+        response = self.post_ndjson([
+            '"https://example.com/a"',
+            '{"url": "https://example.com/b"}',
+            '"https://EXAMPLE.com/existing/"',
+            '"not-a-url"',
+            '"https://online-casino.example.com"',
+            '"https://example.com/a"',
+            '{broken',
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        results = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        self.assertEqual([result['index'] for result in results], list(range(7)))
+        self.assertTrue(results[0]['created'])
+        self.assertTrue(results[1]['created'])
+        self.assertEqual(results[2]['short_code'], existing.short_code)
+        self.assertFalse(results[2]['created'])
+        self.assertIn('error', results[3])
+        self.assertIn('spam', results[4]['error'])
+        self.assertEqual(results[5]['short_code'], results[0]['short_code'])
+        self.assertFalse(results[5]['created'])
+        self.assertIn('error', results[6])
+        self.assertEqual(URL.objects.count(), 3)
+
+        # New codes are written through to the redirect cache
+        with self.assertNumQueries(0):
+            self.assertEqual(redirect_cache.lookup(results[1]['short_code']), 'https://example.com/b')
+
+    def test_bulk_rate_limit(self):
+        """Test that the whole batch is charged to the client's rate limit"""
+        limiter = RateLimiter({'BACKEND': 'memory', 'POLICIES': {
+            'bulk': [{'scope': 'ip', 'algorithm': 'sliding_window', 'limit': 15, 'window': 600}],
+        }})
+        lines = [f'"https://example.com/bulk{i}"' for i in range(10)]
+        with mock.patch('shortener.views.rate_limiter', limiter):
+            response = self.post_ndjson(lines)
+            self.assertEqual(response.status_code, 200)
+            b''.join(response.streaming_content)
+            response = self.post_ndjson(lines)
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response)
+
+            # A batch over the limit itself could never succeed: no Retry-After
+            response = self.post_ndjson(lines + lines[:6])
+            self.assertEqual(response.status_code, 413)
+            self.assertEqual(response.json()['limit'], 15)
+            self.assertNotIn('Retry-After', response)
+        self.assertEqual(URL.objects.count(), 10)
+
+    def test_default_bulk_policy_fits_a_full_batch(self):
+        """Test that the configured 'bulk' policy accepts MAX_URLS URLs"""
+        self.assertGreaterEqual(RateLimiter(settings.SHORTENER_RATE_LIMITS).max_cost('bulk'),
+                                settings.SHORTENER_BULK['MAX_URLS'])
+        self.assertGreaterEqual(RateLimiter().max_cost('bulk'), 1000)
+
+    def test_shorten_many_queries(self):
+        """Test that a batch costs one lookup and one insert on the URL table"""
+        with CaptureQueriesContext(connection) as queries:
+            results = URL.shorten_many([f'https://example.com/many{i}' for i in range(3)])
+        url_queries = [q['sql'].split()[0] for q in queries if 'shortener_url' in q['sql']]
+        self.assertEqual(url_queries, ['SELECT', 'INSERT'])
+        self.assertEqual(len({url.short_code for url, created in results}), 3)
+
+
+class ClickTrackingTest(ColdCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        click_tracker.flush()
+
+    def test_redirect_records_click(self):
+        """Test that redirects are buffered and flushed into counters"""
+        URL.objects.create(original_url='https://example.com/clicked', short_code='click1')
+        for _ in range(3):
+            self.client.get('/click1', HTTP_REFERER='https://news.example.org/item?id=1',
+                            HTTP_CF_IPCOUNTRY='nz')
+        self.client.get('/click1')
+        self.client.get('/nonexistent')
+        self.assertEqual(ClickCount.objects.count(), 0, "Clicks should not be written synchronously")
+
+        self.assertEqual(click_tracker.flush(), 2)
+        counts = {
+            (row.referrer, row.country): row.clicks
+            for row in ClickCount.objects.filter(short_code='click1')
+        }
+        self.assertEqual(counts, {('news.example.org', 'NZ'): 3, ('', ''): 1})
+
+    def test_malformed_referrer(self):
+        """Test that a Referer urlsplit cannot parse is recorded as none, not a 500"""
+        URL.objects.create(original_url='https://example.com/clicked', short_code='click2')
+        response = self.client.get('/click2', HTTP_REFERER='http://[oops/')
+        self.assertEqual(response.status_code, 301)
+
+        app = FastRedirectWSGI(lambda environ, start_response: None)
+        environ = wsgi_environ('/click2', host='localhost', HTTP_REFERER='http://[oops/')
+        self.assertEqual(call_wsgi(app, environ), '301 Moved Permanently')
+        click_tracker.flush()
+        self.assertEqual(ClickCount.objects.get(short_code='click2', referrer='').clicks, 2)
+
+    def test_flush_increments_existing_rows(self):
+        """Test that each flush adds to the counters with one upsert"""
+        tracker = ClickTracker()
+        request = RequestFactory().get('/abc123')
+        tracker.record('abc123', request)
+        tracker.flush()
+        tracker.record('abc123', request)
+        tracker.record('abc123', request)
+        tracker.record('xyz789', request)
+        with self.assertNumQueries(3):  # SAVEPOINT, INSERT ... ON CONFLICT, RELEASE
+            self.assertEqual(tracker.flush(), 2)
+        self.assertEqual(ClickCount.objects.get(short_code='abc123').clicks, 3)
+        self.assertEqual(tracker.stats()['flushed_rows'], 3)
+
+    def test_buffer_is_bounded(self):
+        """Test that clicks for new keys are dropped when the buffer is full"""
+        tracker = ClickTracker({'MAX_PENDING': 2})
+        request = RequestFactory().get('/')
+        for code in ('aaaaaa', 'bbbbbb', 'cccccc', 'aaaaaa'):
+            tracker.record(code, request)
+        stats = tracker.stats()
+        self.assertEqual(stats['pending'], 2)
+        self.assertEqual(stats['recorded'], 3)
+        self.assertEqual(stats['dropped'], 1)
+
+
+class AsyncViewsTest(ColdCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = AsyncRequestFactory()
+
+    async def test_async_redirect(self):
+        """Test that the async redirect view resolves codes with the async ORM"""
+        await URL.objects.acreate(original_url='https://example.com/async', short_code='async1')
+        response = await redirect_to_original_async(self.factory.get('/async1'), 'async1')
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response.url, 'https://example.com/async')
+
+        with self.assertRaises(Http404):
+            await redirect_to_original_async(self.factory.get('/nope00'), 'nope00')
+
+    async def test_async_shorten(self):
+        """Test that ashorten creates once and then reuses the code"""
+        url, created = await URL.ashorten('https://example.com/async-create')
+        self.assertTrue(created)
+        same, created = await URL.ashorten('https://EXAMPLE.com/async-create/')
+        self.assertFalse(created)
+        self.assertEqual(same.short_code, url.short_code)
+
+
+class FastPathTest(ColdCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+
+        def django_app(environ, start_response):
+            self.calls.append(environ['PATH_INFO'])
+            start_response('404 Not Found', [])
+            return [b'']
+
+        self.app = FastRedirectWSGI(django_app)
+
+    def test_cached_redirect_skips_django(self):
+        """Test that cached codes are redirected without calling Django"""
+        redirect_cache.set('fast01', 'https://example.com/fast')
+        self.assertEqual(call_wsgi(self.app, wsgi_environ('/fast01', host='localhost')),
+                         '301 Moved Permanently')
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.app.stats()['hits'], 1)
+
+    def test_other_requests_fall_through(self):
+        """Test that misses, other routes, methods and hosts reach Django"""
+        redirect_cache.set('fast01', 'https://example.com/fast')
+        call_wsgi(self.app, wsgi_environ('/uncached', host='localhost'))
+        call_wsgi(self.app, wsgi_environ('/admin/', host='localhost'))
+        call_wsgi(self.app, wsgi_environ('/fast01', host='evil.example'))
+        call_wsgi(self.app, wsgi_environ('/fast01', host='localhost', REQUEST_METHOD='POST'))
+        self.assertEqual(self.calls, ['/uncached', '/admin/', '/fast01', '/fast01'])
+
+
+class BenchmarkSuiteTest(TestCase):
+    def test_seed_urls(self):
+        """Test that seeding tops the table up to the requested size"""
+        URL.objects.create(original_url='https://example.com/existing', short_code='exist1')
+        self.assertEqual(seed_urls(25, batch_size=10), 24)
+        self.assertEqual(seed_urls(25), 0)
+        self.assertEqual(URL.objects.count(), 25)
+        self.assertEqual(URL.objects.filter(domain='seed.example.com').count(), 24,
+                         "Seeded rows should look like real ones to the admin search")
+
+    def test_compare_to_baseline(self):
+        """Test that slower medians and extra queries are reported as regressions"""
+        baseline = {
+            'redirect_warm': {'p50_us': 100.0, 'p99_us': 200.0, 'queries_per_request': 0},
+            'create': {'p50_us': 1000.0, 'p99_us': 2000.0, 'queries_per_request': 2},
+        }
+        results = {
+            'redirect_warm': {'p50_us': 120.0, 'p99_us': 900.0, 'queries_per_request': 0},
+            'create': {'p50_us': 1500.0, 'p99_us': 2000.0, 'queries_per_request': 3},
+            'spam_check': {'p50_us': 10.0, 'p99_us': 20.0},
+        }
+        regressions = compare_to_baseline(results, baseline, tolerance=0.25)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('create.p50_us'))
+        self.assertTrue(regressions[1].startswith('create.queries_per_request'))
+
+
+class MetricsTest(ColdCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+
+    def test_histogram_buckets(self):
+        """Test that histogram buckets bound values within a fixed relative error"""
+        histogram = Histogram()
+        for value in (0.0000005, 0.001, 0.0012, 0.25, 1000):
+            index = histogram.index(value)
+            self.assertGreaterEqual(histogram.upper_bound(index), min(value, histogram.MAX))
+        for value in [0.001] * 99 + [0.5]:
+            histogram.observe(value)
+        self.assertAlmostEqual(histogram.quantile(0.5), 0.001, delta=0.0003)
+        self.assertAlmostEqual(histogram.quantile(1.0), 0.5, delta=0.15)
+
+    @override_settings(SHORTENER_METRICS={'SAMPLE_RATE': 1.0, 'TOKEN': 'secret'})
+    def test_sampled_requests_are_exported(self):
+        """Test that sampled requests show up on the metrics endpoint"""
+        URL.objects.create(original_url='https://example.com/metric', short_code='metric')
+        self.client.get('/metric')
+        self.client.post(reverse('index'), {'original_url': 'https://example.com/measured'})
+
+        response = self.client.get('/_/metrics')
+        self.assertEqual(response.status_code, 401, "The endpoint should require the token")
+        response = self.client.get('/_/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('shortener_request_duration_seconds_count{view="redirect"} 1', body)
+        self.assertIn('shortener_db_queries_total{view="redirect"} 1', body)
+        self.assertIn('shortener_spam_check_duration_seconds_count 1', body)
+        self.assertIn('shortener_redirect_cache_events_total{event="db_lookups"} 1', body)
+
+    @override_settings(SHORTENER_METRICS={'SAMPLE_RATE': 1.0})
+    async def test_async_requests_are_sampled(self):
+        """Test that the middleware runs natively under ASGI and counts async ORM queries"""
+        async def view(request):
+            await URL.objects.filter(short_code='nosuch').aexists()
+            return HttpResponse('ok')
+
+        middleware = MetricsMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = await middleware(AsyncRequestFactory().get('/'))
+        self.assertEqual(response.content, b'ok')
+        body = registry.render()
+        self.assertIn('shortener_requests_sampled_total{view="unmatched"} 1', body)
+        self.assertIn('shortener_db_queries_total{view="unmatched"} 1', body)
+
+    @override_settings(SHORTENER_METRICS={'SAMPLE_RATE': 0.0})
+    def test_unsampled_requests_are_not_timed(self):
+        """Test that a zero sample rate records nothing"""
+        self.client.get(reverse('index'))
+        self.assertEqual(registry.histograms, {})
+
+
+class SnapshotTest(ColdCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'redirects.snap')
+
+    def export(self, path, *args):
+        call_command('export_snapshot', path, *args, stdout=io.StringIO())
+
+    def test_binary_search(self):
+        """Test that every exported code is found and others are not"""
+        rows = sorted((encode(i * 7919, 6), f'https://example.com/{i}/\u00e9', None) for i in range(1, 501))
+        self.assertEqual(write_snapshot(self.path, rows, until=timezone.now()), 500)
+        snapshot = SnapshotFile(self.path)
+        self.assertEqual(len(snapshot), 500)
+        for code, original_url, _ in rows:
+            self.assertEqual(snapshot.get(code), original_url)
+        self.assertIsNone(snapshot.get('000000'))
+        self.assertIsNone(snapshot.get('zzzzzzz'))
+        self.assertIsNone(snapshot.get('\u00e9'))
+        self.assertEqual(list(snapshot), rows)
+
+    def test_unsorted_rows_are_rejected(self):
+        """Test that the writer refuses rows it could not binary search"""
+        with self.assertRaises(SnapshotError):
+            write_snapshot(self.path, [('b', 'https://b.example', None), ('a', 'https://a.example', None)])
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_expired_links(self):
+        """Test that expiry is stored in the snapshot and expired links are skipped"""
+        now = timezone.now()
+        rows = [
+            ('exp001', 'https://example.com/expired', now - timedelta(seconds=1)),
+            ('exp002', 'https://example.com/later', now + timedelta(hours=1)),
+        ]
+        write_snapshot(self.path, rows)
+        snapshot = SnapshotFile(self.path)
+        self.assertIsNone(snapshot.get('exp001'))
+        self.assertEqual(snapshot.get('exp002'), 'https://example.com/later')
+        self.assertEqual(snapshot.entry('exp002')[1], int(rows[1][2].timestamp()))
+
+    def test_export_and_deltas(self):
+        """Test that deltas only hold newer rows and layer on the snapshot"""
+        URL.objects.create(original_url='https://example.com/one', short_code='snap01')
+        # Older than the overlap each delta re-reads
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        URL.objects.filter(short_code='snap01').update(created_at=an_hour_ago, updated_at=an_hour_ago)
+        self.export(self.path)
+        URL.objects.create(original_url='https://example.com/two', short_code='snap02')
+        delta_dir = os.path.join(self.directory.name, 'deltas')
+        os.mkdir(delta_dir)
+        delta_path = os.path.join(delta_dir, '0001.delta')
+        self.export(delta_path, '--delta-from', self.path)
+
+        delta = SnapshotFile(delta_path)
+        self.assertEqual(list(delta), [('snap02', 'https://example.com/two', None)])
+        store = SnapshotStore(self.path, delta_dir)
+        self.assertEqual(store.get('snap01'), 'https://example.com/one')
+        self.assertEqual(store.get('snap02'), 'https://example.com/two')
+        self.assertEqual(store.until, delta.until)
+
+        with self.assertRaises(SnapshotError):
+            store.apply_delta(self.path)
+
+    def test_bad_deltas_do_not_break_lookups(self):
+        """Test that gapped or corrupt deltas are skipped, and loaded once they chain on"""
+        now = timezone.now()
+        write_snapshot(self.path, [('gap001', 'https://example.com/base', None)], until=now - timedelta(hours=2))
+        delta_dir = os.path.join(self.directory.name, 'deltas')
+        os.mkdir(delta_dir)
+        with open(os.path.join(delta_dir, '0000.delta'), 'wb') as f:
+            f.write(b'SHRTSNAP')
+        gapped = os.path.join(delta_dir, '0002.delta')
+        write_snapshot(gapped, [('gap002', 'https://example.com/gapped', None)], DELTA,
+                       since=now - timedelta(minutes=30), until=now)
+        with self.assertLogs('shortener.snapshot', 'ERROR'):
+            store = SnapshotStore(self.path, delta_dir, refresh_interval=0)
+            self.assertEqual(store.get('gap001'), 'https://example.com/base')
+        self.assertIsNone(store.get('gap002'))
+
+        write_snapshot(os.path.join(delta_dir, '0001.delta'), [('gap003', 'https://example.com/fill', None)],
+                       DELTA, since=now - timedelta(hours=2), until=now - timedelta(minutes=20))
+        with self.assertLogs('shortener.snapshot', 'ERROR'):
+            self.assertEqual(store.get('gap002'), 'https://example.com/gapped')
+        self.assertEqual(store.get('gap003'), 'https://example.com/fill')
+        self.assertEqual(store.until, SnapshotFile(gapped).until)
+
+    def test_delta_includes_rows_that_committed_late(self):
+        """Test that a row created before an export but committed after it reaches the next delta"""
+        later = URL.objects.create(original_url='https://example.com/later', short_code='late02')
+        self.export(self.path)
+        # Simulates a transaction that was still open during the export: a lower
+        # id and an earlier created_at than rows the export already saw
+        URL.objects.create(id=later.id - 1 if later.id > 1 else later.id + 1,
+                           original_url='https://example.com/late', short_code='late01')
+        before_export = SnapshotFile(self.path).until - timedelta(seconds=30)
+        URL.objects.filter(short_code='late01').update(created_at=before_export, updated_at=before_export)
+        delta_path = os.path.join(self.directory.name, '0001.delta')
+        self.export(delta_path, '--delta-from', self.path)
+        self.assertEqual(SnapshotFile(delta_path).get('late01'), 'https://example.com/late')
+
+    def test_deltas_carry_status_changes(self):
+        """Test that links disabled or activated after an export are updated by the next delta"""
+        URL.objects.create(original_url='https://example.com/bad', short_code='stat01')
+        URL.objects.create(original_url='https://example.com/new', short_code='stat02', status='pending')
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        URL.objects.update(created_at=an_hour_ago, updated_at=an_hour_ago)
+        self.export(self.path)
+        set_status(URL.objects.filter(short_code='stat01'), 'disabled', 'phishing')
+        set_status(URL.objects.filter(short_code='stat02'), 'active')
+
+        delta_dir = os.path.join(self.directory.name, 'deltas')
+        os.mkdir(delta_dir)
+        self.export(os.path.join(delta_dir, '0001.delta'), '--delta-from', self.path)
+        store = SnapshotStore(self.path, delta_dir)
+        self.assertIsNone(store.entry('stat01'))
+        self.assertEqual(store.get('stat02'), 'https://example.com/new')
+        with self.settings(SHORTENER_SNAPSHOT={'PATH': self.path, 'DELTA_DIR': delta_dir}):
+            reload_snapshot_store()
+            self.addCleanup(reload_snapshot_store)
+            self.assertIsNone(redirect_cache.lookup('stat01'))
+            self.assertEqual(redirect_cache.lookup('stat02'), 'https://example.com/new')
+
+    def test_redirects_without_database(self):
+        """Test that a snapshot-only node serves redirects with no queries"""
+        URL.objects.create(original_url='https://example.com/edge', short_code='edge01')
+        self.export(self.path)
+        config = {'PATH': self.path, 'FALLBACK_TO_DATABASE': False}
+        with self.settings(SHORTENER_SNAPSHOT=config):
+            reload_snapshot_store()
+            self.addCleanup(reload_snapshot_store)
+            with self.assertNumQueries(0):
+                self.assertEqual(redirect_cache.lookup('edge01'), 'https://example.com/edge')
+                self.assertIsNone(redirect_cache.lookup('nope01'))
+            cache.clear()
+            redirect_cache.clear()
+            self.assertEqual(redirect_cache.peek('edge01'), 'https://example.com/edge')
+        self.assertEqual(redirect_cache.stats()['snapshot_hits'], 1)
+
+
+class CodeFilterTest(ColdCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        code_filter.clear()
+        self.addCleanup(code_filter.clear)
+
+    def test_false_positive_rate(self):
+        """Test that the filter has no false negatives and about the configured error rate"""
+        bloom = BloomFilter(10000, error_rate=0.01)
+        for i in range(10000):
+            bloom.add(f'in{i}')
+        self.assertTrue(all(f'in{i}' in bloom for i in range(10000)))
+        false_positives = sum(f'out{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 200)
+        self.assertAlmostEqual(bloom.estimated_error_rate(), 0.01, delta=0.002)
+        self.assertEqual(bloom.stats()['memory_bytes'], len(bloom.array))
+
+    def test_unknown_codes_skip_the_database(self):
+        """Test that codes the filter rules out 404 without a query"""
+        URL.objects.create(original_url='https://example.com/known', short_code='known1')
+        self.assertTrue(code_filter.might_contain('random'), "An unbuilt filter must not reject codes")
+        code_filter.build()
+        with self.assertNumQueries(0):
+            self.assertIsNone(redirect_cache.lookup('random'))
+        self.assertEqual(redirect_cache.lookup('known1'), 'https://example.com/known')
+        self.assertEqual(code_filter.stats()['rejected'], 1)
+
+    def test_new_codes_are_added(self):
+        """Test that codes created here or elsewhere get into the filter"""
+        code_filter.build()
+        redirect_cache.set('local1', 'https://example.com/local')
+        self.assertTrue(code_filter.might_contain('local1'))
+        URL.objects.create(original_url='https://example.com/other', short_code='other1')
+        self.assertEqual(code_filter.refresh(), 1)
+        self.assertTrue(code_filter.might_contain('other1'))
+        self.assertEqual(code_filter.refresh(), 0)
+
+    def test_refresh_sees_rows_that_committed_late(self):
+        """Test that a row written before a refresh but committed after it is still added"""
+        code_filter.build()
+        code_filter.refresh()
+        URL.objects.create(original_url='https://example.com/slow', short_code='slow01')
+        URL.objects.filter(short_code='slow01').update(
+            id=10 ** 6, updated_at=code_filter.since - timedelta(seconds=30))
+        self.assertEqual(code_filter.refresh(), 1)
+        self.assertTrue(code_filter.might_contain('slow01'))
+
+    def test_off_without_shared_cache(self):
+        """Test that the filter only runs by default when new codes reach every worker"""
+        self.assertFalse(CodeFilter().enabled(), "LocMemCache is per process")
+        self.assertTrue(CodeFilter({'ENABLED': True}).enabled())
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                                                'LOCATION': 'redis://localhost:6379'}}):
+            self.assertTrue(CodeFilter().enabled())
+
+
+@override_settings(SHORTENER_DATABASE_ROUTING={'REPLICAS': ['replica1', 'replica2'], 'STICKY_SECONDS': 10})
+class DatabaseRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def test_reads_go_to_replicas(self):
+        """Test that reads use a replica and writes the primary"""
+        self.assertIn(self.router.db_for_read(URL), ('replica1', 'replica2'))
+        self.assertEqual(self.router.db_for_write(URL), 'default')
+        with use_primary():
+            self.assertEqual(self.router.db_for_read(URL), 'default')
+        self.assertFalse(self.router.allow_migrate('replica1', 'shortener'))
+        with self.settings(SHORTENER_DATABASE_ROUTING={'REPLICAS': []}):
+            self.assertIsNone(self.router.db_for_read(URL))
+
+    def test_reads_after_a_write_stay_on_the_primary(self):
+        """Test read-your-writes within a request and across requests"""
+        reads = []
+
+        def create_then_read(request):
+            self.router.db_for_write(URL)
+            reads.append(self.router.db_for_read(URL))
+            return HttpResponse()
+
+        def read(request):
+            reads.append(self.router.db_for_read(URL))
+            return HttpResponse()
+
+        response = ReplicaStickinessMiddleware(create_then_read)(self.factory.post('/'))
+        cookie = response.cookies['shortener_primary']
+        self.assertEqual(cookie['max-age'], 10)
+
+        sticky_request = self.factory.get('/abc123')
+        sticky_request.COOKIES['shortener_primary'] = cookie.value
+        ReplicaStickinessMiddleware(read)(sticky_request)
+        response = ReplicaStickinessMiddleware(read)(self.factory.get('/abc123'))
+        self.assertEqual(reads[:2], ['default', 'default'])
+        self.assertIn(reads[2], ('replica1', 'replica2'))
+        self.assertNotIn('shortener_primary', response.cookies)
+
+    async def test_async_requests_are_sticky(self):
+        """Test that the middleware runs natively under ASGI and sees writes from sync code"""
+        async def create(request):
+            await sync_to_async(self.router.db_for_write)(URL)
+            return HttpResponse()
+
+        middleware = ReplicaStickinessMiddleware(create)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = await middleware(AsyncRequestFactory().post('/'))
+        self.assertIn('shortener_primary', response.cookies)
+
+    def test_streamed_bulk_writes_are_sticky(self):
+        """Test that the cookie is set although the bulk writes happen while streaming"""
+        request = self.factory.post('/api/bulk', data='"https://example.com/streamed"\n',
+                                    content_type='application/x-ndjson')
+        with mock.patch('shortener.views.rate_limiter', RateLimiter({'BACKEND': 'memory'})):
+            response = ReplicaStickinessMiddleware(bulk_shorten)(request)
+        self.assertTrue(response.streaming)
+        self.assertIn('shortener_primary', response.cookies)
+
+
+class WriteQueueTest(TransactionTestCase):
+    def test_inline_without_writer_thread(self):
+        """Test that calls run directly when the queue is not started"""
+        queue = WriteQueue({'ENABLED': True})
+        url, created = queue.call(URL.shorten, 'https://example.com/inline')
+        self.assertTrue(created)
+        self.assertEqual(queue.stats()['batches'], 0)
+
+    def test_batch_commits_together_and_isolates_failures(self):
+        """Test that a batch is one transaction and a failing call only fails itself"""
+        queue = WriteQueue({'ENABLED': True})
+
+        def fail():
+            URL.objects.create(original_url='https://example.com/rolled-back', short_code='fail01')
+            raise ValueError("boom")
+
+        items = [
+            (contextvars.copy_context(), URL.shorten, (f'https://example.com/batch{i}',), {}, Future())
+            for i in range(3)
+        ]
+        items.insert(1, (contextvars.copy_context(), fail, (), {}, Future()))
+        queue.run_batch(items)
+
+        self.assertIsInstance(items[1][-1].exception(), ValueError)
+        self.assertTrue(all(item[-1].result()[1] for item in items if item[1] is URL.shorten))
+        self.assertEqual(URL.objects.count(), 3)
+        self.assertEqual(queue.stats()['batches'], 1)
+
+    def test_failed_batch_keeps_code_reservations(self):
+        """Test that codes are reserved outside a batch transaction that rolls back"""
+        queue = WriteQueue({'ENABLED': True})
+        generator = SequenceCodeGenerator(sequence='batch', key='k')
+        CodeSequence.objects.create(name='batch')
+        items = [
+            (contextvars.copy_context(), URL.shorten, (f'https://example.com/failed{i}',), {}, Future())
+            for i in range(3)
+        ]
+        with mock.patch('shortener.codegen._generator', generator), \
+                mock.patch.object(connection, 'commit', side_effect=DatabaseError('commit failed')):
+            queue.run_batch(items)
+        self.assertEqual(queue.stats()['failed_batches'], 1)
+        self.assertEqual(URL.objects.count(), 0)
+        # The block was reserved and committed before the batch transaction
+        self.assertGreaterEqual(generator._end, 3)
+        self.assertEqual(CodeSequence.objects.get(name='batch').next_value, generator._end)
+        other = SequenceCodeGenerator(sequence='batch', key='k')
+        self.assertNotIn(other.generate(), {generator.code_for(v) for v in range(generator._end)})
+
+    def test_writer_thread(self):
+        """Test that calls from several threads are run by the writer thread"""
+        queue = WriteQueue({'ENABLED': True})
+        queue.start()
+        self.addCleanup(queue.stop)
+        futures = [queue.submit(URL.shorten, f'https://example.com/queued{i}') for i in range(20)]
+        codes = {future.result(10)[0].short_code for future in futures}
+        queue.stop()
+        self.assertEqual(len(codes), 20)
+        self.assertEqual(queue.stats()['calls'], 20)
+        self.assertEqual(URL.objects.count(), 20)
+
+
+class ExpiryAndRetentionTest(ColdCacheMixin, TestCase):
+    def test_expiring_links_are_not_deduplicated(self):
+        """Test that links with an expiry always get their own code"""
+        permanent, _ = URL.shorten('https://example.com/ttl')
+        expires_at = timezone.now() + timedelta(hours=1)
+        expiring, created = URL.shorten('https://example.com/ttl', expires_at=expires_at)
+        self.assertTrue(created)
+        self.assertNotEqual(expiring.short_code, permanent.short_code)
+        self.assertIsNone(expiring.url_hash)
+        self.assertEqual(URL.shorten('https://example.com/ttl')[0], permanent)
+
+    def test_form_expiry(self):
+        """Test that the landing page creates expiring links"""
+        self.client.post(reverse('index'), {'original_url': 'https://example.com/soon', 'expires_in': '3600'})
+        url = URL.objects.get(original_url='https://example.com/soon')
+        self.assertAlmostEqual(
+            (url.expires_at - timezone.now()).total_seconds(), 3600, delta=60)
+
+    def test_expired_links_stop_redirecting(self):
+        """Test that expired links 404 and are not cached past their expiry"""
+        URL.objects.create(original_url='https://example.com/gone', short_code='gone01',
+                           expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.client.get('/gone01').status_code, 404)
+
+        expires_at = timezone.now() + timedelta(seconds=30)
+        redirect_cache.set('soon01', 'https://example.com/soon', expires_at)
+        self.assertLessEqual(redirect_cache.local._data['soon01'][1] - time.monotonic(), 30)
+        self.assertEqual(cache.get('redirect:soon01')[1], expires_at.timestamp())
+        redirect_cache.local.clear()
+        self.assertEqual(redirect_cache.peek('soon01'), 'https://example.com/soon')
+        cache.set('redirect:soon01', ('https://example.com/soon', time.time() - 1))
+        redirect_cache.local.clear()
+        self.assertIsNone(redirect_cache.peek('soon01'))
+
+    def test_purge_in_batches(self):
+        """Test that expired links are deleted or archived in bounded batches"""
+        past = timezone.now() - timedelta(days=1)
+        for i in range(5):
+            URL.objects.create(original_url=f'https://example.com/old{i}', short_code=f'old{i:03d}',
+                               expires_at=past)
+        URL.objects.create(original_url='https://example.com/keep', short_code='keep01')
+        redirect_cache.set('old000', 'https://example.com/old0')
+
+        config = {'ARCHIVE_EXPIRED': True, 'ARCHIVE_AFTER_MONTHS': None, 'BATCH_SIZE': 2, 'BATCH_PAUSE': 0}
+        self.assertEqual(purge_urls(config=config), {'expired': 5, 'archived': 0})
+        self.assertEqual(list(URL.objects.values_list('short_code', flat=True)), ['keep01'])
+        self.assertEqual(ArchivedURL.objects.count(), 5)
+        self.assertIsNone(redirect_cache.lookup('old000'))
+
+    def test_archive_by_month(self):
+        """Test that old links move to the archive and still redirect"""
+        url = URL.objects.create(original_url='https://example.com/archived', short_code='arch01')
+        URL.objects.filter(pk=url.pk).update(created_at=months_ago(4))
+        config = {'ARCHIVE_EXPIRED': False, 'ARCHIVE_AFTER_MONTHS': 3, 'BATCH_SIZE': 100, 'BATCH_PAUSE': 0}
+        self.assertEqual(purge_urls(config=config), {'expired': 0, 'archived': 1})
+        archived = ArchivedURL.objects.get(short_code='arch01')
+        self.assertEqual(archived.created_month, months_ago(4).date())
+
+        with self.settings(SHORTENER_RETENTION={'ARCHIVE_AFTER_MONTHS': 3}):
+            self.assertEqual(redirect_cache.lookup('arch01'), 'https://example.com/archived')
+        self.assertEqual(drop_archived_months(months_ago(3), config=config), 1)
+
+    def test_archived_link_keeps_status(self):
+        """Test that a disabled link does not start redirecting once archived"""
+        URL.objects.create(original_url='https://example.com/disabled', short_code='arch02',
+                           status='disabled', status_reason='phishing')
+        URL.objects.filter(short_code='arch02').update(created_at=months_ago(4))
+        config = {'ARCHIVE_EXPIRED': False, 'ARCHIVE_AFTER_MONTHS': 3, 'BATCH_SIZE': 100, 'BATCH_PAUSE': 0}
+        purge_urls(config=config)
+        archived = ArchivedURL.objects.get(short_code='arch02')
+        self.assertEqual((archived.status, archived.status_reason), ('disabled', 'phishing'))
+        with self.settings(SHORTENER_RETENTION={'ARCHIVE_AFTER_MONTHS': 3}):
+            self.assertIsNone(redirect_cache.lookup('arch02'))
+
+
+@override_settings(SHORTENER_HTTP_CACHE={'REDIRECT_MAX_AGE': 3600, 'REDIRECT_S_MAXAGE': 86400})
+class HttpCachingTest(ColdCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        URL.objects.create(original_url='https://example.com/cached', short_code='http01')
+
+    def test_redirect_cache_headers(self):
+        """Test that redirects are cacheable and revalidate with a 304"""
+        response = self.client.get('/http01')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600, s-maxage=86400, immutable')
+        etag = response['ETag']
+        response = self.client.get('/http01', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        app = FastRedirectWSGI(lambda environ, start_response: None)
+        environ = wsgi_environ('/http01', host='localhost', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(call_wsgi(app, environ), '304 Not Modified')
+
+    def test_expiring_redirects_are_cached_until_expiry(self):
+        """Test that max-age never outlives an expiring link"""
+        URL.objects.create(original_url='https://example.com/brief', short_code='http02',
+                           expires_at=timezone.now() + timedelta(seconds=120))
+        cache_control = self.client.get('/http02')['Cache-Control']
+        max_age = int(cache_control.split('max-age=')[1].split(',')[0])
+        self.assertTrue(110 <= max_age <= 120, cache_control)
+        self.assertNotIn('s-maxage', cache_control)
+
+    def test_landing_page_conditional_get(self):
+        """Test that the landing page revalidates per CSRF secret"""
+        response = self.client.get(reverse('index'))
+        self.assertFalse(response.has_header('ETag'), "First visits have no CSRF cookie yet")
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        response = self.client.get(reverse('index'))
+        etag = response['ETag']
+        self.assertEqual(self.client.get(reverse('index'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.cookies['csrftoken'] = 'x' * 32
+        self.assertEqual(self.client.get(reverse('index'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class PrerenderedLandingPageTest(TestCase):
+    def setUp(self):
+        views._landing_page = None
+
+    def test_prerendered_page_gets_a_fresh_token(self):
+        """Test that the pre-rendered page carries a usable CSRF token and skips the session"""
+        client = Client(enforce_csrf_checks=True)
+        client.cookies['sessionid'] = 'not-a-real-session'
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse('index'))
+        self.assertEqual(len(queries), 0)
+        self.assertIsNotNone(views._landing_page)
+        content = response.content.decode()
+        self.assertNotIn(views.CSRF_PLACEHOLDER, content)
+        token = content.split('name="csrfmiddlewaretoken" value="')[1].split('"')[0]
+
+        response = client.post(reverse('index'), {
+            'original_url': 'https://example.com/prerendered', 'csrfmiddlewaretoken': token,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(URL.objects.filter(original_url='https://example.com/prerendered').exists())
+
+    def test_pending_messages_are_rendered(self):
+        """Test that a request with a messages cookie gets a full render"""
+        request = RequestFactory().get('/')
+        request.COOKIES[CookieStorage.cookie_name] = 'pending'
+        self.assertIsNone(views.prerendered_landing_page(request))
+        with override_settings(SHORTENER_PRERENDER_LANDING_PAGE=False):
+            self.assertIsNone(views.prerendered_landing_page(RequestFactory().get('/')))
+
+
+class BulkImportExportTest(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.tmpdir):
+            os.remove(os.path.join(self.tmpdir, name))
+        os.rmdir(self.tmpdir)
+
+    def write_ndjson(self, name, rows):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            for row in rows:
+                f.write(json.dumps(row) + '\n')
+        return path
+
+    def test_export_import_round_trip(self):
+        """Test that an export re-imports with the same codes and timestamps"""
+        created_at = timezone.now() - timedelta(days=400)
+        for i in range(1, 6):
+            URL.shorten(f'https://example.com/bulk/{i}')
+        URL.objects.filter(original_url='https://example.com/bulk/1').update(created_at=created_at)
+        expected = set(URL.objects.values_list('short_code', 'original_url'))
+        path = os.path.join(self.tmpdir, 'urls.csv')
+        call_command('export_urls', path, stdout=io.StringIO())
+
+        URL.objects.all().delete()
+        out = io.StringIO()
+        call_command('import_urls', path, '--workers', '2', '--chunk-size', '2', stdout=out)
+        self.assertIn('Imported 5 links', out.getvalue())
+        self.assertEqual(set(URL.objects.values_list('short_code', 'original_url')), expected)
+        imported = URL.objects.get(original_url='https://example.com/bulk/1')
+        self.assertEqual(imported.created_at, created_at)
+        # Imported rows count as changed now, so the next snapshot delta has them
+        self.assertGreater(imported.updated_at, timezone.now() - timedelta(minutes=1))
+        self.assertIsNotNone(URL.objects.get(original_url='https://example.com/bulk/2').url_hash)
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+    def test_import_rejects_and_deduplicates(self):
+        """Test that invalid, spam, duplicate and conflicting rows are handled"""
+        existing, _ = URL.shorten('https://example.com/taken')
+        path = self.write_ndjson('urls.ndjson', [
+            {'original_url': 'not a url'},
+            {'original_url': 'https://viagra.example.com/'},
+            {'original_url': 'https://example.com/taken/'},
+            {'original_url': 'https://example.com/taken', 'short_code': 'legacy'},
+            {'original_url': 'https://example.com/other', 'short_code': existing.short_code},
+            {'original_url': 'https://example.com/prefixed', 'short_code': 'b000001'},
+            {'original_url': 'https://example.com/new', 'ip_address': '127.0.0.1'},
+            {'original_url': 'https://example.com/new'},
+        ])
+        errors = os.path.join(self.tmpdir, 'errors.ndjson')
+        call_command('import_urls', path, '--workers', '0', '--errors', errors, stdout=io.StringIO())
+
+        self.assertEqual(URL.objects.count(), 3)
+        legacy = URL.objects.get(short_code='legacy')
+        self.assertIsNone(legacy.url_hash, "Legacy duplicates keep their code without a url_hash")
+        self.assertEqual(URL.objects.get(original_url='https://example.com/new').ip_address, '127.0.0.1')
+        with open(errors) as f:
+            reasons = [json.loads(line)['error'] for line in f]
+        self.assertEqual(len(reasons), 4)
+        self.assertTrue(reasons[1].startswith('spam'))
+        self.assertIn("invalid short_code 'b000001'", reasons, "Longer codes could clash with node prefixes")
+
+    def test_import_resumes_from_checkpoint(self):
+        """Test that rows before the checkpoint are skipped"""
+        path = self.write_ndjson('urls.jsonl', [
+            {'original_url': f'https://example.com/resume/{i}'} for i in range(10)
+        ])
+        with open(path + '.checkpoint', 'w') as f:
+            json.dump({'rows': 6, 'created': 6, 'existing': 0, 'rejected': 0}, f)
+        out = io.StringIO()
+        call_command('import_urls', path, '--workers', '0', '--chunk-size', '3', stdout=out)
+
+        self.assertIn('Resuming after 6 rows', out.getvalue())
+        self.assertIn('Imported 10 links from 10 rows', out.getvalue())
+        self.assertEqual(
+            sorted(URL.objects.values_list('original_url', flat=True)),
+            [f'https://example.com/resume/{i}' for i in range(6, 10)],
+        )
+
+
+class StubReputationSource:
+    """Stands in for DNS and blocklist lookups in the reputation tests."""
+    per_domain = True
+    calls = []
+
+    def __init__(self, blocked=(), broken=()):
+        self.blocked = blocked
+        self.broken = broken
+
+    def check(self, url, host):
+        StubReputationSource.calls.append(host)
+        if host in self.broken:
+            raise OSError("lookup failed")
+        return "Blocked by stub" if host in self.blocked else None
+
+
+REPUTATION_STUB = {
+    'ENABLED': True,
+    'SOURCES': [{
+        'BACKEND': 'shortener.tests.StubReputationSource',
+        'OPTIONS': {'blocked': ['bad.example.com'], 'broken': ['flaky.example.com']},
+    }],
+    'WORKERS': 4,
+}
+
+
+@override_settings(SHORTENER_REPUTATION=REPUTATION_STUB)
+class ReputationTest(ColdCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        StubReputationSource.calls = []
+
+    def shorten(self, original_url):
+        self.client.post(reverse('index'), {'original_url': original_url})
+        return URL.objects.get(original_url=original_url)
+
+    def test_links_are_pending_until_checked(self):
+        """Test that pending links redirect briefly cached, then get activated or disabled"""
+        good = self.shorten('https://good.example.com/a')
+        also_good = self.shorten('https://good.example.com/b')
+        bad = self.shorten('https://bad.example.com/')
+        self.assertEqual(good.status, 'pending')
+
+        response = self.client.get(f'/{bad.short_code}')
+        self.assertEqual(response.status_code, 301)
+        max_age = int(response['Cache-Control'].split('max-age=')[1].split(',')[0])
+        self.assertLessEqual(max_age, 60)
+
+        out = io.StringIO()
+        call_command('check_pending_urls', stdout=out)
+        self.assertIn('Activated 2, disabled 1', out.getvalue())
+        self.assertEqual(StubReputationSource.calls.count('good.example.com'), 1, "Domain results are cached")
+
+        bad.refresh_from_db()
+        self.assertEqual((bad.status, bad.status_reason), ('disabled', 'Blocked by stub'))
+        self.assertEqual(self.client.get(f'/{bad.short_code}').status_code, 404)
+        also_good.refresh_from_db()
+        self.assertEqual(also_good.status, 'active')
+        self.assertIn('max-age=3600', self.client.get(f'/{good.short_code}')['Cache-Control'])
+
+        response = self.client.post(reverse('index'), {'original_url': 'https://bad.example.com/'})
+        self.assertNotIn('short_url', response.context)
+        self.assertContains(response, 'disabled after a reputation check')
+
+    def test_failing_source_leaves_link_pending(self):
+        """Test that a source error is retried rather than disabling the link"""
+        flaky = self.shorten('https://flaky.example.com/')
+        with self.assertLogs('shortener.reputation', 'ERROR'):
+            counts = ReputationChecker().check_pending()
+        self.assertEqual(counts, {'active': 0, 'disabled': 0, 'retry': 1})
+        flaky.refresh_from_db()
+        self.assertEqual(flaky.status, 'pending')
+        self.assertEqual(flaky.check_attempts, 1)
+        self.assertGreater(flaky.next_check_at, timezone.now() + timedelta(seconds=20))
+
+        # A link that keeps failing does not hold up newer ones
+        good = self.shorten('https://good.example.com/later')
+        self.assertEqual(ReputationChecker().check_pending(limit=1), {'active': 1, 'disabled': 0, 'retry': 0})
+        good.refresh_from_db()
+        self.assertEqual(good.status, 'active')
+
+        URL.objects.filter(pk=flaky.pk).update(next_check_at=timezone.now())
+        with self.assertLogs('shortener.reputation', 'ERROR'):
+            ReputationChecker().check_pending()
+        flaky.refresh_from_db()
+        self.assertEqual(flaky.check_attempts, 2)
+        self.assertGreater(flaky.next_check_at, timezone.now() + timedelta(seconds=50))
+
+    def test_redirect_chain_refuses_internal_addresses(self):
+        """Test that the redirect check never fetches loopback, private or link-local hosts"""
+        paths = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_HEAD(self):
+                paths.append(self.path)
+                if self.path == '/start':
+                    self.send_response(302)
+                    self.send_header('Location', f'http://127.0.0.1:{self.server.server_port}/internal')
+                else:
+                    self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        port = server.server_port
+
+        source = RedirectChainSource(timeout=2)
+        reason = source.check(f'http://127.0.0.1:{port}/start', '127.0.0.1')
+        self.assertIn('Points to a non-public address', reason)
+        self.assertEqual(paths, [])
+
+        # A public host that redirects inward is failed at the inward hop
+        resolve, connect = socket.getaddrinfo, socket.create_connection
+
+        def fake_resolve(host, *args, **kwargs):
+            return resolve('93.184.216.34' if host == 'public.test' else host, *args, **kwargs)
+
+        def fake_connect(address, *args, **kwargs):
+            if address[0] == '93.184.216.34':
+                address = ('127.0.0.1', address[1])
+            return connect(address, *args, **kwargs)
+
+        with mock.patch('socket.getaddrinfo', fake_resolve), mock.patch('socket.create_connection', fake_connect):
+            reason = source.check(f'http://public.test:{port}/start', 'public.test')
+        self.assertIn('Redirects to a non-public address', reason)
+        self.assertEqual(paths, ['/start'])
+
+        with mock.patch('socket.getaddrinfo', return_value=[(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('169.254.169.254', 80))]):
+            with self.assertRaises(NonPublicAddress):
+                connect_public(('metadata.test', 80))
+
+        self.assertIsNone(RedirectChainSource(timeout=2, allow_private=True).check(
+            f'http://127.0.0.1:{port}/start', '127.0.0.1'))
+        self.assertEqual(paths, ['/start', '/start', '/internal'])
+
+    @override_settings(SHORTENER_REPUTATION={})
+    def test_disabled_by_default(self):
+        """Test that links are active straight away without reputation checks"""
+        self.assertEqual(self.shorten('https://example.com/direct').status, 'active')
+
+
+class WarmupTest(ColdCacheMixin, TestCase):
+    def test_preloads_clicked_and_recent_links(self):
+        """Test that warm-up fills the local cache so redirects need no queries"""
+        for i in range(1, 6):
+            URL.objects.create(original_url=f'https://example.com/warm/{i}', short_code=f'warm0{i}')
+        URL.objects.create(original_url='https://example.com/off', short_code='warmof', status='disabled')
+        ClickCount.objects.create(short_code='warm01', bucket=timezone.now(), clicks=10)
+
+        report = warm_up({'RECENT': 3, 'TOP_CLICKED': 10})
+        self.assertTrue(report['complete'])
+        self.assertEqual(report['entries'], 3)  # warmof is disabled, warm01 was among the top
+        self.assertEqual(set(report['steps']), {'connect', 'spam_matcher', 'templates', 'redirects'})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(redirect_cache.lookup('warm01'), 'https://example.com/warm/1')
+            self.assertEqual(redirect_cache.lookup('warm05'), 'https://example.com/warm/5')
+        self.assertEqual(len(queries), 0)
+        self.assertIsNone(redirect_cache.peek('warm02'), "Only RECENT links are preloaded")
+
+    def test_hottest_links_are_evicted_last(self):
+        """Test that links enter the LRU coldest first, whatever order the database returns"""
+        for i in range(1, 6):
+            URL.objects.create(original_url=f'https://example.com/warm/{i}', short_code=f'warm0{i}')
+        for i, clicks in ((2, 5), (4, 50), (3, 20)):
+            ClickCount.objects.create(short_code=f'warm0{i}', bucket=timezone.now(), clicks=clicks)
+
+        warm_up({'RECENT': 5, 'TOP_CLICKED': 10, 'BATCH_SIZE': 2})
+        self.assertEqual(list(redirect_cache.local._data),
+                         ['warm01', 'warm05', 'warm02', 'warm03', 'warm04'])
+
+    def test_time_budget(self):
+        """Test that steps are skipped once the budget is spent"""
+        URL.objects.create(original_url='https://example.com/warm', short_code='warm10')
+        report = warm_up({'TIME_BUDGET': 0})
+        self.assertFalse(report['complete'])
+        self.assertEqual(report['entries'], 0)
+        self.assertEqual(report['steps'], {})
+
+
+class SingleFlightTest(ColdCacheMixin, TestCase):
+    def test_concurrent_calls_share_one_execution(self):
+        """Test that threads asking for the same key wait for one call"""
+        flight = SingleFlight()
+        calls = []
+
+        def load():
+            calls.append(1)
+            while flight.collapsed < 7:
+                time.sleep(0.001)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('k', load))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, ['value'] * 8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats()['leaders'], 1)
+        self.assertEqual(flight.stats()['in_flight'], 0)
+
+        with self.assertRaises(ZeroDivisionError):
+            flight.do('k', lambda: 1 / 0)
+        self.assertEqual(flight.do('k', lambda: 'again'), 'again')
+
+    def test_concurrent_tasks_share_one_execution(self):
+        """Test that async tasks asking for the same key await one call"""
+        flight = SingleFlight()
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'value'
+
+        async def main():
+            return await asyncio.gather(*(flight.ado('k', load) for _ in range(10)))
+
+        self.assertEqual(asyncio.run(main()), ['value'] * 10)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.collapsed, 9)
+
+    def test_waits_for_another_worker(self):
+        """Test that a worker seeing the shared lock taken reuses the other worker's result"""
+        URL.objects.create(original_url='https://example.com/viral', short_code='viral1')
+        key = redirect_cache._key('viral1')
+        cache.add(key + ':lock', 1)  # held by another worker
+        config = {'SHARED_LOCK': True, 'WAIT_TIMEOUT': 2}
+        with mock.patch.dict(single_flight.config, config):
+            threading.Timer(0.05, lambda: cache.set(key, 'https://example.com/elsewhere')).start()
+            with self.assertNumQueries(0):
+                self.assertEqual(redirect_cache.lookup('viral1'), 'https://example.com/elsewhere')
+
+            # Without a result in time, the worker queries for itself
+            redirect_cache.clear()
+            cache.delete(key)
+            single_flight.config['WAIT_TIMEOUT'] = 0.02
+            timeouts = single_flight.shared_timeouts
+            with self.assertNumQueries(1):
+                self.assertEqual(redirect_cache.lookup('viral1'), 'https://example.com/viral')
+            self.assertEqual(single_flight.shared_timeouts, timeouts + 1)
+
+
+class AnalyticsTest(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.tmpdir):
+            os.remove(os.path.join(self.tmpdir, name))
+        os.rmdir(self.tmpdir)
+
+    def test_summary_and_dashboard(self):
+        """Test that the command aggregates links and clicks and the dashboard serves them"""
+        URL.shorten('https://example.com/a', '10.0.0.1')
+        URL.shorten('https://example.com/b', '10.0.0.1')
+        URL.shorten('https://other.example.org/', '10.0.0.2')
+        # Legacy duplicates predate url_hash
+        URL.objects.create(original_url='https://example.com/a/', short_code='legac1')
+        URL.objects.create(original_url='https://EXAMPLE.com/a', short_code='legac2')
+        ClickCount.objects.create(short_code='legac1', bucket=timezone.now(), clicks=5)
+        ClickCount.objects.create(short_code='legac1', bucket=timezone.now() - timedelta(days=2), clicks=2)
+        ClickCount.objects.create(short_code='legac2', bucket=timezone.now(), clicks=1)
+
+        with override_settings(SHORTENER_ANALYTICS={'OUTPUT_DIR': self.tmpdir}):
+            call_command('analytics', '--chunk-size', '2', stdout=io.StringIO())
+            summary = analytics.read_summary()
+
+            self.assertEqual(summary['urls'], 5)
+            self.assertEqual(summary['unique_urls'], 3)
+            self.assertEqual(summary['duplicate_ratio'], 0.4)
+            self.assertEqual(summary['top_domains'][0], {'domain': 'example.com', 'urls': 4, 'duplicate_ratio': 0.75})
+            self.assertEqual(summary['top_ips'][0], {'ip': '10.0.0.1', 'urls': 2})
+            self.assertEqual(summary['peak_ips'][0], {'ip': '10.0.0.1', 'peak': 2})
+            self.assertEqual(summary['clicks'], 8)
+            self.assertEqual(summary['top_clicked'][0], {'short_code': 'legac1', 'clicks': 7})
+            self.assertEqual(sum(count for _, count in summary['created_per_bucket']), 5)
+            self.assertTrue(os.path.exists(os.path.join(self.tmpdir, 'analytics.npz')))
+
+            self.assertEqual(self.client.get(reverse('analytics')).status_code, 302)
+            User.objects.create_user('staff', password='pw', is_staff=True)
+            self.client.login(username='staff', password='pw')
+            self.assertContains(self.client.get(reverse('analytics')), 'other.example.org')
+            self.assertEqual(self.client.get(reverse('analytics') + '?format=json').json()['urls'], 5)
+
+
+class AdminSearchTest(TestCase):
+    def setUp(self):
+        for code, url in [
+            ('abc123', 'https://evil.example/login'),
+            ('abd456', 'https://www.evil.example/pay'),
+            ('xyz789', 'https://good.example.org/docs?ref=evil'),
+        ]:
+            URL.objects.create(short_code=code, original_url=url, url_hash=url_digest(url))
+
+    def codes(self, term, **config):
+        config = dict({'SUBSTRING_SCAN_LIMIT': 100000, 'COUNT_LIMIT': 10000}, **config)
+        return sorted(search_urls(URL.objects.all(), term, config).values_list('short_code', flat=True))
+
+    def test_classify(self):
+        """Test that search terms are routed to the right index"""
+        self.assertEqual(classify('abc'), ('code', 'abc'))
+        self.assertEqual(classify('Evil.Example.'), ('domain', 'evil.example'))
+        self.assertEqual(classify('https://evil.example/x'), ('url', 'https://evil.example/x'))
+        self.assertEqual(classify('code:ab'), ('code', 'ab'))
+        self.assertEqual(classify('domain:EVIL.example'), ('domain', 'evil.example'))
+        self.assertEqual(classify('text:login'), ('substring', 'login'))
+        self.assertEqual(classify('/login?x'), ('substring', '/login?x'))
+
+    def test_domain_is_stored(self):
+        """Test that the domain column is filled on save, shorten_many and edits"""
+        url = URL.objects.get(short_code='abc123')
+        self.assertEqual(url.domain, 'evil.example')
+        url.original_url = 'https://Other.Example./x'
+        url.save(update_fields=['original_url'])
+        url.refresh_from_db()
+        self.assertEqual(url.domain, 'other.example')
+        created = URL.shorten_many(['https://many.example/1'])
+        self.assertEqual(URL.objects.get(original_url='https://many.example/1').domain, 'many.example')
+        self.assertEqual(len(created), 1)
+
+    def test_searches(self):
+        """Test code prefix, domain, URL and substring searches"""
+        self.assertEqual(self.codes('ab'), ['abc123', 'abd456'])
+        self.assertEqual(self.codes('abc'), ['abc123'])
+        self.assertEqual(self.codes('evil.example'), ['abc123', 'abd456'])
+        self.assertEqual(self.codes('https://EVIL.example/login/'), ['abc123'])
+        self.assertEqual(self.codes('text:ref=evil'), ['xyz789'])
+        self.assertEqual(self.codes('/pay'), ['abd456'])
+
+    def test_substring_scan_is_bounded(self):
+        """Test that substring search only scans recent rows without trigram indexes"""
+        if connection.vendor == 'postgresql':
+            self.skipTest('PostgreSQL uses the trigram index')
+        URL.objects.create(short_code='new001', original_url='https://new.example/login')
+        self.assertEqual(self.codes('/login', SUBSTRING_SCAN_LIMIT=1), ['new001'])
+        self.assertEqual(self.codes('/login'), ['abc123', 'new001'])
+
+    def test_paginator_caps_counts(self):
+        """Test that filtered counts stop at COUNT_LIMIT + 1"""
+        with override_settings(SHORTENER_ADMIN_SEARCH={'COUNT_LIMIT': 1}):
+            paginator = EstimatedCountPaginator(URL.objects.filter(short_code__startswith='ab'), 10)
+            self.assertEqual(paginator.count, 2)
+            paginator = EstimatedCountPaginator(URL.objects.all().order_by('id'), 10)
+            self.assertGreaterEqual(paginator.count, 3)
+
+    def test_admin_changelist_search(self):
+        """Test that the admin changelist answers searches through search_urls"""
+        User.objects.create_superuser('admin', password='pw')
+        self.client.login(username='admin', password='pw')
+        changelist = reverse('admin:shortener_url_changelist')
+        response = self.client.get(changelist, {'q': 'evil.example'})
+        self.assertContains(response, 'abd456')
+        self.assertNotContains(response, 'xyz789')
+        self.assertContains(self.client.get(changelist), 'xyz789')
@@ -1,7 +1,18 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Under ASGI the async views serve redirects without tying up a thread
+if getattr(settings, 'SHORTENER_ASYNC_VIEWS', False):
+    index_view, redirect_view = views.index_async, views.redirect_to_original_async
+else:
+    index_view, redirect_view = views.index, views.redirect_to_original
+
 urlpatterns = [
-    path('', views.index, name='index'),
-    path('<str:short_code>', views.redirect_to_original, name='redirect'),
-]
\ No newline at end of file
+    path('', index_view, name='index'),
+    path('api/bulk', views.bulk_shorten, name='bulk_shorten'),
+    # '_' is not a short code character, so this can never shadow a link
+    path('_/metrics', views.metrics, name='metrics'),
+    path('_/analytics', views.analytics_dashboard, name='analytics'),
+    path('<str:short_code>', redirect_view, name='redirect'),
+]
@@ -1,10 +1,42 @@
-from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponsePermanentRedirect
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.middleware.csrf import get_token
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.http import (
+    HttpResponse, HttpResponsePermanentRedirect, Http404, JsonResponse, StreamingHttpResponse,
+)
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_POST
 from .models import URL
+from .reputation import DISABLED
+from .cache import redirect_cache
+from .db_router import mark_written
+from .ratelimit import rate_limiter
+from .clicks import click_tracker
+from .writequeue import write_queue
+from .httpcache import conditional_redirect, landing_page_etag, landing_page_last_modified
+from .metrics import get_config as get_metrics_config, registry
+from .analytics import read_summary as read_analytics_summary
+from .spam_detection import is_spam_url
 from .forms import URLForm
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.db import IntegrityError
 
+# Shown when a URL maps to a link that failed its reputation check
+DISABLED_MESSAGE = "This URL has been disabled after a reputation check."
+
+BULK_DEFAULTS = {
+    'MAX_URLS': 1000,   # URLs accepted per request
+    'CHUNK_SIZE': 200,  # URLs looked up and inserted per database batch
+}
+
 def get_client_ip(request):
     """Get the client's IP address from the request."""
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -14,62 +46,278 @@ def get_client_ip(request):
         ip = request.META.get('REMOTE_ADDR')
     return ip
 
+# Rendered in place of the CSRF token in the pre-rendered landing page
+CSRF_PLACEHOLDER = 'csrfplaceholder0000000000000000000000000000000000000000000000000'
+
+_landing_page = None
+
+def prerendered_landing_page(request):
+    """
+    Return the landing page for a plain GET, or None if this request needs a
+    full render (pending messages, DEBUG, or SHORTENER_PRERENDER_LANDING_PAGE
+    off).
+
+    The page is rendered once per worker, without context processors, and
+    the placeholder token is swapped for the visitor's CSRF token on every
+    request. With cookie-based messages nothing here touches the session.
+    """
+    global _landing_page
+    if (request.method not in ('GET', 'HEAD') or settings.DEBUG
+            or not getattr(settings, 'SHORTENER_PRERENDER_LANDING_PAGE', False)
+            or settings.MESSAGE_STORAGE != 'django.contrib.messages.storage.cookie.CookieStorage'
+            or CookieStorage.cookie_name in request.COOKIES):
+        return None
+    if _landing_page is None:
+        _landing_page = render_to_string(
+            'shortener/index.html',
+            {'form': URLForm(), 'csrf_token': CSRF_PLACEHOLDER, 'messages': ()},
+        )
+    return HttpResponse(_landing_page.replace(CSRF_PLACEHOLDER, get_token(request)))
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=landing_page_etag, last_modified_func=landing_page_last_modified)
 def index(request):
     """Home page with URL shortening form."""
+    response = prerendered_landing_page(request)
+    if response is not None:
+        return response
     form = URLForm()
     context = {'form': form}
+    rate_limit = None
     
     if request.method == 'POST':
         form = URLForm(request.POST)
         if form.is_valid():
             original_url = form.cleaned_data['original_url']
+            expires_at = form.expires_at()
             
             # Get client IP
             ip_address = get_client_ip(request)
             
-            # Check rate limiting (max 10 URLs per 10 minutes)
-            recent_urls = URL.get_recent_urls_by_ip(ip_address, minutes=10)
-            if recent_urls.count() >= 10:
+            # Check rate limiting (SHORTENER_RATE_LIMITS, 10 URLs per 10 minutes by default)
+            rate_limit = rate_limiter.check(ip_address)
+            if not rate_limit.allowed:
                 messages.error(
                     request, 
-                    "Rate limit exceeded. Please try again later."
+                    "Rate limit exceeded. Please try again in "
+                    f"{rate_limit.retry_after_header} seconds."
                 )
             else:
-                # Check if this URL already has a short code
-                existing_url = URL.objects.filter(original_url=original_url).first()
-                if existing_url:
-                    short_code = existing_url.short_code
-                else:
-                    # Try to create a new short URL (with race condition handling)
-                    max_attempts = 3  # Prevent infinite loops
-                    for _ in range(max_attempts):
-                        try:
-                            short_code = URL.create_short_code()
-                            URL.objects.create(
-                                original_url=original_url, 
-                                short_code=short_code,
-                                ip_address=ip_address
-                            )
-                            break  # Success! Exit the loop
-                        except IntegrityError:
-                            # Race condition occurred, try again with a new code
-                            continue
-                    else:
-                        # This will only execute if the loop completes without a break
-                        messages.error(request, "Error generating short URL. Please try again.")
-                        context['form'] = form
-                        return render(request, 'shortener/index.html', context)
+                # Reuse the short code of an equivalent URL, or create one
+                try:
+                    url, created = write_queue.call(
+                        URL.shorten, original_url, ip_address, expires_at=expires_at)
+                except IntegrityError:
+                    messages.error(request, "Error generating short URL. Please try again.")
+                    context['form'] = form
+                    return render(request, 'shortener/index.html', context)
+                short_code = url.short_code
+                if created:
+                    redirect_cache.set(short_code, original_url, url.cache_expires_at())
                 
-                # Build the full short URL
-                short_url = request.build_absolute_uri(f'/{short_code}')
-                context['short_url'] = short_url
+                if url.status == DISABLED:
+                    messages.error(request, DISABLED_MESSAGE)
+                else:
+                    # Build the full short URL
+                    short_url = request.build_absolute_uri(f'/{short_code}')
+                    context['short_url'] = short_url
         
         # Always update the form in the context
         context['form'] = form
     
-    return render(request, 'shortener/index.html', context)
+    response = render(request, 'shortener/index.html', context)
+    if rate_limit is not None and not rate_limit.allowed:
+        response['Retry-After'] = rate_limit.retry_after_header
+    return response
 
 def redirect_to_original(request, short_code):
     """Redirect from short URL to original URL with a 301 status code."""
-    url_obj = get_object_or_404(URL, short_code=short_code)
-    return HttpResponsePermanentRedirect(url_obj.original_url)
\ No newline at end of file
+    original_url, expires = redirect_cache.resolve(short_code)
+    if original_url is None:
+        raise Http404("No URL matches the given short code.")
+    click_tracker.record(short_code, request)
+    return conditional_redirect(request, HttpResponsePermanentRedirect(original_url), original_url, expires)
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=landing_page_etag, last_modified_func=landing_page_last_modified)
+async def index_async(request):
+    """Async version of index(), used with SHORTENER_ASYNC_VIEWS under ASGI."""
+    response = prerendered_landing_page(request)
+    if response is not None:
+        return response
+    form = URLForm()
+    context = {'form': form}
+    rate_limit = None
+    
+    if request.method == 'POST':
+        form = URLForm(request.POST)
+        if form.is_valid():
+            original_url = form.cleaned_data['original_url']
+            expires_at = form.expires_at()
+            ip_address = get_client_ip(request)
+            
+            # The shared cache client may block, so keep it off the event loop
+            rate_limit = await sync_to_async(rate_limiter.check)(ip_address)
+            if not rate_limit.allowed:
+                messages.error(
+                    request, 
+                    "Rate limit exceeded. Please try again in "
+                    f"{rate_limit.retry_after_header} seconds."
+                )
+            else:
+                try:
+                    if write_queue.running:
+                        url, created = await write_queue.acall(
+                            URL.shorten, original_url, ip_address, expires_at=expires_at)
+                    else:
+                        url, created = await URL.ashorten(original_url, ip_address, expires_at=expires_at)
+                except IntegrityError:
+                    messages.error(request, "Error generating short URL. Please try again.")
+                    context['form'] = form
+                    return await sync_to_async(render)(request, 'shortener/index.html', context)
+                if created:
+                    await redirect_cache.aset(url.short_code, original_url, url.cache_expires_at())
+                if url.status == DISABLED:
+                    messages.error(request, DISABLED_MESSAGE)
+                else:
+                    context['short_url'] = request.build_absolute_uri(f'/{url.short_code}')
+        
+        context['form'] = form
+    
+    # Rendering may read pending messages from the session
+    response = await sync_to_async(render)(request, 'shortener/index.html', context)
+    if rate_limit is not None and not rate_limit.allowed:
+        response['Retry-After'] = rate_limit.retry_after_header
+    return response
+
+async def redirect_to_original_async(request, short_code):
+    """Async version of redirect_to_original(), used with SHORTENER_ASYNC_VIEWS under ASGI."""
+    original_url, expires = await redirect_cache.aresolve(short_code)
+    if original_url is None:
+        raise Http404("No URL matches the given short code.")
+    click_tracker.record(short_code, request)
+    return conditional_redirect(request, HttpResponsePermanentRedirect(original_url), original_url, expires)
+
+
+def _parse_bulk_item(line):
+    """Parse and validate one NDJSON line. Returns (url, error)."""
+    try:
+        item = json.loads(line)
+    except ValueError:
+        return None, "Invalid JSON."
+    url = item.get('url') if isinstance(item, dict) else item
+    if not isinstance(url, str):
+        return None, "Expected a URL string or an object with a 'url' key."
+    try:
+        url = URLForm.base_fields['original_url'].clean(url)
+    except ValidationError as e:
+        return url, ' '.join(e.messages)
+    is_spam, reason = is_spam_url(url)
+    if is_spam:
+        return url, f"This URL has been flagged as potential spam. Reason: {reason}"
+    return url, None
+
+
+def _bulk_results(request, items, ip_address, chunk_size):
+    """Shorten items chunk by chunk, yielding one NDJSON result line per item."""
+    for start in range(0, len(items), chunk_size):
+        chunk = items[start:start + chunk_size]
+        valid_urls = [url for url, error in chunk if error is None]
+        results = iter(URL.shorten_many(valid_urls, ip_address) if valid_urls else [])
+
+        for index, (url, error) in enumerate(chunk, start):
+            if error is not None:
+                result = {'index': index, 'url': url, 'error': error}
+            else:
+                url_obj, created = next(results)
+                if created:
+                    redirect_cache.set(url_obj.short_code, url_obj.original_url, url_obj.cache_expires_at())
+                if url_obj.status == DISABLED:
+                    yield json.dumps({'index': index, 'url': url, 'error': DISABLED_MESSAGE}) + '\n'
+                    continue
+                result = {
+                    'index': index,
+                    'url': url,
+                    'short_code': url_obj.short_code,
+                    'short_url': request.build_absolute_uri(f'/{url_obj.short_code}'),
+                    'created': created,
+                }
+            yield json.dumps(result) + '\n'
+
+
+@csrf_exempt
+@require_POST
+def bulk_shorten(request):
+    """
+    Shorten many URLs at once.
+
+    The request body is NDJSON: one URL per line, either as a JSON string or
+    as {"url": ...}. The response streams one NDJSON result per input line,
+    in the same order. The whole batch is charged to the 'bulk' rate limit
+    policy (falling back to 'create'), one unit per valid URL; a batch that
+    costs more than the policy ever allows is refused with a 413.
+    """
+    config = dict(BULK_DEFAULTS, **getattr(settings, 'SHORTENER_BULK', {}))
+    items = []
+    for line in request:
+        line = line.strip()
+        if not line:
+            continue
+        if len(items) >= config['MAX_URLS']:
+            return JsonResponse(
+                {'error': f"At most {config['MAX_URLS']} URLs can be shortened per request."},
+                status=413,
+            )
+        items.append(_parse_bulk_item(line))
+    if not items:
+        return JsonResponse({'error': "No URLs given."}, status=400)
+
+    ip_address = get_client_ip(request)
+    valid_count = sum(1 for url, error in items if error is None)
+    if valid_count:
+        max_cost = rate_limiter.max_cost('bulk')
+        if max_cost is not None and valid_count > max_cost:
+            # Retrying could never help, so this is not a 429
+            return JsonResponse(
+                {'error': f"At most {max_cost} URLs can be shortened per request under the rate limit.",
+                 'limit': max_cost},
+                status=413,
+            )
+        rate_limit = rate_limiter.check(ip_address, policy='bulk', cost=valid_count)
+        if not rate_limit.allowed:
+            response = JsonResponse(
+                {'error': "Rate limit exceeded.", 'retry_after': int(rate_limit.retry_after_header)},
+                status=429,
+            )
+            response['Retry-After'] = rate_limit.retry_after_header
+            return response
+
+    if valid_count:
+        # The writes happen while the response streams, after its headers
+        # (and the replica stickiness cookie) have gone out
+        mark_written()
+    return StreamingHttpResponse(
+        _bulk_results(request, items, ip_address, config['CHUNK_SIZE']),
+        content_type='application/x-ndjson',
+    )
+
+
+def metrics(request):
+    """Expose the metrics registry in the Prometheus text format."""
+    token = get_metrics_config()['TOKEN']
+    if token:
+        supplied = request.META.get('HTTP_AUTHORIZATION', '')
+        if not constant_time_compare(supplied, f'Bearer {token}'):
+            return HttpResponse("Unauthorized", status=401, content_type='text/plain')
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@staff_member_required
+def analytics_dashboard(request):
+    """Serve the summary written by `manage.py analytics`; ?format=json for the raw data."""
+    summary = read_analytics_summary()
+    if request.GET.get('format') == 'json':
+        if summary is None:
+            return JsonResponse({'error': "No analytics summary yet."}, status=404)
+        return JsonResponse(summary)
+    return render(request, 'shortener/analytics.html', {'summary': summary})
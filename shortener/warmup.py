@@ -0,0 +1,167 @@
+"""
+Warm-up run by each worker before it serves traffic.
+
+A fresh worker otherwise pays for its first database connections, the spam
+matcher build, template compilation and a cold redirect cache on live
+requests. warm_up() does that work up front, and fills the per-worker
+redirect LRU with the most clicked and most recently created links, within
+TIME_BUDGET seconds so a slow database cannot hold up a deploy.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import Sum
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WARMUP = {
+    'ENABLED': True,
+    'TIME_BUDGET': 5.0,           # seconds, for the whole warm-up
+    'TOP_CLICKED': 2000,          # most clicked links to preload
+    'CLICK_WINDOW_HOURS': 24,     # ...counting clicks in this window
+    'RECENT': 1000,               # most recently created links to preload
+    'BATCH_SIZE': 500,            # links fetched per query
+}
+
+last_report = None
+
+
+def get_config():
+    return dict(DEFAULT_WARMUP, **getattr(settings, 'SHORTENER_WARMUP', {}))
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.start = time.monotonic()
+        self.end = self.start + seconds
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.end
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+
+def top_clicked_codes(limit, hours):
+    """Short codes with the most clicks in the last `hours` hours, most clicked first."""
+    from .models import ClickCount
+
+    since = timezone.now() - timedelta(hours=hours)
+    return list(
+        ClickCount.objects.filter(bucket__gte=since)
+        .values('short_code').annotate(total=Sum('clicks')).order_by('-total')
+        .values_list('short_code', flat=True)[:limit]
+    )
+
+
+def recent_codes(limit):
+    from .models import URL
+
+    return list(URL.objects.order_by('-id').values_list('short_code', flat=True)[:limit])
+
+
+def preload(codes, deadline, batch_size, shared=False):
+    """
+    Load codes, given coldest first, into the redirect cache until done or
+    out of time.
+
+    Batches are fetched hottest first, so running out of time drops the
+    coldest links, but inserted coldest first, so the hottest links are the
+    most recently used entries of the LRU and the last to be evicted.
+    """
+    from .cache import redirect_cache
+    from .models import URL
+    from .reputation import DISABLED, cache_expiry
+
+    found = {}
+    for end in range(len(codes), 0, -batch_size):
+        if deadline.expired:
+            break
+        rows = (
+            URL.objects.filter(short_code__in=codes[max(0, end - batch_size):end])
+            .exclude(status=DISABLED)
+            .values_list('short_code', 'original_url', 'expires_at', 'status')
+        )
+        for short_code, original_url, expires_at, status in rows:
+            found[short_code] = (original_url, cache_expiry(status, expires_at))
+
+    loaded = 0
+    for short_code in codes:
+        if short_code in found:
+            original_url, expires_at = found[short_code]
+            loaded += redirect_cache.warm(short_code, original_url, expires_at, shared)
+    return loaded
+
+
+def warm_up(config=None, shared=False):
+    """
+    Run the warm-up steps in order, skipping what is left once the time
+    budget runs out. Returns (and logs) a report of what was done.
+    """
+    from .cache import redirect_cache
+    from .httpcache import landing_page_version
+    from .spam_detection import get_matcher
+
+    global last_report
+    config = dict(get_config(), **(config or {}))
+    deadline = Deadline(config['TIME_BUDGET'])
+    report = {'connections': 0, 'entries': 0, 'complete': False, 'steps': {}}
+
+    def step(name, function):
+        if deadline.expired:
+            return None
+        started = time.monotonic()
+        try:
+            return function()
+        except DatabaseError:
+            logger.exception("Warm-up step %s failed", name)
+        finally:
+            report['steps'][name] = round(time.monotonic() - started, 4)
+
+    def connect():
+        for alias in connections:
+            connections[alias].ensure_connection()
+            report['connections'] += 1
+
+    def load_codes():
+        # Least important first, so the most clicked links end up as the
+        # most recently used entries of the LRU
+        limit = redirect_cache.config['MAX_ENTRIES']
+        codes = recent_codes(min(config['RECENT'], limit))[::-1] if config['RECENT'] else []
+        if config['TOP_CLICKED'] and not deadline.expired:
+            top = top_clicked_codes(min(config['TOP_CLICKED'], limit), config['CLICK_WINDOW_HOURS'])
+            top_set = set(top)
+            codes = [code for code in codes if code not in top_set] + top[::-1]
+        codes = codes[-limit:]
+        report['entries'] = preload(codes, deadline, config['BATCH_SIZE'], shared)
+        return codes
+
+    step('connect', connect)
+    step('spam_matcher', get_matcher)
+    step('templates', landing_page_version)
+    codes = step('redirects', load_codes)
+    report['complete'] = codes is not None and not deadline.expired
+    report['seconds'] = round(deadline.elapsed(), 4)
+    logger.info(
+        "Warm-up loaded %d redirects and opened %d connections in %.3fs%s",
+        report['entries'], report['connections'], report['seconds'],
+        '' if report['complete'] else ' (time budget exhausted)',
+    )
+    last_report = report
+    return report
+
+
+def warm_up_worker():
+    """Entry point for wsgi.py and asgi.py; never lets a failure stop the worker booting."""
+    if not get_config()['ENABLED']:
+        return None
+    try:
+        return warm_up()
+    except Exception:
+        logger.exception("Worker warm-up failed")
+        return None
@@ -0,0 +1,155 @@
+import asyncio
+import atexit
+import contextvars
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WRITE_QUEUE = {
+    'ENABLED': False,
+    'MAX_BATCH': 100,     # calls committed together in one transaction
+    'MAX_DELAY': 0.0,     # seconds to wait for more calls once one is queued
+    'TIMEOUT': 30,        # seconds a caller waits for its result
+}
+
+_STOP = object()
+
+
+class WriteQueue:
+    """
+    Runs database writes on a single writer thread, several per transaction.
+
+    SQLite allows one writer at a time, so concurrent requests that each open
+    a write transaction mostly wait on each other's locks. Funnelling them
+    through one thread removes that contention, and committing everything
+    queued so far in one transaction pays for one commit instead of many.
+    Each call runs in its own savepoint so one failure does not affect the
+    others. While no writer thread is running (tests, management commands),
+    calls simply run inline.
+    """
+
+    def __init__(self, config=None):
+        self.config = dict(DEFAULT_WRITE_QUEUE, **(config or {}))
+        self._queue = queue.Queue()
+        self._thread = None
+        self.calls = 0
+        self.batches = 0
+        self.failed_batches = 0
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) and return a Future for its result."""
+        future = Future()
+        # Run in the caller's context so per-request state (e.g. db routing) applies
+        self._queue.put((contextvars.copy_context(), func, args, kwargs, future))
+        return future
+
+    def call(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) on the writer thread and return its result."""
+        if self._thread is None:
+            return func(*args, **kwargs)
+        return self.submit(func, *args, **kwargs).result(self.config['TIMEOUT'])
+
+    async def acall(self, func, *args, **kwargs):
+        """Async version of call()."""
+        if self._thread is None:
+            return await sync_to_async(func)(*args, **kwargs)
+        future = asyncio.wrap_future(self.submit(func, *args, **kwargs))
+        return await asyncio.wait_for(future, self.config['TIMEOUT'])
+
+    def _take_batch(self):
+        """Block for the first call, then take whatever else is queued."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.config['MAX_DELAY']
+        while batch[-1] is not _STOP and len(batch) < self.config['MAX_BATCH']:
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run_batch(self, batch):
+        """Run (context, func, args, kwargs, future) items in one transaction."""
+        from .codegen import get_code_generator
+
+        # Reserve short codes before the transaction opens, so that a batch
+        # that fails to commit cannot roll back a block still in use
+        get_code_generator().prefetch(len(batch))
+        outcomes = []
+        try:
+            with transaction.atomic():
+                for context, func, args, kwargs, future in batch:
+                    try:
+                        with transaction.atomic():
+                            outcomes.append((future, context.run(func, *args, **kwargs), None))
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+        except Exception as e:
+            # The commit failed, so none of the results stand
+            self.failed_batches += 1
+            logger.exception("Failed to commit a batch of %d writes", len(batch))
+            for item in batch:
+                item[-1].set_exception(e)
+            return
+        self.batches += 1
+        self.calls += len(batch)
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            stopping = batch[-1] is _STOP
+            if stopping:
+                batch.pop()
+            if batch:
+                close_old_connections()
+                self.run_batch(batch)
+            if stopping:
+                break
+        connection.close()
+
+    def start(self):
+        """Start the writer thread (once per process)."""
+        if self._thread is not None or not self.config['ENABLED']:
+            return
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=10):
+        """Finish the queued writes and stop the writer thread."""
+        if self._thread is None:
+            return
+        thread, self._thread = self._thread, None
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def stats(self):
+        return {
+            'pending': self._queue.qsize(),
+            'calls': self.calls,
+            'batches': self.batches,
+            'failed_batches': self.failed_batches,
+        }
+
+
+write_queue = WriteQueue(getattr(settings, 'SHORTENER_WRITE_QUEUE', None))
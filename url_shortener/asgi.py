@@ -14,3 +14,28 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'url_shortener.settings')
 
 application = get_asgi_application()
+
+# Start the background flush of buffered click counts in this worker, the
+# build of the Bloom filter that turns away unknown short codes, and the
+# single-writer queue used on SQLite
+from shortener.bloom import code_filter  # noqa: E402
+from shortener.clicks import click_tracker  # noqa: E402
+from shortener.writequeue import write_queue  # noqa: E402
+
+click_tracker.start()
+code_filter.start()
+write_queue.start()
+
+# Connect to the database and preload popular redirects before this worker
+# takes traffic (gunicorn imports this module in each worker after forking)
+from shortener.warmup import warm_up_worker  # noqa: E402
+
+warm_up_worker()
+
+# Serve cached redirects before the request reaches Django's middleware
+from django.conf import settings  # noqa: E402
+
+if getattr(settings, 'SHORTENER_FAST_PATH', False):
+    from shortener.fastpath import FastRedirectASGI  # noqa: E402
+
+    application = FastRedirectASGI(application)
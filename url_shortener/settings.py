@@ -58,6 +58,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shortener.middleware.MetricsMiddleware',
+    'shortener.db_router.ReplicaStickinessMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -102,12 +104,323 @@ DATABASES = {
 # Configure database for Heroku
 # This will use the DATABASE_URL environment variable if available
 # Otherwise, it will fall back to the SQLite database
+# DATABASE_POOL=True uses psycopg's connection pool on PostgreSQL instead of
+# persistent connections (Django does not allow both)
+DATABASE_POOL = os.environ.get('DATABASE_POOL', 'False') == 'True'
+CONN_MAX_AGE = 0 if DATABASE_POOL else 600
+
 if 'DATABASE_URL' in os.environ:
     DATABASES['default'] = dj_database_url.config(
-        conn_max_age=600,
+        conn_max_age=CONN_MAX_AGE,
         ssl_require=True
     )
 
+# Read replicas, as a comma-separated list of database URLs. Reads go to a
+# replica and writes to the primary (see shortener/db_router.py). Two SQLite
+# files work as local stand-ins, e.g.
+# DATABASE_REPLICA_URLS=sqlite:///db.sqlite3 with the default database.
+DATABASE_REPLICAS = []
+for index, url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(','))):
+    alias = f'replica{index + 1}'
+    DATABASES[alias] = dj_database_url.parse(
+        url.strip(),
+        conn_max_age=CONN_MAX_AGE,
+        ssl_require=not url.strip().startswith('sqlite'),
+    )
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+if DATABASE_POOL:
+    for database in DATABASES.values():
+        if database['ENGINE'] == 'django.db.backends.postgresql':
+            database.setdefault('OPTIONS', {})['pool'] = {
+                'min_size': int(os.environ.get('DATABASE_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('DATABASE_POOL_MAX_SIZE', 10)),
+                'timeout': 10,
+            }
+
+# Tuned SQLite: WAL lets readers run alongside the writer, synchronous=NORMAL
+# only syncs at checkpoints, and IMMEDIATE transactions take the write lock
+# up front so concurrent writers wait (busy_timeout) instead of failing with
+# "database is locked". Set SQLITE_TUNED=False for Django's defaults.
+SQLITE_TUNED = os.environ.get('SQLITE_TUNED', 'True') == 'True'
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA cache_size=-65536',       # 64 MB
+    'PRAGMA mmap_size=268435456',     # 256 MB
+    'PRAGMA temp_store=MEMORY',
+]
+
+if SQLITE_TUNED:
+    for database in DATABASES.values():
+        if database['ENGINE'] == 'django.db.backends.sqlite3':
+            database.setdefault('OPTIONS', {}).update({
+                'init_command': '; '.join(SQLITE_PRAGMAS),
+                'transaction_mode': 'IMMEDIATE',
+            })
+
+# WRITE_QUEUE=True runs creates on one writer thread per process, several per
+# transaction (see shortener/writequeue.py). It pays off where commits are
+# expensive (slow disks, synchronous=FULL); with WAL and synchronous=NORMAL
+# the hand-off to the writer thread costs about as much as it saves.
+SHORTENER_WRITE_QUEUE = {
+    'ENABLED': (
+        os.environ.get('WRITE_QUEUE', 'False') == 'True'
+        and DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3'
+    ),
+    'MAX_BATCH': 100,
+}
+
+DATABASE_ROUTERS = ['shortener.db_router.PrimaryReplicaRouter']
+
+# Writes from a client pin its reads to the primary for STICKY_SECONDS
+SHORTENER_DATABASE_ROUTING = {
+    'REPLICAS': DATABASE_REPLICAS,
+    'STICKY_SECONDS': 10,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# The local-memory cache is per process; set REDIS_URL to share the redirect
+# cache between gunicorn workers and dynos.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+if 'REDIS_URL' in os.environ:
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+
+# Redirect lookup cache (see shortener/cache.py)
+SHORTENER_REDIRECT_CACHE = {
+    'MAX_ENTRIES': int(os.environ.get('REDIRECT_CACHE_MAX_ENTRIES', 10000)),
+    'TTL': 300,
+    'NEGATIVE_TTL': 30,
+    'CACHE_ALIAS': 'default',
+    'SHARED_TTL': 86400,
+}
+
+# Concurrent misses for one short code share a single lookup per worker (see
+# shortener/singleflight.py). SHARED_LOCK extends that across workers with a
+# lock in the shared cache; it only pays off with a shared cache such as Redis.
+SHORTENER_SINGLE_FLIGHT = {
+    'ENABLED': True,
+    'SHARED_LOCK': os.environ.get('SINGLE_FLIGHT_SHARED_LOCK', 'False') == 'True',
+    'LOCK_TIMEOUT': 5,
+    'WAIT_TIMEOUT': 0.5,
+}
+
+
+# Short code generation (see shortener/codegen.py)
+# Each worker reserves BLOCK_SIZE sequence values per database round trip.
+# SHORTENER_CODE_KEY keys the code permutation and must never change once
+# codes have been issued; it defaults to SECRET_KEY.
+#
+# With NODE_ID set (one distinct value per region or node), codes get a
+# one-character node prefix and each node allocates from its own sequence,
+# so nodes never coordinate on code allocation.
+SHORTENER_CODE_GENERATOR = {
+    'BACKEND': 'shortener.codegen.SequenceCodeGenerator',
+    'OPTIONS': {
+        'length': 6,
+        'block_size': 100,
+    },
+}
+if os.environ.get('NODE_ID'):
+    SHORTENER_CODE_GENERATOR = {
+        'BACKEND': 'shortener.codegen.NodeSequenceCodeGenerator',
+        'OPTIONS': {
+            'node_id': int(os.environ['NODE_ID']),
+            'prefix_length': 1,
+            'length': 6,
+            'block_size': 100,
+        },
+    }
+SHORTENER_CODE_KEY = os.environ.get('SHORTENER_CODE_KEY')
+
+
+# Rate limiting (see shortener/ratelimit.py)
+# Each policy is a list of rules; a request must pass all of them. Rules
+# count per client IP ('ip') or per network ('subnet', using ipv4_prefix /
+# ipv6_prefix) with the 'sliding_window' or 'token_bucket' algorithm.
+SHORTENER_RATE_LIMITS = {
+    'BACKEND': 'cache',
+    'CACHE_ALIAS': 'default',
+    'POLICIES': {
+        'create': [
+            {'scope': 'ip', 'algorithm': 'sliding_window', 'limit': 10, 'window': 600},
+            {'scope': 'subnet', 'algorithm': 'token_bucket', 'limit': 100, 'window': 600,
+             'ipv4_prefix': 24, 'ipv6_prefix': 64},
+        ],
+        # The bulk API charges one unit per URL, so these limits must stay
+        # above SHORTENER_BULK['MAX_URLS'] for a full batch to be accepted.
+        'bulk': [
+            {'scope': 'ip', 'algorithm': 'sliding_window', 'limit': 2000, 'window': 3600},
+            {'scope': 'subnet', 'algorithm': 'token_bucket', 'limit': 10000, 'window': 3600,
+             'ipv4_prefix': 24, 'ipv6_prefix': 64},
+        ],
+    },
+}
+
+# Bulk shortening API (POST /api/bulk, see shortener.views.bulk_shorten)
+SHORTENER_BULK = {
+    'MAX_URLS': 1000,
+    'CHUNK_SIZE': 200,
+}
+
+
+# Spam detection (see shortener/spam_detection.py)
+# KEYWORD_FILES and DOMAIN_FILES are text files with one entry per line; they
+# are compiled together with the lists below into a single matcher.
+SHORTENER_SPAM = {
+    'KEYWORD_FILES': [],
+    'DOMAIN_FILES': [],
+}
+
+
+# Click tracking (see shortener/clicks.py)
+# Redirects are counted in memory and flushed to ClickCount in batches by a
+# background thread started from wsgi.py / asgi.py.
+SHORTENER_CLICK_TRACKING = {
+    'ENABLED': os.environ.get('CLICK_TRACKING', 'True') == 'True',
+    'BUCKET_SECONDS': 3600,
+    'MAX_PENDING': 50000,
+    'FLUSH_INTERVAL': 5.0,
+    'COUNTRY_HEADER': 'HTTP_CF_IPCOUNTRY',
+}
+
+
+# Serve the landing page and redirects with async views. Enable this with the
+# ASGI profile (Procfile.asgi), where they run on the event loop.
+SHORTENER_ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False') == 'True'
+
+
+# Answer cached /<short_code> redirects in wsgi.py / asgi.py, in front of the
+# middleware stack (see shortener/fastpath.py)
+SHORTENER_FAST_PATH = os.environ.get('FAST_PATH', 'True') == 'True'
+
+
+# Request metrics (see shortener/metrics.py), served at /_/metrics
+# SAMPLE_RATE is the fraction of requests timed by MetricsMiddleware; set
+# METRICS_TOKEN to require 'Authorization: Bearer <token>' on the endpoint.
+SHORTENER_METRICS = {
+    'ENABLED': os.environ.get('METRICS', 'True') == 'True',
+    'SAMPLE_RATE': float(os.environ.get('METRICS_SAMPLE_RATE', 0.01)),
+    'TOKEN': os.environ.get('METRICS_TOKEN'),
+}
+
+
+# Read-only redirect snapshot written by `manage.py export_snapshot`. With
+# SNAPSHOT_FALLBACK_TO_DATABASE=False, redirects make no database queries.
+# An edge node with no database reachable must also set CLICK_TRACKING=False
+# (clicks are flushed to the database) and WARMUP=False (warm-up connects to
+# every database); everything other than redirects still needs a database.
+SHORTENER_SNAPSHOT = {
+    'PATH': os.environ.get('SNAPSHOT_PATH'),
+    'DELTA_DIR': os.environ.get('SNAPSHOT_DELTA_DIR'),
+    'REFRESH_INTERVAL': 60,
+    'FALLBACK_TO_DATABASE': os.environ.get('SNAPSHOT_FALLBACK_TO_DATABASE', 'True') == 'True',
+    'DELTA_OVERLAP': 300,
+}
+
+
+# Bloom filter over existing short codes (see shortener/bloom.py): requests
+# for codes it rules out 404 without a database query. Built in the
+# background by each worker; ~3.6 MB per million codes at the defaults.
+# Unless BLOOM_FILTER is set, it only runs with a shared redirect cache
+# (REDIS_URL): new codes reach other workers through that cache.
+SHORTENER_BLOOM_FILTER = {
+    'ENABLED': {'True': True, 'False': False}.get(os.environ.get('BLOOM_FILTER')),
+    'ERROR_RATE': 0.001,
+    'REFRESH_INTERVAL': 5,
+    'REBUILD_INTERVAL': 3600,
+}
+
+
+# HTTP caching of redirects (see shortener/httpcache.py). A CDN or reverse
+# proxy honouring s-maxage serves repeat redirects without reaching gunicorn;
+# those clicks are then not counted. Set REDIRECT_MAX_AGE to None to send no
+# Cache-Control header at all.
+SHORTENER_HTTP_CACHE = {
+    'REDIRECT_MAX_AGE': int(os.environ.get('REDIRECT_MAX_AGE', 3600)),
+    'REDIRECT_S_MAXAGE': int(os.environ.get('REDIRECT_S_MAXAGE', 86400)),
+    'REDIRECT_IMMUTABLE': True,
+    'REDIRECT_ETAG': True,
+    'LANDING_PAGE_ETAG': True,
+}
+
+
+# Serve the landing page's plain GETs from a per-worker pre-rendered copy
+# (ignored with DEBUG on). Messages live in a cookie so that GETs with none
+# pending never load the session.
+SHORTENER_PRERENDER_LANDING_PAGE = os.environ.get('PRERENDER_LANDING_PAGE', 'True') == 'True'
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+
+# Link expiry and archival, applied by `manage.py purge_urls` (see
+# shortener/retention.py). With ARCHIVE_AFTER_MONTHS set, links are moved to
+# ArchivedURL once that many months old and redirects look there as well.
+SHORTENER_RETENTION = {
+    'ARCHIVE_EXPIRED': os.environ.get('ARCHIVE_EXPIRED', 'False') == 'True',
+    'ARCHIVE_AFTER_MONTHS': int(os.environ['ARCHIVE_AFTER_MONTHS']) if os.environ.get('ARCHIVE_AFTER_MONTHS') else None,
+    'BATCH_SIZE': 1000,
+    'BATCH_PAUSE': 0.1,
+}
+
+
+# Deferred reputation checks (see shortener/reputation.py). When enabled, new
+# links start out pending and `manage.py check_pending_urls --loop` must run
+# alongside the web workers to activate or disable them. BLOCKLIST_FEED_URL
+# adds an external domain blocklist to the DNS and redirect-chain checks.
+SHORTENER_REPUTATION = {
+    'ENABLED': os.environ.get('REPUTATION_CHECKS', 'False') == 'True',
+    'SOURCES': [
+        {'BACKEND': 'shortener.reputation.DNSSource'},
+        {'BACKEND': 'shortener.reputation.RedirectChainSource', 'OPTIONS': {'max_redirects': 5, 'timeout': 5}},
+    ] + ([
+        {'BACKEND': 'shortener.reputation.BlocklistFeedSource', 'OPTIONS': {'url': os.environ['BLOCKLIST_FEED_URL']}},
+    ] if os.environ.get('BLOCKLIST_FEED_URL') else []),
+    'WORKERS': 16,
+    'PENDING_CACHE_TTL': 60,
+}
+
+
+# Warm-up run by each web worker before it takes traffic (see
+# shortener/warmup.py): connect to the databases, build the spam matcher and
+# preload the most clicked and most recent links, within TIME_BUDGET seconds.
+SHORTENER_WARMUP = {
+    'ENABLED': os.environ.get('WARMUP', 'True') == 'True',
+    'TIME_BUDGET': float(os.environ.get('WARMUP_TIME_BUDGET', 5)),
+    'TOP_CLICKED': 2000,
+    'RECENT': 1000,
+}
+
+
+# Offline analytics (see shortener/analytics.py): `manage.py analytics` writes
+# summaries here and the staff dashboard at /_/analytics serves them.
+SHORTENER_ANALYTICS = {
+    'OUTPUT_DIR': os.environ.get('ANALYTICS_DIR', str(BASE_DIR / 'analytics')),
+    'BUCKET_SECONDS': 86400,
+    'TOP': 50,
+}
+
+
+# Admin search (see shortener/search.py): without PostgreSQL's trigram index,
+# substring searches only scan the newest SUBSTRING_SCAN_LIMIT links, and
+# filtered changelists stop counting at COUNT_LIMIT.
+SHORTENER_ADMIN_SEARCH = {
+    'SUBSTRING_SCAN_LIMIT': int(os.environ.get('ADMIN_SEARCH_SCAN_LIMIT', 100000)),
+    'COUNT_LIMIT': 10000,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators